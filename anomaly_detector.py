@@ -1,55 +1,342 @@
-import pandas as pd
-from sklearn.ensemble import IsolationForest
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 
+import numpy as np
 
-def detect_anomalies(log_dict: dict, threshold: float = 0.0) -> tuple[set, dict]:
+from ip_counters import IpCounters
+import metrics
+
+# scikit-learn takes most of a second to import, so it is only imported inside the
+# functions that fit, load or run a model - never by the rule-only mode or --help
+
+
+# Bump when the saved model layout changes; older files are refused rather than misread
+MODEL_VERSION = 2
+
+# IPs scored per decision_function call, so huge IP sets don't build one giant batch
+SCORE_BATCH_SIZE = 100_000
+
+# Busy days have millions of IPs; the forest only ever looks at 256 rows per tree, so
+# fitting on a fixed random sample costs the same at 10k or 5M IPs
+TRAIN_SAMPLE_SIZE = 200_000
+
+# Feature chunks queued per scoring worker - bounds how much of the matrix is copied
+# into the pool at once
+CHUNKS_IN_FLIGHT = 2
+
+# Resident memory of a scoring worker before its first batch: a forked interpreter with
+# NumPy and scikit-learn loaded (about 100 MB on Linux). score_features counts it, and a
+# copy of the forest, for every worker it starts under a memory cap
+WORKER_MEMORY_MB = 100
+
+# The least a memory cap has to leave beyond the scores for the batches and scikit-learn
+MIN_SCORING_MB = 1
+
+# Scores below this are flagged. Tuned on the labelled dataset with the default detailed
+# parse (tune_threshold.py): benign IPs score above -0.07 and attacks below -0.13 across
+# seeds, where -0.05 flagged a busy benign IP with some seeds
+ANOMALY_THRESHOLD = -0.10
+
+BASE_FEATURES = ["total_requests", "error_rate", "unique_path_count"]
+WINDOW_FEATURES = ["peak_window_requests", "peak_window_errors"]
+
+
+class SavedModel:
+    """
+    An Isolation Forest trained by train_model() and saved to disk.
+
+    The file is only unpickled the first time the model is needed, so runs that never
+    get as far as scoring (an empty log, --follow before the first refresh) don't pay
+    for it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._saved = None
+
+    @property
+    def feature_names(self) -> list[str]:
+        return self._load()["feature_names"]
+
+    @property
+    def model(self) -> "IsolationForest":
+        return self._load()["model"]
+
+    def _load(self):
+        if self._saved is None:
+            import sklearn
+
+            with open(self.path, "rb") as model_file:
+                saved = pickle.load(model_file)
+
+            if not isinstance(saved, dict) or saved.get("version") != MODEL_VERSION:
+                raise ValueError(f"'{self.path}' is not a model saved by this version of the analyser - retrain it with --train-model")
+            if saved.get("sklearn_version") != sklearn.__version__:
+                print(f"[!] Model was trained with scikit-learn {saved.get('sklearn_version')}, running {sklearn.__version__}")
+            self._saved = saved
+
+        return self._saved
+
+
+def build_features(log_dict: dict) -> tuple[list[str], np.ndarray, list[str]]:
+    """
+    Turns the parsed per-IP data into a float32 feature matrix, one row per IP.
+
+    The matrix is filled with np.fromiter in a single pass over the per-IP entries - no
+    per-IP dicts and no DataFrame - so memory is one contiguous n x features array, and
+    a spilled state_store.StateStore is read from disk only once.
+    Returns (ips, features, feature_names); row i of `features` belongs to ips[i].
+
+    An ip_counters.IpCounters already holds the counts as columns, which are read as
+    numpy views rather than entry by entry.
+    """
+    if isinstance(log_dict, IpCounters):
+        ips = list(log_dict)
+        totals, errors = log_dict.arrays()
+        features = np.zeros((len(ips), len(BASE_FEATURES)), dtype=np.float32)
+        features[:, 0] = totals
+        np.divide(errors, totals, out=features[:, 1], where=totals > 0, casting="unsafe")
+        return ips, features, list(BASE_FEATURES)
+
+    count = len(log_dict)
+    items = iter(log_dict.items())
+    first = next(items, None)
+
+    # Window peaks need a detailed parse (every entry is parsed the same way)
+    feature_names = list(BASE_FEATURES)
+    if first is not None and "window" in first[1]:
+        feature_names += WINDOW_FEATURES
+
+    ips = []
+    rows = _feature_rows(chain([first], items) if first is not None else (), ips, len(feature_names) > len(BASE_FEATURES))
+    features = np.fromiter(chain.from_iterable(rows), dtype=np.float32,
+                           count=count * len(feature_names)).reshape(count, len(feature_names))
+
+    # Column 1 holds the error count until it is turned into a rate
+    totals = features[:, 0]
+    np.divide(features[:, 1], totals, out=features[:, 1], where=totals > 0)
+    features[totals <= 0, 1] = 0.0
+
+    return ips, features, feature_names
+
+
+def _feature_rows(items, ips, windows):
+    """One (total, errors, paths[, peak requests, peak errors]) tuple per entry, collecting the IPs in `ips` on the way."""
+    for ip, data in items:
+        ips.append(ip)
+        # Either an exact array of path ids or a HyperLogLog sketch - len() gives the
+        # (estimated) count for both
+        if windows:
+            # Busiest WINDOW_SECONDS for this IP, so a burst stands out from the same
+            # number of requests spread over a day
+            window = data["window"]
+            yield data["total"], data["errors"], len(data.get("paths", ())), window.peak_requests, window.peak_errors
+        else:
+            yield data["total"], data["errors"], len(data.get("paths", ()))
+
+
+def fit_forest(features: np.ndarray, jobs: int = 1, seed: int = 42) -> "IsolationForest":
+    """Fits an Isolation Forest on (at most TRAIN_SAMPLE_SIZE rows of) `features`, building trees on `jobs` cores."""
+    from sklearn.ensemble import IsolationForest
+
+    if len(features) > TRAIN_SAMPLE_SIZE:
+        rows = np.random.default_rng(seed).choice(len(features), TRAIN_SAMPLE_SIZE, replace=False)
+        features = features[np.sort(rows)]
+
+    # 'contamination' is the expected proportion of outliers in the data
+    return IsolationForest(contamination="auto", random_state=seed, n_jobs=jobs).fit(features)
+
+
+def score_features(forest: "IsolationForest", features: np.ndarray, batch_size: int = SCORE_BATCH_SIZE,
+                   jobs: int = 1, memory_mb: float | None = None, return_jobs: bool = False):
+    """
+    Returns forest.decision_function(features), computed `batch_size` rows at a time.
+
+    With jobs > 1 the batches are scored by a process pool, with at most
+    CHUNKS_IN_FLIGHT batches per worker queued at once. `memory_mb` caps what scoring
+    adds to this process: the scores, the queued batches and scikit-learn's working
+    memory, plus WORKER_MEMORY_MB and a copy of the forest for every worker. Workers
+    that don't fit are dropped (down to scoring in this process), the batches are
+    shrunk to what is left, and a ValueError is raised if not even the scores fit.
+    The feature matrix already exists and isn't counted.
+
+    With `return_jobs`, returns (scores, processes used) - 1 when no pool was started.
+    """
+    import sklearn
+
+    jobs, batch_size, working_memory = _fit_scoring_memory(forest, features, max(1, jobs), batch_size, memory_mb)
+    batches = [(start, min(start + batch_size, len(features))) for start in range(0, len(features), batch_size)]
+    scores = np.empty(len(features), dtype=np.float64)
+
+    # A pool only pays for itself with more than one batch to share out
+    if jobs == 1 or len(batches) == 1:
+        with sklearn.config_context(working_memory=working_memory or sklearn.get_config()["working_memory"]):
+            for start, end in batches:
+                scores[start:end] = forest.decision_function(features[start:end])
+        return (scores, 1) if return_jobs else scores
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_scoring_worker,
+                             initargs=(forest, working_memory)) as pool:
+        pending = {}
+        for start, end in batches:
+            # Wait for a slot before copying the next batch into the pool
+            while len(pending) >= jobs * CHUNKS_IN_FLIGHT:
+                _collect_oldest(pending, scores)
+            pending[pool.submit(_score_batch, features[start:end])] = start
+        while pending:
+            _collect_oldest(pending, scores)
+
+    return (scores, jobs) if return_jobs else scores
+
+
+def _fit_scoring_memory(forest, features, jobs, batch_size, memory_mb):
+    """(jobs, batch size, scikit-learn working memory in MB) that keep score_features within `memory_mb`."""
+    if not memory_mb:
+        return jobs, batch_size, None
+
+    scores_mb = len(features) * 8 / 2**20
+    available = memory_mb - scores_mb
+    if available < MIN_SCORING_MB:
+        raise ValueError(f"a scoring memory cap of {memory_mb:g} MB is too small for {len(features):,} IPs "
+                         f"(their scores take {scores_mb:.1f} MB - allow at least {scores_mb + MIN_SCORING_MB:.0f} MB)")
+
+    if jobs > 1:
+        # The workers may take half of what is left; the batches and working memory get the rest.
+        # The forest is only pickled (to size it) if two bare workers would fit
+        fitting = 0
+        if available / 2 >= 2 * WORKER_MEMORY_MB:
+            worker_mb = WORKER_MEMORY_MB + len(pickle.dumps(forest, pickle.HIGHEST_PROTOCOL)) / 2**20
+            fitting = min(jobs, int(available / 2 // worker_mb))
+        if fitting < 2:
+            print(f"[*] Scoring in this process: a scoring pool doesn't fit in {memory_mb:g} MB")
+            jobs = 1
+        else:
+            if fitting < jobs:
+                print(f"[*] Scoring with {fitting} processes instead of {jobs} to stay within {memory_mb:g} MB")
+            jobs = fitting
+            available -= jobs * worker_mb
+
+    row_bytes = features.itemsize * features.shape[1] + 8  # The row and its float64 score
+    batch_size = max(1, min(batch_size, int(available * 2**20 / 2 / (jobs * CHUNKS_IN_FLIGHT * row_bytes))))
+    return jobs, batch_size, available / 2 / jobs
+
+
+_WORKER_FOREST = None
+
+
+def _init_scoring_worker(forest, working_memory):
+    """Receives the forest once per worker instead of once per batch"""
+    global _WORKER_FOREST
+    _WORKER_FOREST = forest
+    if working_memory:
+        import sklearn
+        sklearn.set_config(working_memory=working_memory)
+
+
+def _score_batch(features):
+    return _WORKER_FOREST.decision_function(features)
+
+
+def _collect_oldest(pending, scores):
+    future = next(iter(pending))
+    start = pending.pop(future)
+    batch_scores = future.result()
+    scores[start:start + len(batch_scores)] = batch_scores
+
+
+def train_model(log_dict: dict, model_path, jobs: int = 1) -> list[str]:
+    """
+    Fits an Isolation Forest on a baseline log and saves it, with its feature schema,
+    to `model_path`. Returns the feature names it was trained on.
+    """
+    import sklearn
+
+    ips, features, feature_names = build_features(log_dict)
+    model = fit_forest(features, jobs)
+
+    saved = {
+        "version": MODEL_VERSION,
+        "sklearn_version": sklearn.__version__,
+        "feature_names": feature_names,
+        "trained_on": len(ips),
+        "model": model,
+    }
+
+    # Never leave a half-written model behind
+    temp_path = f"{model_path}.tmp"
+    with open(temp_path, "wb") as model_file:
+        pickle.dump(saved, model_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, model_path)
+
+    print(f"[*] Model trained on {len(ips)} IPs ({', '.join(feature_names)}) and saved to {model_path}")
+    return feature_names
+
+
+def detect_anomalies(log_dict: dict, threshold: float = 0.0, model: SavedModel | None = None,
+                     batch_size: int = SCORE_BATCH_SIZE, return_arrays: bool = False, jobs: int = 1,
+                     memory_mb: float | None = None, seed: int = 42):
     """
     Analyses log data to ID anomalous IPs using an Isolation Forest model
 
     Args:
         log_dict (dict): Dictionary of log data
         threshold (float, optional): Threshold for anomaly detection. Defaults to 0.0.
-        any threshold value below 0 should be considered suspicious.
+        any threshold value below 0 should be considered suspicious. The analyser
+        passes ANOMALY_THRESHOLD, tuned for its default detailed features.
+        model (SavedModel, optional): A model from --train-model. When given it is only
+        used for scoring, so scores are comparable between runs; otherwise a new model
+        is fitted on this log.
+        batch_size (int, optional): IPs scored per decision_function call.
+        return_arrays (bool, optional): Return (ips, scores, is_anomaly) - a list and two
+        NumPy arrays in the same order - instead of building a set and a dict per IP.
+        jobs (int, optional): Cores used to build the trees and processes used to score
+        (high-cardinality mode, see score_features).
+        memory_mb (float, optional): Cap on the memory scoring adds (see score_features).
+        seed (int, optional): Random state of a newly fitted model (ignored with `model`).
 
+    Returns:
+        (anomalous_ips, score_dict), or (ips, scores, is_anomaly) with `return_arrays`.
     """
 
     if not log_dict:
         return set()
 
     # 1. Feature Engineering
-    records = []  # Convert the dictionary to a list
-    for ip, data in log_dict.items():
-        error_rate = (data["errors"] / data["total"]) if data["total"] > 0 else 0
-
-        # Get the number of unique paths requested
-        # The data must be modified for the parser first
-        unique_paths = data.get("paths", set())
-
-        records.append({
-            "ip_address": ip,
-            "total_requests": data["total"],
-            "error_rate": error_rate,
-            "unique_path_count": len(unique_paths)
-        })
-
-    df = pd.DataFrame(records)
-
-    # Select the features for the model
-    features = df[["total_requests", "error_rate", "unique_path_count"]]
+    ips, features, feature_names = build_features(log_dict)
 
     # 2. Model training & prediction
-    # Initialise the Isolation Forest model
-    # 'contamination' is the expected proportion of outliers in the data
-    model = IsolationForest(contamination="auto", random_state=42).fit(features)
+    if model is None:
+        # Fit on (a bounded sample of) this log
+        forest = fit_forest(features, jobs, seed)
+    else:
+        missing = [name for name in model.feature_names if name not in feature_names]
+        if missing:
+            raise ValueError(f"The model needs features this parse doesn't have: {', '.join(missing)}")
+        features = features[:, [feature_names.index(name) for name in model.feature_names]]
+        forest = model.model
 
-    # Train the model and generate predictions
-    df["anomaly_score"] = model.decision_function(features)
+    # Score in batches
+    scores, pool_jobs = score_features(forest, features, batch_size, jobs, memory_mb, return_jobs=True)
+    is_anomaly = scores < threshold
+
+    print(f"[*] Anomaly detection complete.\nFound {int(is_anomaly.sum())} anomalous IP addresses")
+    if jobs > 1 or memory_mb:
+        peak = metrics.peak_memory_mb()
+        if peak["process"] is not None:
+            # The children's figure covers every finished child (the --workers parse pool too), so
+            # it is only shown when scoring started processes of its own
+            workers = f" (peak of child processes: {peak['workers']:.0f} MB)" if pool_jobs > 1 else ""
+            print(f"[*] Peak memory: {peak['process']:.0f} MB{workers}")
 
     # 3. Return the results
-    anomalous_ips = set(df[df["anomaly_score"] < threshold]["ip_address"])
+    if return_arrays:
+        return ips, scores, is_anomaly
+
+    anomalous_ips = {ips[index] for index in np.flatnonzero(is_anomaly)}
 
     # `zip()` pairs each IP with its score. `dict()` converts those pairs into a dictionary.
-    score_dict = dict(zip(df["ip_address"], df["anomaly_score"]))
+    score_dict = dict(zip(ips, scores.tolist()))
 
-    print(f"[*] Anomaly detection complete.\nFound {len(anomalous_ips)} anomalous IP addresses")
-    return (anomalous_ips, score_dict)
\ No newline at end of file
+    return (anomalous_ips, score_dict)
@@ -0,0 +1,61 @@
+import ipaddress
+import random
+import time
+
+from cidr_index import CidrIndex
+
+
+# --- CONFIGURATION ---
+PREFIX_COUNT = 100_000   # Roughly the size of a large daily blocklist
+LOOKUP_COUNT = 2_000_000
+IPV6_LOOKUP_COUNT = 100_000
+
+
+def random_prefixes(count, rng):
+    """Random IPv4 and IPv6 prefixes, some nested inside others."""
+    prefixes = []
+    for index in range(count):
+        if index % 10 == 0:
+            network = ipaddress.IPv6Network((rng.getrandbits(128), rng.choice([32, 48, 64])), strict=False)
+        else:
+            network = ipaddress.IPv4Network((rng.getrandbits(32), rng.choice([16, 20, 24, 28, 32])), strict=False)
+        prefixes.append((network, f"list-{index % 5}"))
+    return prefixes
+
+
+def main():
+    rng = random.Random(42)
+
+    print(f"[*] Building index from {PREFIX_COUNT:,} prefixes...")
+    start_time = time.perf_counter()
+    prefixes = random_prefixes(PREFIX_COUNT, rng)
+    index = CidrIndex(prefixes)
+    build_time = time.perf_counter() - start_time
+
+    ipv4_addresses = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(LOOKUP_COUNT)]
+    # Random 128-bit addresses almost never hit a prefix, so half are drawn from inside the listed ones
+    ipv6_networks = [network for network, _ in prefixes if network.version == 6]
+    ipv6_addresses = [str(ipaddress.IPv6Address(rng.getrandbits(128))) for _ in range(IPV6_LOOKUP_COUNT // 2)]
+    for _ in range(IPV6_LOOKUP_COUNT - len(ipv6_addresses)):
+        network = rng.choice(ipv6_networks)
+        ipv6_addresses.append(str(network.network_address + rng.randrange(network.num_addresses)))
+
+    print(f"[*] Looking up {LOOKUP_COUNT:,} IPv4 and {IPV6_LOOKUP_COUNT:,} IPv6 addresses...\n")
+    start_time = time.perf_counter()
+    ipv4_matches = sum(label is not None for label in index.lookup_many(ipv4_addresses))
+    ipv4_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    ipv6_matches = sum(label is not None for label in index.lookup_many(ipv6_addresses))
+    ipv6_time = time.perf_counter() - start_time
+
+    print("CIDR INDEX PERFORMANCE")
+    print("=" * 50)
+    print(f"Index build time: {build_time:.2f} seconds ({len(index):,} disjoint intervals)")
+    print(f"IPv4: {LOOKUP_COUNT / ipv4_time:,.0f} lookups/second ({ipv4_matches:,} matched)")
+    print(f"IPv6: {IPV6_LOOKUP_COUNT / ipv6_time:,.0f} lookups/second ({ipv6_matches:,} matched)")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
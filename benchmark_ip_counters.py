@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from file_parser import BLOCK_SIZE
+
+
+# --- CONFIGURATION ---
+FLOOD_LINES = 600_000
+FLOOD_IPS = 1_000_000   # IPs are drawn from this many, so nearly every line is a new one
+RETAINED_LINES = 100_000
+
+BENCHMARK = os.path.abspath(__file__)
+
+
+def write_flood_log(path, lines=FLOOD_LINES, ip_count=FLOOD_IPS, seed=42):
+    """A high-cardinality flood: one line per request from random IPv4 and some IPv6 clients."""
+    rng = random.Random(seed)
+    with open(path, "w") as log_file:
+        buffer = []
+        for index in range(lines):
+            ip_index = rng.randrange(ip_count)
+            if ip_index % 20 == 0:
+                ip = f"2001:db8::{ip_index:x}"
+            else:
+                ip = f"10.{ip_index >> 16 & 255}.{ip_index >> 8 & 255}.{ip_index & 255}"
+            status = 401 if ip_index % 7 == 0 else 200
+            buffer.append(f'{ip} - - [10/Oct/2025:13:{index // 10000 % 60:02d}:{index // 100 % 60:02d} +0000] '
+                          f'"GET /index.html HTTP/1.1" {status} 512 "-" "Mozilla"\n')
+            if len(buffer) == 10_000:
+                log_file.writelines(buffer)
+                buffer.clear()
+        log_file.writelines(buffer)
+
+
+def measure_parse(log_path, compact):
+    """Run in a fresh interpreter: parse time, IPs, and resident memory before and at the peak of the parse."""
+    from file_parser import parse_apache_file
+    from metrics import peak_memory_mb
+
+    if compact:
+        import numpy  # noqa: F401 - loaded by the compact parse; counted as start-up, not as per-IP data
+
+    start_rss = peak_memory_mb()["process"]
+    start_time = time.perf_counter()
+    result = parse_apache_file(log_path, engine="fast", compact=compact)
+    seconds = time.perf_counter() - start_time
+    print(json.dumps({"seconds": seconds, "ips": len(result), "start_mb": start_rss, "peak_mb": peak_memory_mb()["process"]}))
+
+
+def run_parse(log_path, compact):
+    output = subprocess.run([sys.executable, BENCHMARK, "--child", "compact" if compact else "dict", log_path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def retained_bytes_per_ip(log_path, compact):
+    """Bytes still allocated per IP once the parse has returned (tracemalloc)."""
+    from file_parser import parse_apache_file
+
+    tracemalloc.start()
+    result = parse_apache_file(log_path, engine="fast", compact=compact)
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return retained / len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-IP dictionary against IpCounters (--counts-only --compact-counts) on an IP flood.")
+    parser.add_argument("--lines", type=int, default=FLOOD_LINES, help="Flood log lines.")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "LOG"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure_parse(args.child[1], args.child[0] == "compact")
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "flood.log")
+        sample_path = os.path.join(temp_dir, "sample.log")
+        print(f"[*] Writing a {args.lines:,} line flood log...")
+        write_flood_log(log_path, args.lines)
+        write_flood_log(sample_path, min(args.lines, RETAINED_LINES))
+
+        print("[*] Parsing it counts-only as a dictionary and as IpCounters...\n")
+        results = {name: run_parse(log_path, compact) for name, compact in (("dict", False), ("IpCounters", True))}
+        retained = {name: retained_bytes_per_ip(sample_path, compact) for name, compact in (("dict", False), ("IpCounters", True))}
+
+    print("PER-IP COUNTS MEMORY")
+    print("=" * 72)
+    print(f"{'':<12}{'IPs':>10}{'parse':>10}{'RSS at start':>15}{'peak RSS':>12}{'kept/IP':>11}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['ips']:>10,}{result['seconds']:>9.2f}s{result['start_mb']:>12.1f} MB"
+              f"{result['peak_mb']:>9.1f} MB{retained[name]:>9.0f} B")
+    print("=" * 72)
+
+    dictionary, counters = results["dict"], results["IpCounters"]
+    print(f"Peak RSS {dictionary['peak_mb'] / counters['peak_mb']:.1f}x lower, "
+          f"{retained['dict'] / retained['IpCounters']:.1f}x less kept per IP, "
+          f"parse {counters['seconds'] - dictionary['seconds']:+.2f}s (packing every IP token)")
+    print("IPs are packed and looked up in a NumPy address table one block at a time, so the rest of the")
+    print(f"IpCounters peak is the current {BLOCK_SIZE // 2**20} MB block of lines and what the allocator keeps back.")
+
+
+if __name__ == "__main__":
+    main()
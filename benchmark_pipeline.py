@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import datetime
+import io
+import ipaddress
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+# --- CONFIGURATION ---
+PIPELINE_SIZES = [10**4, 10**5, 10**6, 10**7, 10**8]  # Log lines per run
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = "benchmark_baseline.json"
+TOLERANCE = 0.25   # Slower / bigger than the baseline by more than this is a regression
+MIN_SECONDS = 0.5  # Stages quicker than this are too noisy to compare on throughput
+LINES_PER_IP = 50
+ATTACKER_SHARE = 0.001  # Fraction of IPs that brute-force /login
+TOP_N = 50
+
+ANALYSER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_analyser.py")
+
+NORMAL_PATHS = ["/", "/index.html", "/about.html", "/products/item1", "/static/style.css", "/static/app.js", "/api/cart"]
+USER_AGENTS = ["Mozilla/5.0 (Windows NT 10.0; Win64; x64)", "Mozilla/5.0 (Macintosh; Intel Mac OS X 14_0)",
+               "Mozilla/5.0 (X11; Linux x86_64)", "python-requests/2.31"]
+
+
+def write_benchmark_log(path, lines, seed=42):
+    """
+    Streams `lines` seeded log lines to `path`: one IP per LINES_PER_IP lines, with
+    ATTACKER_SHARE of them hammering /login with 401s. Timestamps advance one second
+    per line block so peak windows stay realistic.
+    """
+    rng = random.Random(seed)
+    ip_count = max(100, lines // LINES_PER_IP)
+    attackers = max(1, int(ip_count * ATTACKER_SHARE))
+    start = datetime.datetime(2025, 10, 10, 0, 0, 0)
+
+    with open(path, "w") as log_file:
+        buffer = []
+        for index in range(lines):
+            ip_index = rng.randrange(ip_count)
+            ip = str(ipaddress.IPv4Address(0x0A000000 + ip_index))
+            if ip_index < attackers:
+                request, status = "POST /login HTTP/1.1", "401"
+            else:
+                request, status = f"GET {rng.choice(NORMAL_PATHS)} HTTP/1.1", "200" if rng.random() < 0.97 else "404"
+
+            timestamp = (start + datetime.timedelta(seconds=index // 100)).strftime("%d/%b/%Y:%H:%M:%S +0000")
+            buffer.append(f'{ip} - - [{timestamp}] "{request}" {status} {rng.randint(100, 4000)} "-" "{rng.choice(USER_AGENTS)}"\n')
+
+            if len(buffer) == 10_000:
+                log_file.writelines(buffer)
+                buffer.clear()
+        log_file.writelines(buffer)
+
+
+def run_stages(log_path, lines, workers, jobs):
+    """
+    Times each pipeline stage in turn on one log. Runs in a fresh process, so the peak
+    RSS recorded after each stage is this run's high-water mark so far.
+    """
+    from anomaly_detector import ANOMALY_THRESHOLD, detect_anomalies
+    from cidr_index import CidrIndex
+    from enrichment import ReputationCache, check_blocklist
+    from file_parser import parse_log_files
+    from log_analyser import iter_report_rows
+    from metrics import peak_memory_mb
+    from reporting import export_to_csv, generate_report, top_ips
+
+    results = []
+
+    def timed(stage, function):
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # The stages' own progress messages
+            value = function()
+        seconds = time.perf_counter() - start_time
+        peak = peak_memory_mb()
+        results.append({"lines": lines, "stage": stage, "seconds": seconds, "lines_per_second": lines / seconds,
+                        "peak_rss_mb": peak["process"], "worker_rss_mb": peak["workers"] or None})
+        return value
+
+    log_dict = timed("parse", lambda: parse_log_files(log_path, workers=workers, engine="fast", detailed=True))
+    anomalous_ips, score_dict = timed("detect", lambda: detect_anomalies(log_dict, threshold=ANOMALY_THRESHOLD, jobs=jobs))
+
+    # The offline tiers only (no API quota is spent): a blocklist covering 1 in 16 IPs,
+    # then a cold cache write and read of the rest
+    def enrich():
+        blocklist = CidrIndex([(ipaddress.ip_network(f"10.{block >> 8}.{block & 255}.0/24"), "bench")
+                               for block in range(0, 64 * 256, 16)])
+        reputation = check_blocklist(log_dict, blocklist)
+        with contextlib.closing(sqlite3.connect(":memory:")) as db_connection:
+            db_connection.execute("CREATE TABLE REPUTATION (IP_ADDRESS TEXT PRIMARY KEY, ABUSE_SCORE INTEGER, "
+                                  "COUNTRY TEXT, LAST_CHECKED TEXT)")
+            cache = ReputationCache(db_connection, lru_size=0)
+            cache.put_many({ip: (0, "N/A") for ip in log_dict if ip not in reputation})
+            reputation.update(cache.get_many(log_dict))
+        return reputation
+
+    reputation = timed("enrich", enrich)
+    timed("report", lambda: generate_report(list(iter_report_rows(top_ips(log_dict, score_dict, TOP_N, "score"),
+                                                                   anomalous_ips, score_dict, reputation))))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        csv_path = os.path.join(temp_dir, "report.csv")
+        timed("csv", lambda: export_to_csv(iter_report_rows(log_dict.items(), anomalous_ips, score_dict, reputation), csv_path))
+
+    return results
+
+
+def run_pipeline(log_path, lines, workers, jobs):
+    """Times a full log_analyser.py run (parse, detect, top-N table and CSV) as a user would start it."""
+    from metrics import peak_memory_mb
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start_time = time.perf_counter()
+        # The analyser keeps ip_cache.db in its working directory, so run it in the temporary one
+        subprocess.run([sys.executable, ANALYSER, "-f", log_path, "--workers", str(workers), "--score-jobs", str(jobs),
+                        "--top", str(TOP_N), "-o", os.path.join(temp_dir, "report.csv")],
+                       cwd=temp_dir, stdout=subprocess.DEVNULL, check=True)
+        seconds = time.perf_counter() - start_time
+
+    # This process only waits for the analyser, so its children's peak is the analyser's
+    return [{"lines": lines, "stage": "pipeline", "seconds": seconds, "lines_per_second": lines / seconds,
+             "peak_rss_mb": peak_memory_mb()["workers"], "worker_rss_mb": None}]
+
+
+def run_isolated(function, *arguments):
+    """Runs `function` in a freshly spawned process so its peak RSS is not inherited from earlier runs."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(function, *arguments).result()
+
+
+def compare_to_baseline(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns (regressions, missing): a message for every stage that ran slower (lower
+    throughput) or used more peak memory than its baseline entry by more than
+    `tolerance`, and the "stage @ lines" names with no baseline entry to compare to.
+    Throughput changes where both timings are under MIN_SECONDS are ignored.
+    """
+    previous = {(entry["lines"], entry["stage"]): entry for entry in baseline.get("results", [])}
+    regressions = []
+    missing = []
+
+    for entry in results:
+        before = previous.get((entry["lines"], entry["stage"]))
+        name = f"{entry['stage']} @ {entry['lines']:,} lines"
+        if before is None:
+            missing.append(name)
+            continue
+
+        if max(entry["seconds"], before["seconds"]) >= MIN_SECONDS and \
+                entry["lines_per_second"] < before["lines_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {entry['lines_per_second']:,.0f} lines/s "
+                               f"(baseline {before['lines_per_second']:,.0f})")
+        if entry["peak_rss_mb"] and before["peak_rss_mb"] and entry["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: {entry['peak_rss_mb']:.0f} MB peak RSS (baseline {before['peak_rss_mb']:.0f} MB)")
+
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks every pipeline stage and the full run on generated logs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=PIPELINE_SIZES, help="Optional: Log lines per run (default: 10^4 to 10^8).")
+    parser.add_argument("--workers", type=int, default=1, help="Optional: Parse worker processes.")
+    parser.add_argument("--jobs", type=int, default=1, help="Optional: Scoring processes.")
+    parser.add_argument("--output", default=RESULTS_FILE, help=f"Optional: Where to write the JSON results (default: {RESULTS_FILE}).")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"Optional: Results to compare against (default: {BASELINE_FILE}).")
+    parser.add_argument("--save-baseline", action='store_true', help="Store this run as the baseline instead of comparing to it.")
+    parser.add_argument("--no-compare", action='store_true', help="Only record the results; skip the baseline comparison.")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help=f"Optional: Allowed slow-down / memory growth (default: {TOLERANCE:.0%}).")
+    parser.add_argument("--log-dir", help="Optional: Where to write the generated logs (default: a temporary directory).")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.log_dir) as temp_dir:
+        print(f"[*] Pipeline benchmark ({args.workers} parse worker(s), {args.jobs} scoring process(es))")
+        print("=" * 72)
+        print(f"{'Lines':>12} {'Stage':<10} {'Time (s)':>10} {'Lines/second':>14} {'Peak RSS (MB)':>14}")
+        print("-" * 72)
+
+        for lines in args.sizes:
+            log_path = os.path.join(temp_dir, f"access_{lines}.log")
+            write_benchmark_log(log_path, lines)
+
+            size_results = run_isolated(run_stages, log_path, lines, args.workers, args.jobs)
+            size_results += run_isolated(run_pipeline, log_path, lines, args.workers, args.jobs)
+            os.remove(log_path)
+
+            for entry in size_results:
+                peak = f"{entry['peak_rss_mb']:.0f}" if entry["peak_rss_mb"] is not None else "n/a"
+                print(f"{lines:>12,} {entry['stage']:<10} {entry['seconds']:>10.2f} {entry['lines_per_second']:>14,.0f} {peak:>14}")
+            results += size_results
+
+        print("=" * 72)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {"workers": args.workers, "jobs": args.jobs},
+        "results": results,
+    }
+    with open(args.output, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+    print(f"\n[+] Results written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"[+] Baseline saved to {args.baseline}")
+        return
+
+    if args.no_compare:
+        print("[*] Baseline comparison skipped (--no-compare)")
+        return
+
+    # Baselines are machine-specific, so none is shipped - but a check that compared nothing mustn't pass
+    if not os.path.exists(args.baseline):
+        print(f"\n[!] ERROR: No baseline at {args.baseline} - run with --save-baseline to store one, "
+              f"or --no-compare to skip the check")
+        sys.exit(2)
+
+    with open(args.baseline, "r") as baseline_file:
+        regressions, missing = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+
+    if len(missing) == len(results):
+        print(f"\n[!] ERROR: {args.baseline} has none of these sizes/stages - re-run with --save-baseline")
+        sys.exit(2)
+    if missing:
+        print(f"[*] Not in the baseline, so not compared: {', '.join(missing)}")
+
+    if regressions:
+        print(f"\n[!] ERROR: {len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"\t{regression}")
+        sys.exit(1)
+    print(f"[+] No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
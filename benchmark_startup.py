@@ -0,0 +1,71 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# --- CONFIGURATION ---
+# Wall-clock budgets (seconds); a run slower than this counts as a regression
+HELP_BUDGET = 0.5
+RULES_ONLY_BUDGET = 1.0
+RUNS = 5
+LOG_LINES = 2_000
+
+ANALYSER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log_analyser.py")
+
+
+def write_small_log(path, lines=LOG_LINES):
+    """A small log with one credential-stuffing IP among normal traffic."""
+    with open(path, "w") as log_file:
+        for index in range(lines):
+            second = f"{index // 60 % 60:02d}:{index % 60:02d}"
+            if index % 4 == 0:
+                log_file.write(f'198.51.100.7 - - [10/Oct/2025:13:{second} +0000] "POST /login HTTP/1.1" 401 0 "-" "python-requests"\n')
+            else:
+                log_file.write(f'10.0.{index % 50}.{index % 200} - - [10/Oct/2025:13:{second} +0000] "GET /index.html HTTP/1.1" 200 512 "-" "Mozilla"\n')
+
+
+def time_command(arguments, runs=RUNS):
+    """Best wall-clock time of `runs` runs of log_analyser.py with `arguments`."""
+    best = float("inf")
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, ANALYSER, *arguments], stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of log_analyser.py against fixed budgets.")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Runs per command (the best one counts).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "access.log")
+        write_small_log(log_path)
+
+        # The analyser writes ip_cache.db to its working directory
+        os.chdir(temp_dir)
+        results = [
+            ("--help", time_command(["--help"], args.runs), HELP_BUDGET),
+            ("--rules-only (small log)", time_command(["-f", log_path, "--rules-only"], args.runs), RULES_ONLY_BUDGET),
+        ]
+
+    print("START-UP PERFORMANCE")
+    print("=" * 50)
+    regressions = 0
+    for name, seconds, budget in results:
+        status = "OK" if seconds <= budget else "REGRESSION"
+        regressions += seconds > budget
+        print(f"{name:<26} {seconds:6.3f}s (budget {budget:.1f}s) {status}")
+    print("=" * 50)
+
+    if regressions:
+        print(f"\n[!] ERROR: {regressions} command(s) over their start-up budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
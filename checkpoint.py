@@ -0,0 +1,95 @@
+import hashlib
+import os
+import pickle
+
+from intern_table import PATHS, USER_AGENTS, merge_ids
+
+
+# Bump when the layout of the saved state changes so old checkpoints are ignored
+CHECKPOINT_VERSION = 5
+
+# The last block before the checkpointed offset is hashed to detect a rewritten file
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def checkpoint_path(state_dir, log_path) -> str:
+    """Returns where the checkpoint for a given log file lives (one file per log)."""
+    digest = hashlib.sha1(os.path.abspath(str(log_path)).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(state_dir, f"parse_checkpoint_{digest}.pkl")
+
+
+def block_hash(log_path, offset: int) -> str:
+    """Hashes the HASH_BLOCK_SIZE bytes that end at `offset`."""
+    start = max(0, offset - HASH_BLOCK_SIZE)
+    with open(log_path, "rb") as log:
+        log.seek(start)
+        return hashlib.sha256(log.read(offset - start)).hexdigest()
+
+
+def load_checkpoint(state_dir, log_path, engine: str, detailed: bool = False,
+                    approximate: bool = False) -> tuple[int, dict]:
+    """
+    Loads the saved per-IP state for a log and the byte offset it covers.
+
+    Returns (0, {}) - i.e. "parse from the start" - when there is no checkpoint, or
+    when the log is no longer the file that was checkpointed: a different inode
+    (rotated), a smaller size (truncated) or different bytes before the offset
+    (rewritten in place). Saved path and user agent ids are re-interned into this
+    process's tables.
+    """
+    try:
+        with open(checkpoint_path(state_dir, log_path), "rb") as checkpoint_file:
+            checkpoint = pickle.load(checkpoint_file)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return 0, {}
+
+    stat = os.stat(log_path)
+    offset = checkpoint.get("offset", 0)
+
+    if (checkpoint.get("version") != CHECKPOINT_VERSION
+            or checkpoint.get("engine") != engine
+            or checkpoint.get("detailed") != detailed
+            or checkpoint.get("approximate") != approximate
+            or checkpoint.get("identity") != (stat.st_dev, stat.st_ino)
+            or stat.st_size < offset
+            or block_hash(log_path, offset) != checkpoint.get("block_hash")):
+        print(f"[*] {log_path} was rotated or rewritten since the last run - parsing it from the start")
+        return 0, {}
+
+    log_dict = checkpoint["log_dict"]
+    if detailed and not approximate:
+        path_ids = PATHS.remap(checkpoint["paths"])
+        agent_ids = USER_AGENTS.remap(checkpoint["agents"])
+        for data in log_dict.values():
+            data["paths"] = merge_ids([], data["paths"], path_ids)
+            data["agents"] = merge_ids([], data["agents"], agent_ids)
+
+    return offset, log_dict
+
+
+def save_checkpoint(state_dir, log_path, engine: str, offset: int, log_dict: dict, detailed: bool = False,
+                    approximate: bool = False) -> None:
+    """Saves the per-IP state for the first `offset` bytes of the log (written atomically)."""
+    stat = os.stat(log_path)
+    checkpoint = {
+        "version": CHECKPOINT_VERSION,
+        "engine": engine,
+        "detailed": detailed,
+        "approximate": approximate,
+        "identity": (stat.st_dev, stat.st_ino),
+        "offset": offset,
+        "block_hash": block_hash(log_path, offset),
+        "log_dict": log_dict,
+    }
+    if detailed and not approximate:
+        # The ids in log_dict only mean something alongside the tables they came from
+        checkpoint["paths"] = PATHS.values
+        checkpoint["agents"] = USER_AGENTS.values
+
+    path = checkpoint_path(state_dir, log_path)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Never leave a half-written checkpoint behind if the run is killed
+    os.replace(temp_path, path)
@@ -0,0 +1,229 @@
+import ipaddress
+import os
+import socket
+from functools import partial
+
+import numpy as np
+
+
+# IPv6 addresses as two big-endian halves; NumPy sorts and searches these field by field
+_V6_DTYPE = np.dtype([("high", np.uint64), ("low", np.uint64)])
+_LOW_MASK = (1 << 64) - 1
+
+
+class CidrIndex:
+    """
+    Longest-prefix-match index over CIDR blocks (IPv4 and IPv6), for scoring IPs
+    against local blocklist / ASN feeds instead of the API.
+
+    Nested prefixes are flattened into disjoint intervals, each labelled with the most
+    specific prefix that covers it, so a lookup is a single binary search for the last
+    interval starting at or below the address. IPv4 intervals live in sorted uint32
+    NumPy arrays, IPv6 (128-bit, too wide for one NumPy integer) in arrays of two uint64
+    fields compared lexicographically; both are searched for a whole batch of IPs at once.
+    """
+
+    def __init__(self, prefixes):
+        """`prefixes` is an iterable of (ipaddress network, label) pairs."""
+        self.labels = []
+        label_ids = {}
+        by_version = {4: [], 6: []}
+
+        for network, label in prefixes:
+            label_id = label_ids.get(label)
+            if label_id is None:
+                label_id = label_ids[label] = len(self.labels)
+                self.labels.append(label)
+            by_version[network.version].append(
+                (int(network.network_address), int(network.broadcast_address), label_id))
+
+        v4 = _flatten(by_version[4])
+        self._v4_starts = np.array([start for start, _, _ in v4], dtype=np.uint32)
+        self._v4_ends = np.array([end for _, end, _ in v4], dtype=np.uint32)
+        self._v4_labels = np.array([label_id for _, _, label_id in v4], dtype=np.int32)
+
+        v6 = _flatten(by_version[6])
+        self._v6_starts = _v6_array([start for start, _, _ in v6])
+        self._v6_start_highs = self._v6_starts["high"].copy()
+        self._v6_ends = _v6_array([end for _, end, _ in v6])
+        self._v6_labels = np.array([label_id for _, _, label_id in v6], dtype=np.int32)
+
+    def __len__(self):
+        return len(self._v4_starts) + len(self._v6_starts)
+
+    def lookup(self, ip_address: str):
+        """Returns the label of the longest prefix containing `ip_address`, or None."""
+        return self.lookup_many([ip_address])[0]
+
+    def lookup_many(self, ip_addresses) -> list:
+        """Looks up a batch of IP strings; returns their labels (None where nothing matches) in order."""
+        ip_addresses = list(ip_addresses)
+        results = [None] * len(ip_addresses)
+
+        # Log traffic is mostly IPv4 - only split the batch when there is IPv6 in it
+        v6_positions = [position for position, ip_address in enumerate(ip_addresses) if ":" in ip_address]
+        if v6_positions:
+            v6_set = set(v6_positions)
+            v4_positions = [position for position in range(len(ip_addresses)) if position not in v6_set]
+            v4_addresses = [ip_addresses[position] for position in v4_positions]
+        else:
+            v4_positions, v4_addresses = None, ip_addresses
+
+        # Label id -1 picks the trailing None
+        labels = np.array(self.labels + [None], dtype=object)
+
+        if v4_addresses and len(self._v4_starts):
+            packed, valid = _pack_ipv4(v4_addresses)
+            index = np.searchsorted(self._v4_starts, packed, side="right") - 1
+            clipped = np.maximum(index, 0)
+            label_ids = np.where(valid & (index >= 0) & (packed <= self._v4_ends[clipped]), self._v4_labels[clipped], -1)
+
+            v4_results = labels[label_ids].tolist()
+            if v4_positions is None:
+                results = v4_results
+            else:
+                for position, label in zip(v4_positions, v4_results):
+                    results[position] = label
+
+        if v6_positions and len(self._v6_starts):
+            packed, valid = _pack_ipv6([ip_addresses[position] for position in v6_positions])
+            index = _search_v6(self._v6_starts, self._v6_start_highs, packed)
+            clipped = np.maximum(index, 0)
+            ends = self._v6_ends[clipped]
+            inside = (packed["high"] < ends["high"]) | ((packed["high"] == ends["high"]) & (packed["low"] <= ends["low"]))
+            label_ids = np.where(valid & (index >= 0) & inside, self._v6_labels[clipped], -1)
+
+            for position, label in zip(v6_positions, labels[label_ids].tolist()):
+                results[position] = label
+
+        return results
+
+
+def load_cidr_files(paths) -> CidrIndex:
+    """
+    Builds a CidrIndex from CIDR text files, one prefix per line. Anything after the
+    prefix (e.g. "; SBL123" or an ASN) becomes its label, otherwise the file name does.
+    Blank lines and lines starting with # or ; are skipped, as are malformed prefixes.
+    """
+    prefixes = []
+    skipped = 0
+
+    for path in paths:
+        default_label = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r", encoding="utf-8", errors="replace") as feed:
+            for line in feed:
+                line = line.strip()
+                if not line or line[0] in "#;":
+                    continue
+
+                prefix, _, label = line.partition(" ")
+                label = label.strip().lstrip(";#").strip() or default_label
+                try:
+                    prefixes.append((ipaddress.ip_network(prefix, strict=False), label))
+                except ValueError:
+                    skipped += 1
+
+    if skipped:
+        print(f"[!] Skipped {skipped} malformed CIDR lines")
+    return CidrIndex(prefixes)
+
+
+def _pack_ipv4(ip_addresses):
+    """
+    Dotted quads -> (uint32 array, validity mask), via inet_pton. Unlike inet_aton it only
+    takes the canonical four-part form, so tokens like "10" or "1.2" aren't read as
+    addresses. Invalid ones are packed as 0.0.0.0 and masked out, so they never match.
+    """
+    try:
+        packed = b"".join(map(partial(socket.inet_pton, socket.AF_INET), ip_addresses))
+        valid = np.ones(len(ip_addresses), dtype=bool)
+    except OSError:
+        parts, valid = [], np.ones(len(ip_addresses), dtype=bool)
+        for position, ip_address in enumerate(ip_addresses):
+            try:
+                parts.append(socket.inet_pton(socket.AF_INET, ip_address))
+            except OSError:
+                parts.append(bytes(4))
+                valid[position] = False
+        packed = b"".join(parts)
+    return np.frombuffer(packed, dtype=">u4").astype(np.uint32), valid
+
+
+def _pack_ipv6(ip_addresses):
+    """
+    IPv6 strings -> (_V6_DTYPE array, validity mask), via inet_pton (falls back to ipaddress
+    for anything it rejects, e.g. a %scope). Invalid addresses are packed as :: and masked out.
+    """
+    try:
+        packed = b"".join(map(partial(socket.inet_pton, socket.AF_INET6), ip_addresses))
+        valid = np.ones(len(ip_addresses), dtype=bool)
+    except OSError:
+        parts, valid = [], np.ones(len(ip_addresses), dtype=bool)
+        for position, ip_address in enumerate(ip_addresses):
+            try:
+                parts.append(ipaddress.IPv6Address(ip_address).packed)
+            except ValueError:
+                parts.append(bytes(16))
+                valid[position] = False
+        packed = b"".join(parts)
+
+    halves = np.frombuffer(packed, dtype=">u8").reshape(-1, 2)
+    result = np.empty(len(ip_addresses), dtype=_V6_DTYPE)
+    result["high"], result["low"] = halves[:, 0], halves[:, 1]
+    return result, valid
+
+
+def _search_v6(starts, start_highs, packed):
+    """
+    np.searchsorted(starts, packed, side="right") - 1 for _V6_DTYPE arrays. Searching
+    the plain uint64 high halves is several times faster than comparing both fields, so
+    only addresses that share their high half with an interval start need the second.
+    """
+    index = np.searchsorted(start_highs, packed["high"], side="right") - 1
+    tied = (index >= 0) & (start_highs[np.maximum(index, 0)] == packed["high"])
+    if tied.any():
+        index[tied] = np.searchsorted(starts, packed[tied], side="right") - 1
+    return index
+
+
+def _v6_array(addresses):
+    """128-bit ints -> _V6_DTYPE array"""
+    return np.array([(address >> 64, address & _LOW_MASK) for address in addresses], dtype=_V6_DTYPE)
+
+
+def _flatten(intervals):
+    """
+    Turns possibly nested (start, end, label) intervals into sorted disjoint ones, each
+    point keeping the label of the innermost interval around it. CIDR blocks are either
+    nested or disjoint, so one pass with a stack of open blocks is enough.
+    """
+    flat = []
+    stack = []
+    position = 0
+
+    def emit(start, end, label_id):
+        if start <= end:
+            if flat and flat[-1][2] == label_id and flat[-1][1] + 1 == start:
+                flat[-1] = (flat[-1][0], end, label_id)
+            else:
+                flat.append((start, end, label_id))
+
+    # Outer blocks before the blocks nested inside them
+    for start, end, label_id in sorted(intervals, key=lambda interval: (interval[0], -interval[1])):
+        # Close the blocks that end before this one starts
+        while stack and stack[-1][1] < start:
+            _, parent_end, parent_label = stack.pop()
+            emit(position, parent_end, parent_label)
+            position = parent_end + 1
+
+        if stack:
+            emit(position, start - 1, stack[-1][2])
+        stack.append((start, end, label_id))
+        position = start
+
+    while stack:
+        _, parent_end, parent_label = stack.pop()
+        emit(position, parent_end, parent_label)
+        position = parent_end + 1
+
+    return flat
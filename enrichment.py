@@ -1,79 +1,297 @@
-import sqlite3
-import requests
+import email.utils
+import math
+import random
+import threading
+import time
 import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+# `requests` is imported where a lookup is made, so runs that never go to the API
+# don't pay for loading it
 
-def check_cache(ip_address: str, db_connection) -> tuple | None:
-    """Looks inside the local database to see if the IP has been investigated"""
-    cursor = db_connection.cursor()
 
-    # Executes the query and passes the IP Address as a paramter
-    cursor.execute("SELECT ABUSE_SCORE, COUNTRY FROM REPUTATION WHERE IP_ADDRESS = ?", (ip_address,))
-    result = cursor.fetchone()
+API_URL = "https://api.abuseipdb.com/api/v2/check"
 
-    if result:
-        # If found, returns a result (e.g., (100, RU))
-        return result
-    else:
-        return None
+# Concurrency and pacing for enrich_ips. The token bucket starts at RATE_PER_SECOND
+# and is then steered by the quota headers AbuseIPDB sends back.
+ENRICH_WORKERS = 8
+RATE_PER_SECOND = 10.0
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+MAX_QUOTA_WAIT = 60.0  # Give up (and report N/A) rather than wait longer than this for quota
 
+# Score given to IPs found in a local --blocklist feed (AbuseIPDB's maximum)
+BLOCKLIST_SCORE = 100
 
-def get_ip_reputation(ip_address: str, api_key: str) -> tuple[int, str]:
-    """Contacts the external AbuseIPDB API"""
-    url = "https://api.abuseipdb.com/api/v2/check"
+# Cached reputations older than this are looked up again
+CACHE_TTL_DAYS = 7.0
+LRU_SIZE = 100_000
+QUERY_CHUNK = 900  # Stays under SQLite's bound-parameter limit on older builds
 
-    # Headers that include API key for authentication
-    headers = {
-        "Accept": "application/json",
-        "Key": api_key
-    }
 
-    # Parameters for the request
-    params = {
-        "ipAddress": ip_address,
-        "maxAgeInDays": "90"
-    }
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` requests per second with bursts of up to `capacity`.
+
+    update_from_headers() follows the API's X-RateLimit-Remaining / X-RateLimit-Reset
+    and Retry-After headers, and pause() holds every thread back after a 429.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, max_wait: float | None = None) -> bool:
+        """Takes one token, sleeping until one is free. Returns False if that would take longer than `max_wait`."""
+        give_up_at = None if max_wait is None else time.monotonic() + max_wait
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+            if give_up_at is not None and now + wait > give_up_at:
+                return False
+            time.sleep(wait)
 
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for `seconds`."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers) -> bool:
+        """
+        Caps the bucket at the quota the API says is left, pausing until the reset when it runs out.
+
+        Returns True if a Retry-After header paused the bucket. Headers that can't be
+        parsed are treated as absent, so the caller falls back to its own backoff.
+        """
+        remaining = _header_number(headers.get("X-RateLimit-Remaining"))
+        if remaining is not None:
+            with self._lock:
+                self.tokens = min(self.tokens, remaining)
+
+            reset = _header_number(headers.get("X-RateLimit-Reset"))
+            if remaining <= 0 and reset is not None:
+                self.pause(max(0.0, reset - time.time()))
+
+        retry_after = _retry_after_seconds(headers.get("Retry-After"))
+        if retry_after is None:
+            return False
+        self.pause(retry_after)
+        return True
+
+
+def _header_number(value) -> float | None:
+    """A numeric header as a float, or None if it is missing or isn't a finite number."""
+    if value is None:
+        return None
     try:
-        # Make the API request
-        response = requests.get(url, headers=headers, params=params)
+        number = float(value)
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def _retry_after_seconds(value) -> float | None:
+    """Retry-After in seconds from now. It may be a number of seconds or an HTTP-date; None if it's neither."""
+    seconds = _header_number(value)
+    if seconds is not None:
+        return max(0.0, seconds)
+    if value is None:
+        return None
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        # HTTP-dates are always GMT
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
 
-        # Check if the request is successful
-        if response.status_code == 200:
-            data = response.json()["data"]
-            score = data["abuseConfidenceScore"]
-            country = data["countryCode"]
-            return (score, country)
 
-        else:
-            # If the API produces an error (bad key or invalid IP)
-            print(f"[!] API Error: Received status code {response.status_code}")
-            return (0, "N/A")
+def create_session(pool_size: int = ENRICH_WORKERS) -> "requests.Session":
+    """One HTTP session whose connection pool is big enough for every worker thread to keep its connection alive."""
+    import requests
+    from requests.adapters import HTTPAdapter
 
-    except requests.exceptions.RequestException as e:
-        print(f"[!] Network Error: Could not connect to the API.")
-        return (0, "N/A")
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
+def check_blocklist(ip_addresses, index) -> dict:
+    """First enrichment tier: (BLOCKLIST_SCORE, "N/A") for every IP inside a prefix of the local CidrIndex."""
+    ip_addresses = list(ip_addresses)
+    return {ip_address: (BLOCKLIST_SCORE, "N/A")
+            for ip_address, label in zip(ip_addresses, index.lookup_many(ip_addresses)) if label is not None}
 
-def update_cache(ip_address: str, abuse_score: int, country_code: str, db_connection) -> None:
-    """Saves the new intelligence retrieved from the API into the local database."""
 
-    # Get the current time in a standard format
-    timestamp = datetime.datetime.now().isoformat()
+class ReputationCache:
+    """
+    Batch front-end to the reputation table.
 
-    cursor = db_connection.cursor()
+    get_many() resolves a whole set of IPs with one `IN (...)` query per QUERY_CHUNK
+    IPs, and put_many() writes every result in a single transaction. Rows whose
+    last_checked is older than `ttl_days` count as misses. A bounded LRU of recent
+    results sits in front of SQLite so repeated lookups (e.g. every --follow refresh)
+    don't touch the database at all.
+    """
 
-    # INSERT a new row if the IP does not exist, or REPLACE if it does
-    cursor.execute('''
-    INSERT OR REPLACE INTO REPUTATION (IP_ADDRESS, ABUSE_SCORE, COUNTRY, LAST_CHECKED)
-    VALUES (?, ?, ?, ?)
-    ''', (ip_address, abuse_score, country_code, timestamp))
+    def __init__(self, db_connection, ttl_days: float = CACHE_TTL_DAYS, lru_size: int = LRU_SIZE):
+        self.db_connection = db_connection
+        self.ttl = datetime.timedelta(days=ttl_days)
+        self.lru_size = lru_size
+        self._lru = OrderedDict()  # ip -> (score, country, last_checked)
 
-    # Saves the changes to the database
-    db_connection.commit()
+    def get_many(self, ip_addresses) -> dict:
+        """Returns {ip: (score, country)} for every IP with a fresh cached result."""
+        # ISO timestamps sort as text, so the TTL check is a string comparison (and part of the query)
+        cutoff = (datetime.datetime.now() - self.ttl).isoformat()
+        results, missing = {}, []
 
+        for ip_address in ip_addresses:
+            cached = self._lru.get(ip_address)
+            if cached is not None and cached[2] >= cutoff:
+                self._lru.move_to_end(ip_address)
+                results[ip_address] = cached[:2]
+            else:
+                missing.append(ip_address)
 
+        for index in range(0, len(missing), QUERY_CHUNK):
+            chunk = missing[index:index + QUERY_CHUNK]
+            cursor = self.db_connection.execute(
+                "SELECT IP_ADDRESS, ABUSE_SCORE, COUNTRY, LAST_CHECKED FROM REPUTATION "
+                f"WHERE IP_ADDRESS IN ({','.join('?' * len(chunk))}) AND LAST_CHECKED >= ?",
+                (*chunk, cutoff))
+            for ip_address, score, country, last_checked in cursor.fetchall():
+                results[ip_address] = (score, country)
+                self._remember(ip_address, score, country, last_checked)
 
+        return results
 
+    def put_many(self, results: dict) -> None:
+        """Saves {ip: (score, country)} in one transaction."""
+        if not results:
+            return
 
+        timestamp = datetime.datetime.now().isoformat()
+        with self.db_connection:
+            self.db_connection.executemany('''
+            INSERT OR REPLACE INTO REPUTATION (IP_ADDRESS, ABUSE_SCORE, COUNTRY, LAST_CHECKED)
+            VALUES (?, ?, ?, ?)
+            ''', [(ip_address, score, country, timestamp) for ip_address, (score, country) in results.items()])
+
+        for ip_address, (score, country) in results.items():
+            self._remember(ip_address, score, country, timestamp)
+
+    def _remember(self, ip_address, score, country, last_checked):
+        self._lru[ip_address] = (score, country, last_checked)
+        self._lru.move_to_end(ip_address)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+
+def enrich_ips(ip_addresses, api_key: str, workers: int = ENRICH_WORKERS, rate: float = RATE_PER_SECOND,
+               url: str = API_URL) -> dict:
+    """
+    Looks up many IPs concurrently through one pooled session.
+
+    At most `workers` requests are in flight, paced by a shared TokenBucket. A 429 (or
+    a 5xx / network error) is retried up to MAX_RETRIES times with exponential backoff,
+    honouring Retry-After when the API sends it. A 401 or 403 means the key itself
+    was refused, so the lookups still queued are skipped. Returns {ip: (score, country)}
+    for the IPs that were looked up successfully; the rest are left out so they are
+    not cached and get retried next run.
+    """
+    ip_addresses = list(ip_addresses)
+    if not ip_addresses:
+        return {}
+
+    bucket = TokenBucket(rate)
+    refused = threading.Event()
+    results = {}
+
+    with create_session(workers) as session:
+        def lookup(ip_address):
+            if refused.is_set():
+                return
+            result = _fetch_reputation(ip_address, api_key, session, bucket, url, refused)
+            if result is not None:
+                results[ip_address] = result
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lookup, ip_addresses))
+
+    if refused.is_set():
+        print("[!] API Error: AbuseIPDB refused the API key - skipped the remaining lookups")
+    if len(results) < len(ip_addresses):
+        print(f"[!] Could not enrich {len(ip_addresses) - len(results)} of {len(ip_addresses)} IPs (quota or network errors)")
+    return results
+
+
+def _fetch_reputation(ip_address, api_key, session, bucket, url, refused):
+    """One lookup for enrich_ips, with retries. Returns (score, country) or None; sets `refused` on a 401/403."""
+    import requests
+
+    for attempt in range(MAX_RETRIES + 1):
+        if refused.is_set() or not bucket.acquire(max_wait=MAX_QUOTA_WAIT):
+            return None
+
+        try:
+            response = session.get(url, headers=_api_headers(api_key), params=_api_params(ip_address), timeout=30)
+        except requests.exceptions.RequestException:
+            response = None
+
+        if response is not None:
+            retry_after_honoured = bucket.update_from_headers(response.headers)
+            if response.status_code == 200:
+                try:
+                    data = response.json()["data"]
+                    return (data["abuseConfidenceScore"], data["countryCode"])
+                except (ValueError, KeyError, TypeError):
+                    # Not the JSON the API documents (e.g. a proxy's error page)
+                    return None
+            if response.status_code in (401, 403):
+                refused.set()
+                return None
+            if response.status_code != 429 and response.status_code < 500:
+                # Invalid IP - retrying won't help
+                print(f"[!] API Error: Received status code {response.status_code} for {ip_address}")
+                return None
+
+        # Rate limited or a transient failure: back off (a Retry-After we could read already paused the bucket)
+        if response is None or not retry_after_honoured:
+            bucket.pause(BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.0))
+
+    return None
+
+
+def _api_headers(api_key):
+    # Headers that include API key for authentication
+    return {
+        "Accept": "application/json",
+        "Key": api_key
+    }
+
+
+def _api_params(ip_address):
+    # Parameters for the request
+    return {
+        "ipAddress": ip_address,
+        "maxAgeInDays": "90"
+    }
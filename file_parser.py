@@ -1,34 +1,810 @@
+import bz2
+import calendar
+import glob
+import gzip
+import lzma
+import mmap
+import os
 import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
+from checkpoint import load_checkpoint, save_checkpoint
+from hyperloglog import HyperLogLog
+from intern_table import PATHS, USER_AGENTS, add_id, merge_ids
+from ip_counters import IpCounters
+from sigma_rules import get_rule_set
+from time_windows import SlidingWindow
 
-def parse_apache_file(filepath):
-    """Reads an Apache log file and returns a dictionary of IP data"""
 
-    # Regex to extract IP and status code
-    # Supports IPv6
-    pattern = re.compile(r'(\b\d{1,3}(?:\.\d{1,3}){3}\b|\b[a-fA-F0-9:]+\b).*"\s*(\d{3})\s')
+# Regex to extract IP and status code
+# Supports IPv6
+LOG_PATTERN = re.compile(r'(\b\d{1,3}(?:\.\d{1,3}){3}\b|\b[a-fA-F0-9:]+\b).*"\s*(\d{3})\s')
+
+# The fast engine reads the file in blocks of this many bytes
+BLOCK_SIZE = 8 * 1024 * 1024
+# Smaller blocks when parsing into a StateStore, whose memory budget has to cover them
+STORE_BLOCK_SIZE = 1024 * 1024
+
+# Rotated logs are decompressed on the fly based on their extension
+COMPRESSED_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Dotted quad, or IPv6 / any hex run starting and ending on a word character (the \b anchors)
+_IP_TOKEN = re.compile(rb"(?:[0-9]{1,3}\.){3}[0-9]{1,3}|[0-9a-fA-F](?:[0-9a-fA-F:]*[0-9a-fA-F])?")
+_STATUS_END = (b" ", b"\t", b"\r", b"")
+_MONTHS = {month.encode(): index for index, month in enumerate(calendar.month_abbr) if month}
+
+
+class LineCounts:
+    """
+    Lines read by the parse engines in this process, and how many of them neither the
+    fast path nor the regex could read (unparsed). Worker processes send their counts
+    back with their results, so after a parse these cover the whole run without
+    reading the logs again.
+    """
+
+    __slots__ = ("read", "unparsed")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.read = 0
+        self.unparsed = 0
+
+    def add(self, read: int, unparsed: int) -> None:
+        self.read += read
+        self.unparsed += unparsed
+
+
+LINE_COUNTS = LineCounts()
+
+
+def parse_apache_file(filepath, workers=1, engine="regex", detailed=False, approximate=False, compact=False):
+    """
+    Reads an Apache log file and returns a dictionary of IP data
+
+    Args:
+        filepath: Path to the Apache access log
+        workers (int, optional): Number of worker processes. Defaults to 1 (serial).
+        engine (str, optional): "regex" decodes each line and runs LOG_PATTERN on it.
+        "fast" memory-maps the file and reads the fields from bytes, falling back to
+        the regex for lines it cannot read. The engines agree on well-formed lines;
+        they differ where a quoted referer or user agent contains something like
+        `\" 200 `, which the regex takes for the status (see parse_log_bytes).
+        detailed (bool, optional): Also keep bytes sent, first/last seen and the
+        distinct paths and user agents per IP (see new_entry). Fields are always read
+        by position, so this implies the fast engine.
+        approximate (bool, optional): With `detailed`, track distinct paths and user
+        agents per IP in fixed-size HyperLogLog sketches instead of exact id arrays.
+        compact (bool, optional): Without `detailed`, return the fast engine's counts as
+        an ip_counters.IpCounters (packed addresses and typed count columns) instead of
+        a dictionary. It reads the same, in a fraction of the memory, but parses more
+        slowly: every block's IPs are packed and looked up again. Implies the fast engine.
+    """
+
+    if detailed:
+        engine = "fast"
+        compact = False
+    elif compact:
+        engine = "fast"
+
+    if is_compressed(filepath):
+        # A compressed stream can't be split into byte ranges, so it is always read serially
+        try:
+            return _parse_compressed(filepath, engine, detailed, approximate, compact)
+        except FileNotFoundError:
+            print(f"\n[!] ERROR: The file '{filepath}' was not found.\n")
+            return None
+
+    if workers > 1:
+        return parse_apache_file_parallel(filepath, workers, engine, detailed=detailed, approximate=approximate,
+                                          compact=compact)
+
+    if engine == "fast":
+        try:
+            return _parse_range_fast(filepath, 0, os.path.getsize(filepath), detailed, approximate, compact)
+        except FileNotFoundError:
+            print(f"\n[!] ERROR: The file '{filepath}' was not found.\n")
+            return None
 
     try:
         # Structure: {ip: {"total": int, "errors": int}}
-        log_dict = {}
-        with open(filepath, "r") as log:
-            for line in log:
-                match = pattern.search(line)
-                if match:
-                    ip = match.group(1)
-                    status = match.group(2)
+        # Read and decoded exactly like a worker's byte range, so --workers gives the same result
+        with open(filepath, "rb") as log:
+            return _parse_lines_regex(log)
 
-                    if ip not in log_dict:
-                        log_dict[ip] = {"total": 0, "errors": 0}
+    except FileNotFoundError:
+        print(f"\n[!] ERROR: The file '{filepath}' was not found.\n")
+        return None
 
-                    log_dict[ip]["total"] += 1
 
-                    # Check for 4xx or 5xx errors
-                    if status.startswith(("4", "5")):
-                        log_dict[ip]["errors"] += 1
+def parse_log_files(path_pattern, workers=1, engine="regex", state_dir=None, detailed=False, approximate=False,
+                    store=None, compact=False):
+    """
+    Parses every log matched by a file path, glob (e.g. "access.log*") or directory and
+    merges the per-IP data into one dictionary. Rotated .gz/.bz2/.xz files are
+    decompressed as they are read. With several files and workers > 1 each file is
+    parsed in its own worker process; a single plain file is split into chunks instead.
+    If `state_dir` is given, plain files resume from their last checkpoint there.
+    See parse_apache_file for `engine`, `detailed`, `approximate` and `compact`.
 
-        return log_dict
+    With a `store` (state_store.StateStore) the files are parsed serially with the fast
+    engine into the store, which keeps within its memory budget, and the finished store
+    is returned in place of the dictionary.
+    """
+    paths = find_log_files(path_pattern)
 
+    if not paths:
+        print(f"\n[!] ERROR: No log files found matching '{path_pattern}'.\n")
+        return None
+
+    if store is not None:
+        if len(paths) > 1:
+            print(f"[*] Found {len(paths)} log files")
+        for path in paths:
+            try:
+                _parse_into_store(path, store, detailed, approximate)
+            except FileNotFoundError:
+                print(f"\n[!] ERROR: The file '{path}' was not found.\n")
+                return None
+        return store.finish()
+
+    if len(paths) == 1:
+        return _parse_log_file(paths[0], workers, engine, state_dir, detailed, approximate, compact)
+
+    print(f"[*] Found {len(paths)} log files")
+    log_dict = IpCounters() if compact and not detailed else {}
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            results = pool.map(_in_worker, [_parse_log_file] * len(paths), paths, [1] * len(paths),
+                               [engine] * len(paths), [state_dir] * len(paths), [detailed] * len(paths),
+                               [approximate] * len(paths), [compact] * len(paths))
+            for result in results:
+                _merge_worker_result(log_dict, result)
+    else:
+        for path in paths:
+            partial = _parse_log_file(path, 1, engine, state_dir, detailed, approximate, compact)
+            if partial:
+                merge_log_dicts(log_dict, partial)
+
+    return log_dict
+
+
+def _parse_into_store(filepath, store, detailed=False, approximate=False):
+    """Parses one log into a StateStore. Lines are counted straight into its entries, so windows stay exact."""
+    if is_compressed(filepath):
+        # Merged block by block, exactly as _parse_compressed does
+        opener = COMPRESSED_OPENERS[os.path.splitext(str(filepath))[1].lower()]
+        with opener(filepath, "rb") as stream:
+            for data in _whole_line_blocks(stream):
+                store.merge(parse_log_bytes(data, 0, len(data), detailed, approximate))
+                store.trim()
+        return
+
+    # Read rather than memory-mapped: mapped pages count towards the resident memory being budgeted
+    with open(filepath, "rb") as log:
+        for data in _whole_line_blocks(log, STORE_BLOCK_SIZE):
+            parse_log_bytes(data, 0, len(data), detailed, approximate, store=store)
+
+
+def _parse_log_file(filepath, workers, engine, state_dir, detailed=False, approximate=False, compact=False):
+    """Parses one log, resuming from a checkpoint when there is a state dir to keep it in"""
+    if state_dir is not None and not is_compressed(filepath):
+        # Checkpoints hold the dictionary form
+        return parse_apache_file_resumable(filepath, state_dir, workers, engine, detailed, approximate)
+    return parse_apache_file(filepath, workers=workers, engine=engine, detailed=detailed, approximate=approximate,
+                             compact=compact)
+
+
+def _in_worker(function, *args):
+    """
+    Runs a parse function in a worker process. Path and user agent ids are only
+    meaningful within the process that interned them, so the worker's tables are
+    sent back alongside its result for _merge_worker_result to translate, together
+    with the lines it read.
+    """
+    LINE_COUNTS.reset()
+    result = function(*args)
+    return result, PATHS.values, USER_AGENTS.values, (LINE_COUNTS.read, LINE_COUNTS.unparsed)
+
+
+def _merge_worker_result(log_dict, result):
+    """Merges a partial returned by _in_worker into `log_dict`, re-interning its ids locally"""
+    partial, paths, user_agents, line_counts = result
+    LINE_COUNTS.add(*line_counts)
+    if partial:
+        merge_log_dicts(log_dict, partial, PATHS.remap(paths), USER_AGENTS.remap(user_agents))
+
+
+def parse_apache_file_resumable(filepath, state_dir, workers=1, engine="regex", detailed=False, approximate=False):
+    """
+    Parses only the bytes appended since the last run and merges them into the
+    per-IP state saved by that run, then checkpoints the new state and offset.
+    Falls back to a full parse when the log was rotated or rewritten.
+    """
+    try:
+        file_size = os.path.getsize(filepath)
     except FileNotFoundError:
         print(f"\n[!] ERROR: The file '{filepath}' was not found.\n")
-        return None
\ No newline at end of file
+        return None
+
+    if detailed:
+        engine = "fast"
+
+    offset, log_dict = load_checkpoint(state_dir, filepath, engine, detailed, approximate)
+    if offset:
+        print(f"[*] Resuming {filepath} from byte {offset:,} of {file_size:,}")
+
+    # Only checkpoint whole lines - Apache may be halfway through writing the last one
+    line_end = _last_line_end(filepath, offset, file_size)
+    merge_log_dicts(log_dict, parse_apache_file_parallel(filepath, workers, engine, offset, line_end,
+                                                         detailed, approximate))
+    tail = {}
+    if line_end < file_size:
+        tail = _parse_range(filepath, line_end, file_size, engine, detailed, approximate)
+
+    save_checkpoint(state_dir, filepath, engine, line_end, log_dict, detailed, approximate)
+
+    # The half-written line still counts for this run's report, like a full parse would
+    return merge_log_dicts(log_dict, tail)
+
+
+def _last_line_end(filepath, start, end):
+    """Returns the offset just past the last newline in [start, end), or `start` if there is none"""
+    with open(filepath, "rb") as log:
+        position = end
+        while position > start:
+            block_start = max(start, position - BLOCK_SIZE)
+            log.seek(block_start)
+            newline = log.read(position - block_start).rfind(b"\n")
+            if newline != -1:
+                return block_start + newline + 1
+            position = block_start
+
+    return start
+
+
+def find_log_files(path_pattern):
+    """Expands a path, glob or directory into a sorted list of log file paths"""
+    path_pattern = str(path_pattern)
+
+    if os.path.isdir(path_pattern):
+        return sorted(
+            os.path.join(path_pattern, name) for name in os.listdir(path_pattern)
+            if not name.startswith(".") and os.path.isfile(os.path.join(path_pattern, name))
+        )
+
+    if any(char in path_pattern for char in "*?["):
+        return sorted(path for path in glob.glob(path_pattern) if os.path.isfile(path))
+
+    return [path_pattern] if os.path.exists(path_pattern) else []
+
+
+def is_compressed(filepath):
+    """True if the file extension is one of the supported compression formats"""
+    return os.path.splitext(str(filepath))[1].lower() in COMPRESSED_OPENERS
+
+
+def parse_apache_file_parallel(filepath, workers, engine="regex", start=0, end=None, detailed=False,
+                               approximate=False, compact=False):
+    """Splits the log file (or its [start, end) byte range) into newline-aligned ranges and parses them in worker processes"""
+
+    try:
+        ranges = find_chunk_ranges(filepath, workers, start, end)
+    except FileNotFoundError:
+        print(f"\n[!] ERROR: The file '{filepath}' was not found.\n")
+        return None
+
+    # Nothing to split (empty file or a single chunk) - no point paying for a pool
+    if len(ranges) <= 1 or workers <= 1:
+        log_dict = IpCounters() if compact and not detailed else {}
+        for start, end in ranges:
+            merge_log_dicts(log_dict, _parse_range(filepath, start, end, engine, detailed, approximate, compact))
+        return log_dict
+
+    log_dict = IpCounters() if compact and not detailed else {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # map() yields results in submission order, so merging chunk by chunk keeps
+        # the same first-seen IP order as the serial path
+        results = pool.map(_in_worker, [_parse_range] * len(ranges), [filepath] * len(ranges),
+                           [start for start, _ in ranges], [end for _, end in ranges],
+                           [engine] * len(ranges), [detailed] * len(ranges), [approximate] * len(ranges),
+                           [compact] * len(ranges))
+        for result in results:
+            _merge_worker_result(log_dict, result)
+
+    return log_dict
+
+
+def find_chunk_ranges(filepath, chunks, start=0, end=None):
+    """Returns a list of (start, end) byte ranges that each begin at the start of a line"""
+    if chunks < 1:
+        raise ValueError(f"Can't split a log into {chunks} chunks")
+    if end is None:
+        end = os.path.getsize(filepath)
+    if end <= start:
+        return []
+
+    chunk_size = max(1, (end - start) // chunks)
+    boundaries = [start]
+
+    with open(filepath, "rb") as log:
+        for index in range(1, chunks):
+            # Jump to the rough split point, then move forward to the next line start
+            log.seek(max(start + index * chunk_size, boundaries[-1]))
+            if log.tell() > 0:
+                log.seek(log.tell() - 1)
+                log.readline()
+            position = log.tell()
+
+            if position >= end:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+
+    boundaries.append(end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _parse_range(filepath, start, end, engine="regex", detailed=False, approximate=False, compact=False):
+    """Parses the lines in [start, end) of the file into a partial {ip: {"total", "errors"}} map"""
+    if engine == "fast" or detailed:
+        return _parse_range_fast(filepath, start, end, detailed, approximate, compact)
+
+    with open(filepath, "rb") as log:
+        log.seek(start)
+        return _parse_lines_regex(_read_lines(log, end - start))
+
+
+def _read_lines(log, limit):
+    """Yields raw lines from a binary file handle until `limit` bytes have been read"""
+    position = 0
+    while position < limit:
+        raw_line = log.readline()
+        if not raw_line:
+            break
+        position += len(raw_line)
+        yield raw_line
+
+
+def _parse_lines_regex(raw_lines):
+    """Runs LOG_PATTERN over an iterable of raw (bytes) lines and returns the per-IP map"""
+    pattern = LOG_PATTERN
+    log_dict = {}
+    read = unparsed = 0
+
+    for raw_line in raw_lines:
+        read += 1
+        # Lines end at "\n" only (a lone "\r" stays inside the line, as in the fast engine);
+        # undecodable bytes are replaced rather than failing the parse
+        line = raw_line.decode("utf-8", errors="replace").replace("\r\n", "\n")
+        match = pattern.search(line)
+        if not match:
+            unparsed += 1
+        else:
+            ip = match.group(1)
+            status = match.group(2)
+
+            if ip not in log_dict:
+                log_dict[ip] = {"total": 0, "errors": 0}
+
+            log_dict[ip]["total"] += 1
+
+            if status.startswith(("4", "5")):
+                log_dict[ip]["errors"] += 1
+
+    LINE_COUNTS.add(read, unparsed)
+    return log_dict
+
+
+def _parse_compressed(filepath, engine="regex", detailed=False, approximate=False, compact=False):
+    """Decompresses a rotated .gz/.bz2/.xz log on the fly - nothing is written to disk"""
+    opener = COMPRESSED_OPENERS[os.path.splitext(str(filepath))[1].lower()]
+
+    with opener(filepath, "rb") as stream:
+        if engine != "fast" and not detailed:
+            return _parse_lines_regex(stream)
+
+        log_dict = IpCounters() if compact and not detailed else {}
+        for data in _whole_line_blocks(stream):
+            merge_log_dicts(log_dict, parse_log_bytes(data, 0, len(data), detailed, approximate, compact=compact))
+        return log_dict
+
+
+def _whole_line_blocks(stream, block_size=BLOCK_SIZE):
+    """Reads a stream in blocks, yielding whole lines only (plus a final unterminated line)"""
+    pending = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+
+        # The tail is completed by the next block
+        data = pending + block
+        cut = data.rfind(b"\n") + 1
+        pending = data[cut:]
+        if cut:
+            yield data[:cut]
+
+    if pending:
+        yield pending
+
+
+def _parse_range_fast(filepath, start, end, detailed=False, approximate=False, compact=False):
+    """Memory-maps the file and counts the lines in [start, end) without decoding them"""
+    if end <= start:
+        return IpCounters() if compact and not detailed else {}
+
+    with open(filepath, "rb") as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return parse_log_bytes(mapped, start, end, detailed, approximate, compact=compact)
+
+
+def parse_log_bytes(buffer, start=0, end=None, detailed=False, approximate=False, store=None, compact=False):
+    """
+    Counts the log lines in buffer[start:end] (bytes or an mmap) into a partial
+    {ip: {"total", "errors"}} map. Fields are read by position from the
+    Common/Combined Log Format layout:
+
+        ip ident user [time] "request" status bytes ["referer" "user agent"]
+
+    Any line that doesn't fit that layout is handed to the regex instead. Reading the
+    status by position also means a quoted referer or user agent that contains
+    something like `\" 200 ` can't be mistaken for the status, which the regex's
+    greedy `.*"` can do.
+
+    With `detailed`, each entry also carries the fields described in new_entry.
+    Otherwise `compact` returns the counts as an ip_counters.IpCounters.
+
+    With a `store` (state_store.StateStore), lines are counted into its entries instead,
+    the store is trimmed to its memory budget after every block, and it is returned.
+    """
+    if detailed:
+        return _parse_log_bytes_detailed(buffer, start, end, approximate, store)
+
+    # Each IP gets a row the first time it is seen, keyed by its raw bytes. Lines only note
+    # their row; each block is then counted in one go. IpCounters and the store only need
+    # the rows of one block, so those start again every block.
+    rows = {}
+    seen = array("I")
+    failed = array("I")
+    note_seen, note_failed = seen.append, failed.append
+    counters = IpCounters()
+
+    def count_regex(line):
+        result = _match_line_regex(line)
+        if result is None:
+            LINE_COUNTS.unparsed += 1
+        else:
+            ip, status = result
+            row = rows.get(ip)
+            if row is None:
+                row = rows[ip] = len(rows)
+            note_seen(row)
+            if status[0] in b"45":
+                note_failed(row)
+
+    def count_block():
+        if compact:
+            counters.count_block(list(rows), seen, failed)
+            rows.clear()
+        elif store is None:
+            counters.count(seen, failed, len(rows))
+        else:
+            # Rows only live for one block here - the store holds the running counts
+            block = IpCounters()
+            block.count(seen, failed, len(rows))
+            store.add_counts(dict(zip(rows, zip(block.totals, block.errors))))
+            rows.clear()
+        del seen[:], failed[:]
+
+    for lines, terminated in _line_blocks(buffer, start, end):
+        LINE_COUNTS.read += len(lines)
+        if not terminated:
+            # A final line without a trailing newline is rare; let the regex decide
+            count_regex(lines[0])
+            continue
+
+        for line in lines:
+            # The status code sits right after the request's closing quote
+            head, quote, rest = line.partition(b'" ')
+            status = rest[:3]
+            if not quote or not status.isdigit() or rest[3:4] not in _STATUS_END:
+                count_regex(line + b"\n")
+                continue
+
+            # The client IP is the first space-separated field
+            space = head.find(b" ")
+            ip = head[:space]
+            row = rows.get(ip)
+            if row is None:
+                # Check each new IP once against what LOG_PATTERN would match
+                if space <= 0 or not _is_ip_token(ip):
+                    count_regex(line + b"\n")
+                    continue
+                row = rows[ip] = len(rows)
+
+            note_seen(row)
+            if status[0] in b"45":
+                note_failed(row)
+
+        count_block()
+        if store is not None:
+            store.trim()
+
+    count_block()
+    if store is not None:
+        return store
+
+    if compact:
+        counters.trim()
+        return counters
+    return {ip.decode("utf-8"): {"total": total, "errors": errors}
+            for ip, total, errors in zip(rows, counters.totals, counters.errors)}
+
+
+def _parse_log_bytes_detailed(buffer, start, end, approximate=False, store=None):
+    """parse_log_bytes(detailed=True): full per-IP entries with interned paths and user agents"""
+    # Keyed by the raw IP bytes while parsing, decoded once per IP at the end
+    log_dict = {} if store is None else store.hot
+    intern_path = PATHS.intern
+    intern_user_agent = USER_AGENTS.intern
+    match_rules = get_rule_set().match
+
+    for lines, terminated in _line_blocks(buffer, start, end):
+        LINE_COUNTS.read += len(lines)
+        for line in lines:
+            fields = parse_log_line(line, known_ips=log_dict) if terminated else None
+
+            if fields is None:
+                # Not readable by position - still count it, just without the extra fields
+                result = _match_line_regex(line + b"\n" if terminated else line)
+                if result is None:
+                    LINE_COUNTS.unparsed += 1
+                    continue
+                ip, status = result
+                entry = log_dict.get(ip)
+                if entry is None:
+                    entry = log_dict[ip] = new_entry(True, approximate) if store is None else store.load(ip)
+                entry["total"] += 1
+                if status[0] in b"45":
+                    entry["errors"] += 1
+                continue
+
+            ip, timestamp, _, path, status, bytes_sent, user_agent = fields
+            entry = log_dict.get(ip)
+            if entry is None:
+                entry = log_dict[ip] = new_entry(True, approximate) if store is None else store.load(ip)
+
+            entry["total"] += 1
+            if status[0] in b"45":
+                entry["errors"] += 1
+            entry["bytes"] += bytes_sent
+
+            if timestamp is not None:
+                if entry["first_seen"] is None or timestamp < entry["first_seen"]:
+                    entry["first_seen"] = timestamp
+                if entry["last_seen"] is None or timestamp > entry["last_seen"]:
+                    entry["last_seen"] = timestamp
+                entry["window"].add(timestamp, status[0] in b"45")
+
+                # Every Sigma rule is checked here, in the same pass
+                for rule in match_rules(path, status):
+                    rule_window = entry["rules"].get(rule.name)
+                    if rule_window is None:
+                        rule_window = entry["rules"][rule.name] = SlidingWindow(rule.slots)
+                    rule_window.add(timestamp, False)
+
+            if approximate:
+                # Sketches hash the raw bytes - no table needed, and memory stays fixed
+                if path:
+                    entry["paths"].add(path)
+                if user_agent:
+                    entry["agents"].add(user_agent)
+            else:
+                if path:
+                    add_id(entry["paths"], intern_path(path))
+                if user_agent:
+                    add_id(entry["agents"], intern_user_agent(user_agent))
+
+        if store is not None:
+            # Between blocks: no entry is half-updated, so cold ones can go to disk
+            store.trim()
+
+    if store is not None:
+        return store
+
+    return {ip.decode("utf-8"): entry for ip, entry in log_dict.items()}
+
+
+def _line_blocks(buffer, start, end):
+    """
+    Yields (lines, True) for each block of complete lines in buffer[start:end], without
+    their newlines, then ([last_line], False) if the range ends mid-line.
+    """
+    if end is None:
+        end = len(buffer)
+
+    # Pages of a memory-mapped log that have been read count towards resident memory
+    # until released, so a big log would otherwise end up resident as a whole
+    release = isinstance(buffer, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED")
+    released = start - start % mmap.PAGESIZE
+
+    carry = b""
+    position = start
+
+    while position < end:
+        block_end = min(position + BLOCK_SIZE, end)
+        lines = (carry + buffer[position:block_end]).split(b"\n")
+        position = block_end
+        if release:
+            done = block_end - block_end % mmap.PAGESIZE
+            if done > released:
+                buffer.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+
+        # The last piece has no newline yet - keep it for the next block
+        carry = lines.pop()
+        yield lines, True
+
+    if carry:
+        yield [carry], False
+
+
+def parse_log_line(line, known_ips=None):
+    """
+    Splits one Common/Combined Log Format line (bytes, without its newline) into
+    (ip, timestamp, method, path, status, bytes_sent, user_agent), or returns None if
+    the line doesn't fit the layout. Everything stays as bytes except timestamp (epoch
+    seconds, or None if unreadable) and bytes_sent (int). The path has its query
+    string removed and user_agent is b"" for Common Log Format lines.
+
+    `known_ips` can be any container of IPs that were already validated, to skip
+    checking them again.
+    """
+    # The status code sits right after the request's closing quote
+    head, quote, rest = line.partition(b'" ')
+    status = rest[:3]
+    if not quote or not status.isdigit() or rest[3:4] not in _STATUS_END:
+        return None
+
+    # The client IP is the first space-separated field
+    space = head.find(b" ")
+    ip = head[:space]
+    if known_ips is None or ip not in known_ips:
+        if space <= 0 or not _is_ip_token(ip):
+            return None
+
+    # [10/Oct/2025:13:55:36 +0000]
+    timestamp = None
+    open_bracket = head.find(b"[", space)
+    close_bracket = head.find(b"]", open_bracket)
+    if open_bracket != -1 and close_bracket != -1:
+        timestamp = parse_apache_time(head[open_bracket + 1:close_bracket])
+
+    # "GET /path?query HTTP/1.1"
+    request = head[head.find(b'"', max(space, close_bracket)) + 1:]
+    method, _, target = request.partition(b" ")
+    path = (target.rpartition(b" ")[0] or target).partition(b"?")[0]
+
+    # status bytes ["referer" "user agent"]
+    size_field, _, extra = rest[4:].rstrip(b"\r").partition(b" ")
+    bytes_sent = int(size_field) if size_field.isdigit() else 0
+
+    user_agent = b""
+    if extra.endswith(b'"'):
+        open_quote = extra.rfind(b'"', 0, len(extra) - 1)
+        if open_quote != -1:
+            user_agent = extra[open_quote + 1:-1]
+
+    return ip, timestamp, method, path, status, bytes_sent, user_agent
+
+
+@lru_cache(maxsize=4096)
+def parse_apache_time(stamp):
+    """
+    Converts an Apache timestamp such as b"10/Oct/2025:13:55:36 +0000" to epoch
+    seconds (UTC). A missing timezone is treated as UTC. Returns None if unreadable.
+    Cached, since consecutive lines usually share a timestamp.
+    """
+    try:
+        month = _MONTHS[stamp[3:6]]
+        seconds = calendar.timegm((int(stamp[7:11]), month, int(stamp[0:2]),
+                                   int(stamp[12:14]), int(stamp[15:17]), int(stamp[18:20])))
+    except (KeyError, ValueError):
+        return None
+
+    zone = stamp[21:26]
+    if len(zone) == 5 and zone[1:].isdigit():
+        offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+        seconds += -offset if zone[:1] == b"+" else offset
+
+    return seconds
+
+
+def new_entry(detailed=False, approximate=False):
+    """
+    Returns an empty per-IP entry. The basic structure is {"total": int, "errors": int};
+    detailed entries also hold:
+
+        bytes       total response bytes sent
+        first_seen  earliest request time (epoch seconds) or None
+        last_seen   latest request time (epoch seconds) or None
+        paths       sorted array('I') of distinct path ids in intern_table.PATHS
+        agents      sorted array('I') of distinct user agent ids in intern_table.USER_AGENTS
+        window      time_windows.SlidingWindow with the peak requests/errors in any window
+        rules       {Sigma rule name: SlidingWindow of the lines matching it} (see sigma_rules)
+
+    With `approximate`, paths and agents are HyperLogLog sketches instead; len() gives
+    the (estimated) distinct count either way.
+    """
+    if not detailed:
+        return {"total": 0, "errors": 0}
+
+    if approximate:
+        return {"total": 0, "errors": 0, "bytes": 0, "first_seen": None, "last_seen": None,
+                "paths": HyperLogLog(), "agents": HyperLogLog(), "window": SlidingWindow(), "rules": {}}
+
+    return {"total": 0, "errors": 0, "bytes": 0, "first_seen": None, "last_seen": None,
+            "paths": array("I"), "agents": array("I"), "window": SlidingWindow(), "rules": {}}
+
+
+def _is_ip_token(token):
+    """Checks that a whole (non-empty) token is what LOG_PATTERN's IP group would match at the start of the line"""
+    return _IP_TOKEN.fullmatch(token) is not None
+
+
+def _match_line_regex(line):
+    """Fallback for lines the fast engine cannot read: decode and run LOG_PATTERN"""
+    match = LOG_PATTERN.search(line.decode("utf-8", errors="replace"))
+    if match:
+        return match.group(1).encode("utf-8"), match.group(2).encode("utf-8")
+    return None
+
+
+def merge_log_dicts(target, partial, path_ids=None, agent_ids=None):
+    """
+    Adds the per-IP data from `partial` into `target` in place and returns `target`.
+    `path_ids` / `agent_ids` translate the partial's ids when it was interned by another
+    process (see InternTable.remap). An IpCounters target merges through IpCounters.merge.
+    """
+    if isinstance(target, IpCounters):
+        return target.merge(partial)
+
+    for ip, data in partial.items():
+        detailed = "paths" in data
+        entry = target.get(ip)
+        if entry is None:
+            entry = target[ip] = new_entry(detailed, isinstance(data.get("paths"), HyperLogLog))
+
+        entry["total"] += data["total"]
+        entry["errors"] += data["errors"]
+
+        if detailed:
+            entry["bytes"] += data["bytes"]
+            entry["first_seen"] = _earliest(entry["first_seen"], data["first_seen"])
+            entry["last_seen"] = _latest(entry["last_seen"], data["last_seen"])
+            entry["window"].merge(data["window"])
+            for name, rule_window in data["rules"].items():
+                if name in entry["rules"]:
+                    entry["rules"][name].merge(rule_window)
+                else:
+                    entry["rules"][name] = rule_window
+            if isinstance(entry["paths"], HyperLogLog):
+                entry["paths"].merge(data["paths"])
+                entry["agents"].merge(data["agents"])
+            else:
+                entry["paths"] = merge_ids(entry["paths"], data["paths"], path_ids)
+                entry["agents"] = merge_ids(entry["agents"], data["agents"], agent_ids)
+
+    return target
+
+
+def _earliest(first, second):
+    return second if first is None else first if second is None else min(first, second)
+
+
+def _latest(first, second):
+    return second if first is None else first if second is None else max(first, second)
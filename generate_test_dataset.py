@@ -1,12 +1,35 @@
+import argparse
 import random
 import datetime
 import csv
+import ipaddress
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 
 # --- CONFIGURATION ---
 OUTPUT_FILE = "test_access.log"
 GROUND_TRUTH_FILE = "ground_truth_labels.csv"
 
+# --- LARGE-SCALE MODE (--lines / --size) ---
+SHARD_IPS = 10_000   # IPs per unit of work - fixed, so the output doesn't depend on --workers
+BLOCK_IPS = 1_000    # IPs whose lines are shuffled together before being written
+AVG_LINE_BYTES = 80  # Turns --size into a line count
+ATTACK_SHARE = 0.001
+HIGH_VOLUME_SHARE = 0.02
+LARGE_FIRST_IP = int(ipaddress.IPv4Address("11.0.0.0"))
+LARGE_BASE_TIME = datetime.datetime(2025, 10, 10)  # Fixed, so a seed always gives the same file
+LARGE_DURATION_SECONDS = 86_400
+
+# Average lines per session of each kind (see the generators below)
+CREDENTIAL_LINES = 1000
+RECON_LINES = 125
+HIGH_VOLUME_LINES = 175
+NORMAL_LINES = 32.5
+BOUNCE_LINES = 3
+
 # Attack IPs
 ATTACKER_IPS = [
     "203.45.12.78",   # Credential stuffer
@@ -119,6 +142,11 @@ def generate_normal_user(user_ip, start_time, volume="normal"):
         error_rate = random.uniform(0.0, 0.05)
         num_unique_paths = random.randint(30, 50)
 
+    elif volume == "bounce":  # A visitor who looks at a page or two and leaves
+        num_request = random.randint(1, 5)
+        error_rate = random.uniform(0.0, 0.05)
+        num_unique_paths = random.randint(1, 5)
+
     else:  # normal
         num_request = random.randint(15, 50)
         error_rate = random.uniform(0.0, 0.05)
@@ -154,7 +182,140 @@ def generate_labeled_dataset():
     pass
 
 
-def main():
+def session_mix(lines_per_ip, attack_share=ATTACK_SHARE) -> tuple[float, float]:
+    """
+    Works out how benign IPs should behave for the dataset to average `lines_per_ip`.
+
+    Returns (normal_share, sessions_per_ip): below a normal user's ~32 lines, part of
+    the ordinary users become short "bounce" visits; above it, every benign IP comes
+    back for several sessions spread over the day. Attackers always run one attack.
+    """
+    attack_lines = attack_share * (2 * CREDENTIAL_LINES + RECON_LINES) / 3  # 2 in 3 attackers credential-stuff
+    ordinary_share = 1 - attack_share - HIGH_VOLUME_SHARE
+    benign_lines = lines_per_ip - attack_lines
+    one_session_lines = HIGH_VOLUME_SHARE * HIGH_VOLUME_LINES + ordinary_share * NORMAL_LINES
+
+    if benign_lines > one_session_lines:
+        return 1.0, benign_lines / one_session_lines
+
+    per_ordinary = (benign_lines - HIGH_VOLUME_SHARE * HIGH_VOLUME_LINES) / ordinary_share
+    normal_share = (per_ordinary - BOUNCE_LINES) / (NORMAL_LINES - BOUNCE_LINES)
+    return min(1.0, max(0.0, normal_share)), 1.0
+
+
+def generate_shard(shard, first_ip, ip_count, seed, normal_share, sessions_per_ip, attack_share, part_dir):
+    """
+    Writes the lines and labels of IPs [first_ip, first_ip + ip_count) to part files in
+    `part_dir`. Only BLOCK_IPS IPs' lines are held (and shuffled) at a time.
+    Returns the number of lines written.
+    """
+    # The session generators use the module RNG, so each shard re-seeds it
+    random.seed(seed * 1_000_003 + shard)
+    lines_written = 0
+
+    with open(os.path.join(part_dir, f"{shard}.log"), "w") as log_file, \
+            open(os.path.join(part_dir, f"{shard}.csv"), "w", newline="") as labels_file:
+        writer = csv.writer(labels_file)
+
+        for block_start in range(first_ip, first_ip + ip_count, BLOCK_IPS):
+            block = []
+            for index in range(block_start, min(block_start + BLOCK_IPS, first_ip + ip_count)):
+                ip = str(ipaddress.IPv4Address(LARGE_FIRST_IP + index))
+                start_time = LARGE_BASE_TIME + datetime.timedelta(seconds=random.randrange(LARGE_DURATION_SECONDS))
+                roll = random.random()
+
+                if roll < attack_share:
+                    if random.random() < 1 / 3:
+                        block.extend(generate_recon_scan(ip, start_time))
+                    else:
+                        block.extend(generate_credential_stuffing(ip, start_time))
+                    writer.writerow([ip, "ATTACK"])
+                    continue
+
+                if roll < attack_share + HIGH_VOLUME_SHARE:
+                    volume = "high"
+                else:
+                    volume = "normal" if random.random() < normal_share else "bounce"
+
+                # Whole sessions plus one more with the leftover probability
+                sessions = int(sessions_per_ip) + (random.random() < sessions_per_ip % 1)
+                for session in range(sessions):
+                    if session:
+                        start_time = LARGE_BASE_TIME + datetime.timedelta(seconds=random.randrange(LARGE_DURATION_SECONDS))
+                    block.extend(generate_normal_user(ip, start_time, volume=volume))
+                writer.writerow([ip, "BENIGN"])
+
+            random.shuffle(block)
+            if block:
+                log_file.write("\n".join(block) + "\n")
+            lines_written += len(block)
+
+    return lines_written
+
+
+def generate_large_dataset(lines, ip_count=None, seed=42, workers=1, attack_share=ATTACK_SHARE,
+                           output_file=OUTPUT_FILE, ground_truth_file=GROUND_TRUTH_FILE) -> int:
+    """
+    Streams a dataset of about `lines` lines from `ip_count` distinct IPs to `output_file`,
+    with every IP's label in `ground_truth_file`.
+
+    IPs are split into fixed shards that are generated (in `workers` processes) into
+    part files and appended in order, so memory stays bounded by BLOCK_IPS IPs per worker
+    and the same seed gives the same files whatever the number of workers.
+    Returns the number of lines written.
+    """
+    ip_count = ip_count or max(1, lines // 40)
+    normal_share, sessions_per_ip = session_mix(lines / ip_count, attack_share)
+    shards = list(enumerate(range(0, ip_count, SHARD_IPS)))
+
+    print(f"[*] Generating ~{lines:,} log lines from {ip_count:,} IPs in {len(shards)} shard(s) "
+          f"({workers} worker(s), seed {seed})...")
+
+    # Part files go next to the output, so appending them never crosses file systems
+    part_dir = tempfile.mkdtemp(prefix="dataset_parts_", dir=os.path.dirname(os.path.abspath(output_file)))
+    total_lines = 0
+    try:
+        arguments = [(shard, first_ip, min(SHARD_IPS, ip_count - first_ip), seed, normal_share, sessions_per_ip,
+                      attack_share, part_dir) for shard, first_ip in shards]
+
+        with open(output_file, "w") as log_file, open(ground_truth_file, "w", newline="") as labels_file:
+            labels_file.write("IP Address,Label\r\n")
+
+            pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                results = pool.map(generate_shard, *zip(*arguments)) if pool else (generate_shard(*args) for args in arguments)
+
+                # Shards come back in order; each is appended and deleted as soon as it is done
+                for (shard, _), shard_lines in zip(shards, results):
+                    for suffix, target in ((".log", log_file), (".csv", labels_file)):
+                        part_path = os.path.join(part_dir, f"{shard}{suffix}")
+                        with open(part_path, "r", newline="") as part_file:
+                            shutil.copyfileobj(part_file, target)
+                        os.remove(part_path)
+                    total_lines += shard_lines
+            finally:
+                if pool:
+                    pool.shutdown()
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+
+    print(f"[+] Generated {total_lines:,} log entries")
+    print(f"[+] Logs written to {output_file}")
+    print(f"[+] Ground truth written to {ground_truth_file}")
+    return total_lines
+
+
+def parse_size(size) -> int:
+    """'2G' -> 2147483648 (K, M, G and T are powers of 1024)"""
+    size = str(size).strip().upper().rstrip("B")
+    units = {"K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def generate_small_dataset(output_file=OUTPUT_FILE, ground_truth_file=GROUND_TRUTH_FILE):
+    """The original hand-tuned dataset: 3 attackers and 10-15 legitimate users."""
     all_logs = []
     ground_truth = {}
     legit_user_count = 0
@@ -203,11 +364,11 @@ def main():
 
     random.shuffle(all_logs)
 
-    with open(OUTPUT_FILE, "w") as f:
+    with open(output_file, "w") as f:
         for log in all_logs:
             f.write(log + "\n")
 
-    with open(GROUND_TRUTH_FILE, "w", newline="") as f:
+    with open(ground_truth_file, "w", newline="") as f:
         writer = csv.writer(f)
         writer.writerow(["IP Address", "Label"])
         for ip, label in ground_truth.items():
@@ -215,8 +376,31 @@ def main():
 
 
     print(f"[+] Generated {len(all_logs)} log entries")
-    print(f"[+] Logs written to {OUTPUT_FILE}")
-    print(f"[+] Ground truth written to {GROUND_TRUTH_FILE}")
+    print(f"[+] Logs written to {output_file}")
+    print(f"[+] Ground truth written to {ground_truth_file}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a labelled Apache log dataset and its ground truth.")
+    parser.add_argument("--lines", type=int, help="Large-scale mode: Approximate number of log lines to stream out.")
+    parser.add_argument("--size", help="Large-scale mode: Approximate file size instead of --lines (e.g. 500M, 2G).")
+    parser.add_argument("--ips", type=int, help="Optional: Distinct IPs in large-scale mode (default: lines / 40).")
+    parser.add_argument("--attack-share", type=float, default=ATTACK_SHARE, help=f"Optional: Fraction of IPs that attack (default: {ATTACK_SHARE}).")
+    parser.add_argument("--seed", type=int, help="Optional: Random seed, for reproducible datasets (large-scale mode default: 42).")
+    parser.add_argument("--workers", type=int, default=1, help="Optional: Worker processes in large-scale mode.")
+    parser.add_argument("-o", "--output", default=OUTPUT_FILE, help=f"Optional: Log file to write (default: {OUTPUT_FILE}).")
+    parser.add_argument("--labels", default=GROUND_TRUTH_FILE, help=f"Optional: Ground truth CSV to write (default: {GROUND_TRUTH_FILE}).")
+    args = parser.parse_args()
+
+    if args.lines or args.size:
+        lines = args.lines or parse_size(args.size) // AVG_LINE_BYTES
+        generate_large_dataset(lines, args.ips, seed=42 if args.seed is None else args.seed, workers=args.workers,
+                               attack_share=args.attack_share, output_file=args.output, ground_truth_file=args.labels)
+        return
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    generate_small_dataset(args.output, args.labels)
 
 
 if __name__ == "__main__":
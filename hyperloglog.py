@@ -0,0 +1,82 @@
+import hashlib
+import math
+from functools import lru_cache
+
+
+# 2^8 = 256 one-byte registers per sketch. The standard error of a HyperLogLog
+# estimate is 1.04 / sqrt(registers), so about 6.5% here (and within ~13% for 95%
+# of sketches), whatever the true count. Each extra bit of precision doubles the
+# memory and divides the error by sqrt(2).
+DEFAULT_PRECISION = 8
+
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(66)]
+
+
+@lru_cache(maxsize=65536)
+def hash_value(value: bytes) -> int:
+    """64-bit hash that is the same in every process, so sketches from workers or other hosts can be merged."""
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    """
+    Fixed-size sketch that estimates how many distinct values were added to it.
+
+    Memory is 2^precision bytes no matter how many values are added, which keeps the
+    per-IP cost of tracking unique paths and user agents constant for scanners that
+    hit thousands of URLs. len() returns the estimate, so a sketch can stand in for
+    an exact set or id array wherever only the count is used.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: bytes) -> None:
+        """Adds a value (bytes) to the sketch."""
+        self.add_hash(hash_value(value))
+
+    def add_hash(self, value_hash: int) -> None:
+        """Adds a value by its 64-bit hash."""
+        # The low bits pick a register, the rest record the longest run of leading zeros
+        index = value_hash & ((1 << self.precision) - 1)
+        remaining = value_hash >> self.precision
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Folds another sketch of the same precision into this one (the union of both)."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Returns the estimated number of distinct values added."""
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers * registers / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+
+        # Small cardinalities: linear counting on the empty registers is more accurate
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * registers and empty:
+            estimate = registers * math.log(registers / empty)
+
+        return round(estimate)
+
+    def __len__(self):
+        return self.count()
+
+    def __eq__(self, other):
+        return (isinstance(other, HyperLogLog) and self.precision == other.precision
+                and self.registers == other.registers)
+
+    def __getstate__(self):
+        return self.precision, bytes(self.registers)
+
+    def __setstate__(self, state):
+        self.precision, registers = state
+        self.registers = bytearray(registers)
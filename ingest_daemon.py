@@ -0,0 +1,334 @@
+import asyncio
+import json
+import re
+import time
+from array import array
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from file_parser import merge_log_dicts, parse_log_bytes
+from intern_table import PATHS, USER_AGENTS
+from reporting import top_ips
+from sigma_rules import get_rule_set
+from time_windows import BUCKET_SECONDS
+
+
+SYSLOG_PORT = 5140
+HTTP_PORT = 8080
+SERVE_INTERVAL = 10.0  # Seconds between re-scoring
+MAX_QUEUE_BYTES = 64 * 2**20  # Log data waiting to be parsed; beyond this new data is refused / dropped
+MAX_BODY_BYTES = 8 * 2**20    # Largest POST /ingest body
+INGEST_BATCH_BYTES = 4 * 2**20  # Parsed in one go before giving the event loop back
+STATE_TTL_SECONDS = 3600
+TOP_LIMIT = 100
+# Interned paths + user agents before the tables are first rebuilt from the live state
+# (then again each time they double), so values only expired IPs used are dropped
+INTERN_COMPACT_AT = 100_000
+
+# Where the Apache line starts inside a syslog message ("<134>Oct 10 13:55:36 web01 apache: 10.0.0.1 - - [...")
+_APACHE_LINE_START = re.compile(rb"(?:\d{1,3}(?:\.\d{1,3}){3}|[0-9a-fA-F]*:[0-9a-fA-F:]+) \S+ \S+ \[")
+
+_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class IngestDaemon:
+    """
+    Long-running ingest service: takes Apache log lines from a local UDP syslog port and
+    an HTTP POST /ingest endpoint, keeps rolling per-IP state and re-scores it every
+    `interval` seconds. GET /anomalies returns the current top anomalies and GET /stats
+    the counters.
+
+    Received data waits in one queue bounded by `max_queue_bytes`. When it is full,
+    POSTs get a 503 with Retry-After (backpressure) and UDP datagrams, which can't be
+    pushed back, are dropped; both are counted. Scoring (`score`, a blocking
+    log_dict -> (anomalous_ips, score_dict) function) runs in a thread on the state as
+    it was when scoring started, while new lines are parsed into a fresh state that is
+    merged back afterwards, so the queue keeps draining. A scoring error is logged and
+    counted, and the previous anomalies are served until the next run.
+
+    IPs idle for `state_ttl` seconds are forgotten: by log time in detailed mode, and
+    by when their lines arrived in counts-only mode, whose entries carry no timestamps.
+    """
+
+    def __init__(self, score, detailed=True, approximate=False, host="127.0.0.1", syslog_port=SYSLOG_PORT,
+                 http_port=HTTP_PORT, interval=SERVE_INTERVAL, max_queue_bytes=MAX_QUEUE_BYTES, state_ttl=STATE_TTL_SECONDS):
+        self.score_function = score
+        self.detailed = detailed
+        self.approximate = approximate
+        self.host = host
+        self.syslog_port = syslog_port
+        self.http_port = http_port
+        self.interval = interval
+        self.max_queue_bytes = max_queue_bytes
+        self.state_ttl = state_ttl
+
+        self.log_dict = {}
+        self.top = []
+        self.scored_at = None
+        self.counters = {"udp_datagrams": 0, "udp_lines": 0, "udp_dropped_lines": 0, "udp_ignored": 0,
+                         "http_posts": 0, "http_lines": 0, "http_rejected_posts": 0, "http_rejected_lines": 0,
+                         "lines_parsed": 0, "expired_ips": 0, "scoring_runs": 0, "scoring_errors": 0}
+        self.last_scoring_seconds = None
+
+        self._arrivals = {}      # Counts-only: ip -> time.monotonic() of its latest lines
+        self._scoring = None     # The state being scored, while self.log_dict collects new lines
+        self._compact_at = INTERN_COMPACT_AT
+
+        self._queue = deque()
+        self._queued_bytes = 0
+        self._data_ready = asyncio.Event()
+        self._state_lock = asyncio.Lock()
+        self._transport = None
+        self._server = None
+
+    async def start(self) -> None:
+        """Binds both ports (port 0 picks a free one; the real ports are stored back)."""
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: _SyslogProtocol(self),
+                                                                 local_addr=(self.host, self.syslog_port))
+        self.syslog_port = self._transport.get_extra_info("sockname")[1]
+
+        self._server = await asyncio.start_server(self._handle_http, self.host, self.http_port)
+        self.http_port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        """Starts the listeners, then parses and re-scores until cancelled."""
+        await self.start()
+        print(f"[*] Listening for syslog on udp://{self.host}:{self.syslog_port} "
+              f"and HTTP on http://{self.host}:{self.http_port} (POST /ingest, GET /anomalies, GET /stats)")
+        try:
+            await asyncio.gather(self._consume(), self._rescore())
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+        if self._server is not None:
+            self._server.close()
+
+    def offer(self, data: bytes, source: str) -> bool:
+        """Queues complete lines from `source` ("udp" / "http"). Returns False (and counts the loss) when the queue is full."""
+        lines = data.count(b"\n")
+        if self._queued_bytes + len(data) > self.max_queue_bytes:
+            if source == "udp":
+                self.counters["udp_dropped_lines"] += lines
+            else:
+                self.counters["http_rejected_posts"] += 1
+                self.counters["http_rejected_lines"] += lines
+            return False
+
+        self.counters[f"{source}_lines"] += lines
+        self._queue.append(data)
+        self._queued_bytes += len(data)
+        self._data_ready.set()
+        return True
+
+    def drain(self, limit: int | None = None) -> int:
+        """Parses queued data (up to about `limit` bytes) into the per-IP state. Returns the lines parsed."""
+        chunks, size = [], 0
+        while self._queue and (limit is None or size < limit):
+            chunk = self._queue.popleft()
+            chunks.append(chunk)
+            size += len(chunk)
+        self._queued_bytes -= size
+        if not chunks:
+            return 0
+
+        data = b"".join(chunks)
+        partial = parse_log_bytes(data, 0, len(data), self.detailed, self.approximate)
+        merge_log_dicts(self.log_dict, partial)
+        if not self.detailed:
+            self._arrivals.update(dict.fromkeys(partial, time.monotonic()))
+        lines = data.count(b"\n")
+        self.counters["lines_parsed"] += lines
+        return lines
+
+    async def score(self) -> None:
+        """Expires idle IPs and re-scores the state in a worker thread; the result backs GET /anomalies."""
+        loop = asyncio.get_running_loop()
+        async with self._state_lock:
+            state, self.log_dict = self.log_dict, {}
+            arrivals, self._arrivals = self._arrivals, {}
+            self._scoring = state
+
+        try:
+            start_time = time.perf_counter()
+            self.top = await loop.run_in_executor(None, self._score_state, state, arrivals)
+            self.last_scoring_seconds = time.perf_counter() - start_time
+            self.scored_at = time.time()
+            self.counters["scoring_runs"] += 1
+        except Exception as error:
+            self.counters["scoring_errors"] += 1
+            print(f"\n[!] ERROR: Scoring failed, keeping the previous anomalies: {error!r}")
+        finally:
+            async with self._state_lock:
+                # Lines parsed while scoring are folded into the scored state
+                merge_log_dicts(state, self.log_dict)
+                arrivals.update(self._arrivals)
+                self.log_dict, self._arrivals, self._scoring = state, arrivals, None
+                await loop.run_in_executor(None, self._compact_intern_tables, state)
+
+    def stats(self) -> dict:
+        return {**self.counters, "ips": self._ip_count(), "anomalies": len(self.top),
+                "interned_values": len(PATHS) + len(USER_AGENTS),
+                "queued_bytes": self._queued_bytes, "max_queue_bytes": self.max_queue_bytes,
+                "last_scoring_seconds": self.last_scoring_seconds, "scored_at": self.scored_at}
+
+    async def _consume(self):
+        while True:
+            await self._data_ready.wait()
+            async with self._state_lock:
+                self.drain(INGEST_BATCH_BYTES)
+            if not self._queue:
+                self._data_ready.clear()
+            await asyncio.sleep(0)  # Let the listeners run between batches
+
+    async def _rescore(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.score()
+            print(f"[*] {time.strftime('%H:%M:%S')} - {len(self.log_dict)} IPs, {len(self.top)} anomalies "
+                  f"(dropped: {self.counters['udp_dropped_lines']} UDP lines, "
+                  f"{self.counters['http_rejected_posts']} POSTs refused)")
+
+    def _score_state(self, log_dict, arrivals):
+        """Runs in the scoring thread, on a state the event loop no longer touches. Returns the new top anomalies."""
+        self._expire_idle(log_dict, arrivals)
+        if not log_dict:
+            return []
+
+        anomalous_ips, score_dict = self.score_function(log_dict)
+        flagged = {ip: log_dict[ip] for ip in anomalous_ips}
+        rule_set = get_rule_set()
+        return [{"ip": ip, "total": data["total"], "errors": data["errors"], "score": round(score_dict[ip], 4),
+                 "sigma_matches": rule_set.evaluate(data) if "rules" in data else None}
+                for ip, data in top_ips(flagged, score_dict, TOP_LIMIT, rank_by="score")]
+
+    def _expire_idle(self, log_dict, arrivals):
+        """Forgets IPs with no requests in the last `state_ttl` seconds, so the state keeps rolling."""
+        if not self.state_ttl:
+            return
+
+        if not self.detailed:
+            cutoff = time.monotonic() - self.state_ttl
+            idle = [ip for ip, arrived in arrivals.items() if arrived < cutoff]
+            for ip in idle:
+                del log_dict[ip], arrivals[ip]
+            self.counters["expired_ips"] += len(idle)
+            return
+
+        newest = max((data["last_seen"] for data in log_dict.values() if data["last_seen"] is not None), default=None)
+        if newest is None:
+            return
+
+        cutoff = newest - self.state_ttl
+        idle = [ip for ip, data in log_dict.items() if data["last_seen"] is not None and data["last_seen"] < cutoff]
+        for ip in idle:
+            del log_dict[ip]
+        self.counters["expired_ips"] += len(idle)
+
+        # Buckets before the cutoff are folded into each window's peaks, so windows stay
+        # as small as the TTL however long an IP keeps sending
+        bucket = int(cutoff) // BUCKET_SECONDS
+        for data in log_dict.values():
+            data["window"].forget_before(bucket)
+            for rule_window in data["rules"].values():
+                rule_window.forget_before(bucket)
+
+    def _compact_intern_tables(self, log_dict):
+        """Rebuilds PATHS / USER_AGENTS from the ids live entries use, once they pass `_compact_at` values."""
+        if not self.detailed or self.approximate or len(PATHS) + len(USER_AGENTS) < self._compact_at:
+            return
+
+        for table, field in ((PATHS, "paths"), (USER_AGENTS, "agents")):
+            live_ids = set()
+            for data in log_dict.values():
+                live_ids.update(data[field])
+            id_map = table.compact(live_ids)
+            for data in log_dict.values():
+                data[field] = array("I", [id_map[value_id] for value_id in data[field]])
+        self._compact_at = max(INTERN_COMPACT_AT, 2 * (len(PATHS) + len(USER_AGENTS)))
+
+    def _ip_count(self):
+        if self._scoring is None:
+            return len(self.log_dict)
+        return len(self._scoring) + sum(ip not in self._scoring for ip in self.log_dict)
+
+    async def _handle_http(self, reader, writer):
+        try:
+            status, body, headers = await self._route(reader)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            status, body, headers = 400, {"error": "malformed request"}, {}
+
+        payload = json.dumps(body).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json",
+                f"Content-Length: {len(payload)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _route(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return 400, {"error": "malformed request line"}, {}
+        method, target, _ = request_line
+
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path == "/ingest":
+            if method != "POST":
+                return 405, {"error": "use POST"}, {"Allow": "POST"}
+            if "content-length" not in headers:
+                return 411, {"error": "Content-Length required"}, {}
+            length = int(headers["content-length"])
+            if length > MAX_BODY_BYTES:
+                return 413, {"error": f"body over {MAX_BODY_BYTES} bytes"}, {}
+
+            data = await reader.readexactly(length)
+            if data and not data.endswith(b"\n"):
+                data += b"\n"
+            self.counters["http_posts"] += 1
+            if not self.offer(data, "http"):
+                return 503, {"error": "ingest queue full"}, {"Retry-After": "1"}
+            return 202, {"accepted": data.count(b"\n")}, {}
+
+        if method != "GET":
+            return 405, {"error": "use GET"}, {"Allow": "GET"}
+        if url.path == "/anomalies":
+            limit = int(parse_qs(url.query).get("limit", [TOP_LIMIT])[0])
+            if limit < 0:
+                return 400, {"error": "limit must be 0 or more"}, {}
+            return 200, {"scored_at": self.scored_at, "ips": self._ip_count(), "anomalies": self.top[:limit]}, {}
+        if url.path == "/stats":
+            return 200, self.stats(), {}
+        return 404, {"error": "not found"}, {}
+
+
+class _SyslogProtocol(asyncio.DatagramProtocol):
+    """Receives syslog datagrams (RFC 3164 / 5424, or bare log lines) and queues the Apache lines in them."""
+
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def datagram_received(self, data, addr):
+        self.daemon.counters["udp_datagrams"] += 1
+        lines = [line for line in map(apache_line, data.splitlines()) if line]
+        if not lines:
+            self.daemon.counters["udp_ignored"] += 1
+            return
+        self.daemon.offer(b"\n".join(lines) + b"\n", "udp")
+
+
+def apache_line(message: bytes) -> bytes | None:
+    """Strips the syslog header (priority, timestamp, host, tag) off a message; None if it holds no Apache line."""
+    match = _APACHE_LINE_START.search(message)
+    return message[match.start():] if match else None
@@ -0,0 +1,66 @@
+from array import array
+from bisect import bisect_left
+
+
+class InternTable:
+    """
+    Maps strings (request paths, user agents) to small integer ids, so each distinct
+    value is stored once no matter how many IPs requested it. Per-IP data then only
+    holds compact arrays of ids.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def intern(self, value) -> int:
+        """Returns the id for `value`, adding it to the table if it is new."""
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+    def remap(self, values) -> list[int]:
+        """Interns another table's values; result[old_id] is the id in this table."""
+        return [self.intern(value) for value in values]
+
+    def compact(self, live_ids) -> list:
+        """
+        Drops the values whose ids aren't in `live_ids`, for long-running processes.
+        Returns id_map, where id_map[old_id] is the new id of a kept value (None if
+        dropped). Kept values stay in the same order, so sorted id arrays stay sorted.
+        """
+        id_map = [None] * len(self.values)
+        values = []
+        for old_id in sorted(live_ids):
+            id_map[old_id] = len(values)
+            values.append(self.values[old_id])
+        self.values = values
+        self.ids = {value: value_id for value_id, value in enumerate(values)}
+        return id_map
+
+    def __getitem__(self, value_id):
+        return self.values[value_id]
+
+    def __len__(self):
+        return len(self.values)
+
+
+def add_id(ids: array, value_id: int) -> None:
+    """Adds an id to a sorted array of unique ids (in place)."""
+    index = bisect_left(ids, value_id)
+    if index == len(ids) or ids[index] != value_id:
+        ids.insert(index, value_id)
+
+
+def merge_ids(ids: array, other_ids, id_map=None) -> array:
+    """Returns the sorted union of two id arrays, translating `other_ids` through `id_map` first."""
+    if id_map is not None:
+        other_ids = [id_map[value_id] for value_id in other_ids]
+    return array("I", sorted(set(ids).union(other_ids)))
+
+
+# Global tables shared by everything parsed in this process
+PATHS = InternTable()
+USER_AGENTS = InternTable()
@@ -0,0 +1,454 @@
+import hashlib
+import socket
+from array import array
+from functools import partial
+from itertools import islice
+
+
+# Rows are added at least this many at a time, then by 1/8 of the current capacity
+ROW_CHUNK = 4096
+ADDRESS_SIZE = 16
+# Rows turned back into IP text per numpy pass when iterating
+_TEXT_ROWS = 65536
+# Address table slots to start with; it doubles to stay at most half full
+TABLE_SLOTS = 4096
+
+# IPv4 is stored IPv4-mapped (::ffff:a.b.c.d), so both families share one 16-byte column
+_V4_PREFIX = bytes(10) + b"\xff\xff"
+# Tokens that aren't a canonical address ("2001:DB8::1", "deadbeef", ...) get a hash in the
+# discard-only 0100::/64 block (RFC 6666), which no client can log from, plus their text in `names`
+_TOKEN_PREFIX = b"\x01\x00" + bytes(6)
+
+
+class IpCounters:
+    """
+    Counts-only per-IP data as parallel typed columns instead of {ip: {"total", "errors"}}.
+
+    Row i holds one client IP: its 16-byte packed address in `addresses` and its counts
+    in totals[i] / errors[i] (array("Q")). Rows keep first-seen order. That is 32 bytes
+    an IP instead of a str key and a dict, roughly a tenth of the memory.
+
+    While counting, rows are found by address in an _AddressTable (numpy open addressing,
+    8-16 bytes an IP) a block at a time, so each IP is packed as its block is counted and
+    no per-IP Python objects live for the whole parse. The table is dropped by trim().
+
+    The columns grow in chunks of at least ROW_CHUNK rows (see reserve), so they can
+    hold more rows than `size`. arrays() hands totals and errors to numpy as views,
+    without copying; views have to be dropped before rows are added again.
+
+    For everything else it reads like the log_dict it replaces: len, iteration over the
+    IP strings, items() / values() with {"total", "errors"} entries, [ip], get and in.
+    """
+
+    def __init__(self):
+        self.addresses = bytearray()
+        self.totals = array("Q")
+        self.errors = array("Q")
+        self.size = 0
+        self.names = {}      # packed address -> text, for tokens that aren't canonical addresses
+        self._table = None   # _AddressTable of the rows, built on the first lookup
+
+    def reserve(self, rows: int) -> None:
+        """Makes rows up to `rows` usable (zeroed), growing the count columns by a whole chunk when full."""
+        if rows > len(self.totals):
+            grow = max(rows - len(self.totals), ROW_CHUNK, len(self.totals) // 8)
+            self.totals.frombytes(bytes(8 * grow))
+            self.errors.frombytes(bytes(8 * grow))
+        self.size = max(self.size, rows)
+
+    def count(self, seen: array, failed: array, rows: int) -> None:
+        """
+        Adds a block of lines: `seen` holds the row of every line and `failed` the row of
+        every 4xx/5xx line (array("I")). `rows` is the number of rows in use after the block.
+        """
+        import numpy as np
+
+        self.reserve(rows)
+        if not seen:
+            return
+        _add_rows(np.frombuffer(self.totals, dtype=np.uint64, count=rows), np.frombuffer(seen, dtype=np.uint32), rows)
+        _add_rows(np.frombuffer(self.errors, dtype=np.uint64, count=rows), np.frombuffer(failed, dtype=np.uint32), rows)
+
+    def count_block(self, ips, seen: array, failed: array) -> None:
+        """
+        Adds a block of lines: `ips` are the block's IP tokens (raw bytes) in first-seen
+        order, `seen` holds the position in `ips` of every line and `failed` that of every
+        4xx/5xx line (array("I")). New IPs get rows in the order they appear.
+        """
+        import numpy as np
+
+        if not ips:
+            return
+        rows = self._rows_for(self._pack_many(ips))
+        for column, lines in ((self.totals, seen), (self.errors, failed)):
+            if lines:
+                _add_rows(np.frombuffer(column, dtype=np.uint64, count=self.size),
+                          rows[np.frombuffer(lines, dtype=np.uint32)], self.size)
+
+    def trim(self) -> None:
+        """Drops the spare capacity and the address table, e.g. before the counters are kept or sent to another process."""
+        del self.totals[self.size:]
+        del self.errors[self.size:]
+        self._table = None
+
+    def add(self, ip: bytes, total: int, errors: int) -> None:
+        """Adds counts for one IP token, giving it a new row if it hasn't been seen."""
+        row = int(self._rows_for(self._pack(ip))[0])
+        self.totals[row] += total
+        self.errors[row] += errors
+
+    def merge(self, partial) -> "IpCounters":
+        """merge_log_dicts() into the counters: adds another IpCounters, or any {ip: {"total", "errors"}} map."""
+        import numpy as np
+
+        if isinstance(partial, IpCounters):
+            for address, name in partial.names.items():
+                self.names.setdefault(address, name)
+            packed = bytes(partial.addresses[:partial.size * ADDRESS_SIZE])
+            partial_totals, partial_errors = partial.arrays()
+        else:
+            packed = b"".join(self._pack(ip.encode("utf-8")) for ip in partial)
+            partial_totals = np.fromiter((data["total"] for data in partial.values()), dtype=np.uint64, count=len(partial))
+            partial_errors = np.fromiter((data["errors"] for data in partial.values()), dtype=np.uint64, count=len(partial))
+
+        if packed:
+            rows = self._rows_for(packed)
+            totals, errors = self.arrays()
+            # Tokens that decode to the same text share a row, so repeats have to add up
+            np.add.at(totals, rows, partial_totals)
+            np.add.at(errors, rows, partial_errors)
+            del totals, errors
+        del partial_totals, partial_errors
+        # Only kept while merging - it would cost more than the columns themselves
+        self.trim()
+        return self
+
+    def arrays(self):
+        """(totals, errors) as uint64 numpy views of the columns, `size` long."""
+        import numpy as np
+
+        return (np.frombuffer(self.totals, dtype=np.uint64, count=self.size),
+                np.frombuffer(self.errors, dtype=np.uint64, count=self.size))
+
+    def top_by_errors(self, count: int | None = None) -> list:
+        """top_ips(rank_by="errors") in one stable numpy sort: most errors first, ties in first-seen order."""
+        import numpy as np
+
+        _, errors = self.arrays()
+        # ~ reverses the order of unsigned values, so a stable ascending sort gives descending errors
+        rows = np.argsort(~errors, kind="stable")[:count].tolist()
+        # Rebuilding every IP's text in bulk is cheaper than row by row once most rows are wanted
+        ip = list(self).__getitem__ if len(rows) > self.size // 8 else self.ip
+        return [(ip(row), {"total": self.totals[row], "errors": self.errors[row]}) for row in rows]
+
+    def address(self, row: int) -> bytes:
+        return bytes(self.addresses[row * ADDRESS_SIZE:(row + 1) * ADDRESS_SIZE])
+
+    def ip(self, row: int) -> str:
+        """The IP of a row, exactly as it appeared in the log."""
+        address = self.address(row)
+        if address.startswith(_V4_PREFIX):
+            return socket.inet_ntop(socket.AF_INET, address[12:])
+        if address.startswith(_TOKEN_PREFIX):
+            return self.names[address]
+        return socket.inet_ntop(socket.AF_INET6, address)
+
+    # --- Read access, like a log_dict ---
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        for start in range(0, self.size, _TEXT_ROWS):
+            yield from self._texts(start, min(start + _TEXT_ROWS, self.size))
+
+    def keys(self):
+        return _View(self, self.__iter__)
+
+    def values(self):
+        return _View(self, lambda: ({"total": total, "errors": errors}
+                                    for total, errors in zip(islice(self.totals, self.size), islice(self.errors, self.size))))
+
+    def items(self):
+        return _View(self, lambda: zip(self, self.values()))
+
+    def get(self, ip: str, default=None):
+        import numpy as np
+
+        address = np.frombuffer(self._pack(ip.encode("utf-8"), add_name=False), dtype=np.uint64).reshape(-1, 2)
+        row = int(self._lookup_table().find(address, self._stored())[0])
+        if row < 0:
+            return default
+        return {"total": self.totals[row], "errors": self.errors[row]}
+
+    def __getitem__(self, ip: str):
+        entry = self.get(ip)
+        if entry is None:
+            raise KeyError(ip)
+        return entry
+
+    def __contains__(self, ip):
+        return self.get(ip) is not None
+
+    def _texts(self, start, stop):
+        """The IPs of rows [start, stop). IPv4 text is written for all of them at once with numpy."""
+        import numpy as np
+
+        rows = np.frombuffer(self.addresses, dtype=np.uint8, count=(stop - start) * ADDRESS_SIZE,
+                             offset=start * ADDRESS_SIZE).reshape(-1, ADDRESS_SIZE)
+        words = rows.view(np.uint32)
+        v4 = (words[:, 0] == 0) & (words[:, 1] == 0) & (words[:, 2] == np.frombuffer(_V4_PREFIX[8:], dtype=np.uint32)[0])
+        octets = rows[v4, 12:]
+
+        # Three digit slots and a separator per octet; leading zero digits are left out
+        chars = np.empty(octets.shape + (4,), dtype=np.uint8)
+        chars[..., 0] = octets // 100 + 48
+        chars[..., 1] = octets // 10 % 10 + 48
+        chars[..., 2] = octets % 10 + 48
+        chars[..., 3] = ord(".")
+        chars[:, 3, 3] = ord("\n")
+        keep = np.ones(chars.shape, dtype=bool)
+        keep[..., 0] = octets >= 100
+        keep[..., 1] = octets >= 10
+        texts = chars[keep].tobytes().decode("ascii").split("\n")[:-1]
+        del rows, words
+
+        if len(texts) == stop - start:
+            return texts
+        # IPv6 and tokens kept by name, one at a time
+        v4_texts = iter(texts)
+        return [next(v4_texts) if is_v4 else self.ip(row) for row, is_v4 in enumerate(v4.tolist(), start)]
+
+    def __getstate__(self):
+        # The table is rebuilt on demand; there is no point pickling it to another process
+        return {**self.__dict__, "_table": None}
+
+    def _stored(self):
+        """The addresses as an (n, 2) uint64 view; drop it before adding rows."""
+        import numpy as np
+
+        return np.frombuffer(self.addresses, dtype=np.uint64).reshape(-1, 2)
+
+    def _lookup_table(self):
+        if self._table is None:
+            self._table = _AddressTable(self._stored())
+        return self._table
+
+    def _rows_for(self, packed):
+        """The rows of a run of 16-byte addresses, adding rows (and addresses) for the new ones in order."""
+        import numpy as np
+
+        keys = np.frombuffer(packed, dtype=np.uint64).reshape(-1, 2)
+        table = self._lookup_table()
+        rows, new = table.find_or_add(keys, self._stored())
+        if new.any():
+            self.addresses += keys[new].tobytes()
+            self.reserve(self.size + int(new.sum()))
+        return rows
+
+    def _pack_many(self, ips):
+        """_pack for a list of IP tokens, joined, with a shortcut for dotted quads (nearly all of them)."""
+        to_v4, from_v4 = partial(socket.inet_pton, socket.AF_INET), partial(socket.inet_ntop, socket.AF_INET)
+        packed = []
+        for ip in ips:
+            if b":" not in ip:
+                try:
+                    text = ip.decode("ascii")
+                    address = to_v4(text)
+                    if from_v4(address) == text:
+                        packed.append(_V4_PREFIX + address)
+                        continue
+                except (OSError, UnicodeDecodeError, ValueError):
+                    pass
+            packed.append(self._pack(ip))
+        return b"".join(packed)
+
+    def _pack(self, ip, add_name=True):
+        """The 16-byte address of an IP token (bytes); `names` keeps the text of the ones without a canonical form."""
+        text = ip.decode("utf-8", errors="replace")
+        try:
+            if ":" in text:
+                packed = socket.inet_pton(socket.AF_INET6, text)
+                # Mapped addresses are kept as text so they don't come back as plain IPv4
+                if socket.inet_ntop(socket.AF_INET6, packed) == text and not packed.startswith((_V4_PREFIX, _TOKEN_PREFIX)):
+                    return packed
+            else:
+                packed = socket.inet_pton(socket.AF_INET, text)
+                if socket.inet_ntop(socket.AF_INET, packed) == text:
+                    return _V4_PREFIX + packed
+        except (OSError, ValueError):
+            pass
+
+        # Probe past the (64-bit) hash of another token, however unlikely
+        salt = 0
+        while True:
+            address = _TOKEN_PREFIX + hashlib.blake2b(ip, digest_size=8, salt=salt.to_bytes(8, "little")).digest()
+            name = self.names.get(address)
+            if name is None:
+                if add_name:
+                    self.names[address] = text
+                return address
+            if name == text:
+                return address
+            salt += 1
+
+
+class _View:
+    """keys() / values() / items() of an IpCounters: sized, and iterable any number of times like a dict view."""
+
+    def __init__(self, counters, iterate):
+        self._counters = counters
+        self._iterate = iterate
+
+    def __len__(self):
+        return len(self._counters)
+
+    def __iter__(self):
+        return self._iterate()
+
+
+class _AddressTable:
+    """
+    Open-addressing hash table from 16-byte addresses to rows, looked up and filled a
+    whole batch at a time with numpy. It only holds row numbers (4 bytes a slot); the
+    addresses themselves are read from the IpCounters column, passed in as `stored`, an
+    (n, 2) uint64 view. Linear probing, doubling to stay at most half full, so a batch
+    needs only a few numpy passes.
+    """
+
+    EMPTY = 0xFFFFFFFF
+
+    def __init__(self, stored):
+        import numpy as np
+
+        slots = TABLE_SLOTS
+        while slots < 2 * len(stored):
+            slots *= 2
+        self._allocate(slots)
+        if len(stored):
+            self._place(stored, np.arange(len(stored)))
+
+    def find(self, keys, stored):
+        """The row of each key, or -1 where it isn't in the table."""
+        import numpy as np
+
+        result = np.full(len(keys), -1, dtype=np.int64)
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+        while pending.size:
+            probed = slots[pending]
+            occupant = self.rows[probed].astype(np.int64)
+            empty = occupant == self.EMPTY
+            occupant_keys = stored[np.where(empty, 0, occupant)]
+            same = ~empty & (occupant_keys[:, 0] == keys[pending, 0]) & (occupant_keys[:, 1] == keys[pending, 1])
+            result[pending[same]] = occupant[same]
+            moving = ~empty & ~same
+            slots[pending[moving]] = (probed[moving] + 1) & self.mask
+            pending = pending[moving]
+        return result
+
+    def find_or_add(self, keys, stored):
+        """
+        (rows, new) for a batch of keys: their rows, with keys not in the table yet given
+        rows from len(stored) on in the order they first appear, and a mask of those keys.
+        """
+        import numpy as np
+
+        next_row = len(stored)
+        if not len(keys):
+            return np.empty(0, dtype=np.int64), np.zeros(0, dtype=bool)
+        if next_row + len(keys) > len(self.rows) // 2:
+            self._grow(next_row + len(keys), stored)
+
+        # A new key's slot first holds next_row + its position; real rows are given out at the end
+        result = np.empty(len(keys), dtype=np.int64)
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+        claimed = []
+        while pending.size:
+            probed = slots[pending]
+            occupant = self.rows[probed].astype(np.int64)
+            empty = occupant == self.EMPTY
+            # Rows below next_row are stored addresses, the rest keys of this batch
+            earlier = occupant < next_row
+            occupant_keys = keys[np.where(earlier | empty, 0, occupant - next_row)]
+            occupant_keys[earlier] = stored[occupant[earlier]]
+            same = ~empty & (occupant_keys[:, 0] == keys[pending, 0]) & (occupant_keys[:, 1] == keys[pending, 1])
+            result[pending[same]] = occupant[same]
+
+            # Each empty slot goes to the first key that reached it; a repeat of that key finds it next pass
+            claimed_slots, first = np.unique(probed[empty], return_index=True)
+            winners = np.flatnonzero(empty)[first]
+            self.rows[claimed_slots] = next_row + pending[winners]
+            result[pending[winners]] = next_row + pending[winners]
+            claimed.append(claimed_slots)
+
+            moving = ~empty & ~same
+            slots[pending[moving]] = (probed[moving] + 1) & self.mask
+            waiting = ~same
+            waiting[winners] = False
+            pending = pending[waiting]
+
+        new = result == next_row + np.arange(len(keys))
+        rank = np.cumsum(new) - 1
+        placeholder = result >= next_row
+        result[placeholder] = next_row + rank[result[placeholder] - next_row]
+        claimed = np.concatenate(claimed)
+        self.rows[claimed] = next_row + rank[self.rows[claimed].astype(np.int64) - next_row]
+        return result, new
+
+    def _allocate(self, slots):
+        import numpy as np
+
+        self.rows = np.full(slots, self.EMPTY, dtype=np.uint32)
+        self.mask = slots - 1
+        self._shift = np.uint64(64 - (slots.bit_length() - 1))
+
+    def _grow(self, needed, stored):
+        import numpy as np
+
+        slots = len(self.rows)
+        while slots < 2 * needed:
+            slots *= 2
+        self._allocate(slots)
+        self._place(stored, np.arange(len(stored)))
+
+    def _place(self, keys, rows):
+        """Inserts keys known to be distinct and not in the table yet: each takes the first free slot."""
+        import numpy as np
+
+        slots = self._slots(keys)
+        pending = np.arange(len(keys))
+        while pending.size:
+            probed = slots[pending]
+            empty = self.rows[probed] == self.EMPTY
+            claimed_slots, first = np.unique(probed[empty], return_index=True)
+            winners = np.flatnonzero(empty)[first]
+            self.rows[claimed_slots] = rows[pending[winners]]
+            slots[pending[~empty]] = (probed[~empty] + 1) & self.mask
+            waiting = np.ones(len(pending), dtype=bool)
+            waiting[winners] = False
+            pending = pending[waiting]
+
+    def _slots(self, keys):
+        import numpy as np
+
+        # Multiplicative hashing of both halves; the top bits pick the slot
+        mixed = keys[:, 0] * np.uint64(0x9E3779B97F4A7C15) ^ keys[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)
+        mixed ^= mixed >> np.uint64(31)
+        return ((mixed * np.uint64(0x94D049BB133111EB)) >> self._shift).astype(np.int64)
+
+
+def _add_rows(column, rows, size):
+    """column[row] += 1 for every row in `rows` (repeats included), `size` being the rows in use."""
+    import numpy as np
+
+    if size <= 4 * len(rows):
+        column += np.bincount(rows, minlength=size).astype(np.uint64)
+    else:
+        # Far more rows than lines in the block - count just the ones it touched
+        touched, counts = np.unique(rows, return_counts=True)
+        column[touched] += counts.astype(np.uint64)
@@ -6,16 +6,34 @@ import sqlite3
 from dotenv import load_dotenv
 
 # --- Local Modules ---
-from file_parser import parse_apache_file
-from reporting import generate_report, export_to_csv
-from enrichment import check_cache, get_ip_reputation, update_cache
-from anomaly_detector import detect_anomalies
+from file_parser import LINE_COUNTS, find_log_files, parse_log_files
+from log_follower import LogFollower
+from reporting import generate_report, export_to_csv, top_ips
+from enrichment import CACHE_TTL_DAYS, ENRICH_WORKERS, ReputationCache, check_blocklist, enrich_ips
+from sigma_rules import get_rule_set
+from metrics import RunMetrics
+from partials import merge_partials, write_partial
+
+# anomaly_detector (NumPy + scikit-learn), rule_detector and cidr_index (NumPy) are
+# imported by the stage that uses them: loading them is most of the start-up time,
+# and --help, --counts-only runs without a model etc. don't need them
+
+
+# The reputation cache; parse checkpoints are kept in the same directory
+CACHE_DB = 'ip_cache.db'
+
+# From this much log on, the default detailed parse says what --counts-only would save
+DETAILED_NOTICE_BYTES = 256 * 2**20
 
 
 def setup_database():
     """Connects to the SQLite DB and creates the necessary table if it doesn't exist."""
-    conn = sqlite3.connect('ip_cache.db')
+    conn = sqlite3.connect(CACHE_DB)
     cursor = conn.cursor()
+
+    # WAL: readers don't block the writer, and a commit doesn't fsync the whole database
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS reputation (
             ip_address TEXT PRIMARY KEY,
@@ -28,15 +46,206 @@ def setup_database():
     return conn
 
 
+def lookup_reputation(ip_addresses, args, api_key, cache, blocklist=None, metrics=None) -> dict:
+    """Resolves {ip: (score, country)} for the IPs being reported, if enrichment is enabled."""
+    metrics = metrics or RunMetrics()
+    ip_addresses = list(ip_addresses)
+
+    # Local blocklists first (no quota), then the cache in bulk, then every miss in one
+    # concurrent, rate-limited batch
+    reputation = {}
+    if args.enrich and blocklist is not None:
+        reputation = check_blocklist(ip_addresses, blocklist)
+        print(f"[*] {len(reputation)} IPs matched the local blocklists")
+        metrics.count("blocklist_hits", len(reputation))
+
+    if args.enrich and api_key:
+        remaining = [ip for ip in ip_addresses if ip not in reputation]
+        cached = cache.get_many(remaining)
+        reputation.update(cached)
+
+        misses = [ip for ip in remaining if ip not in reputation]
+        fetched = enrich_ips(misses, api_key, workers=args.enrich_workers)
+        cache.put_many(fetched)
+        reputation.update(fetched)
+
+        metrics.count("cache_hits", len(cached))
+        metrics.count("cache_misses", len(misses))
+        metrics.count("api_calls", len(misses))
+        metrics.count("api_failures", len(misses) - len(fetched))
+
+    return reputation
+
+
+def iter_report_rows(ip_items, anomalous_ips, score_dict, reputation):
+    """Yields one report row per (ip, data) pair, so a full CSV never needs every row in memory at once."""
+    rule_set = get_rule_set()
+
+    for ip, data in ip_items:
+        score, country = reputation.get(ip, ("N/A", "N/A"))  # Default values
+
+        # Check if the IP was flagged by the model
+        is_anomaly = ip in anomalous_ips
+        anomaly_score = score_dict.get(ip, 0.0)
+
+        # Sigma rules fired by this IP (only evaluated by the detailed parse)
+        sigma_matches = "N/A"
+        if "rules" in data:
+            sigma_matches = ", ".join(rule_set.evaluate(data)) or "-"
+
+        yield (ip, data["total"], data["errors"], score, country, is_anomaly, anomaly_score, sigma_matches)
+
+
+def build_report_data(sorted_ips, anomalous_ips, score_dict, args, api_key, cache, blocklist=None):
+    """Builds the report rows for each (ip, data) pair, enriching them if requested."""
+    sorted_ips = list(sorted_ips)
+    reputation = lookup_reputation((ip for ip, _ in sorted_ips), args, api_key, cache, blocklist)
+    return list(iter_report_rows(sorted_ips, anomalous_ips, score_dict, reputation))
+
+
+def score_ips(log_dict, args, model=None) -> tuple[set, dict]:
+    """Runs the detection stage: the Isolation Forest, or only the Sigma rules with --rules-only."""
+    if args.rules_only:
+        from rule_detector import detect_rule_anomalies
+        return detect_rule_anomalies(log_dict)
+
+    from anomaly_detector import ANOMALY_THRESHOLD, detect_anomalies
+    return detect_anomalies(log_dict, threshold=ANOMALY_THRESHOLD, model=model, jobs=args.score_jobs,
+                            memory_mb=args.score_memory)
+
+
+def scoring_error(args, error) -> str:
+    """The message for a failed detection stage, naming the model only when --model gave one."""
+    if args.model:
+        return f"Could not score with model '{args.model}': {error}"
+    return f"Could not score the IPs: {error}"
+
+
+def follow_log(args, api_key, cache, blocklist=None, model=None, poll_seconds=1.0):
+    """Tails the log, updating the per-IP counters as lines arrive and re-scoring every --interval seconds."""
+    follower = LogFollower(args.file, detailed=not args.counts_only, approximate=args.approx)
+    print(f"[*] Following log file: {args.file} (re-scoring every {args.interval:g}s, Ctrl+C to stop)...")
+
+    report_data = []
+    next_scoring = time.monotonic()
+    try:
+        while True:
+            new_lines = follower.poll()
+
+            if time.monotonic() >= next_scoring:
+                next_scoring = time.monotonic() + args.interval
+                log_dict = follower.log_dict
+
+                if log_dict:
+                    try:
+                        anomalous_ips, score_dict = score_ips(log_dict, args, model)
+                    except (OSError, ValueError) as error:
+                        print(f"\n[!] ERROR: {scoring_error(args, error)}")
+                        break
+
+                    # Only show the flagged IPs, worst first - the full table is too noisy to watch
+                    flagged = top_ips({ip: log_dict[ip] for ip in anomalous_ips}, score_dict, args.top, rank_by="score")
+                    report_data = build_report_data(flagged, anomalous_ips, score_dict, args, api_key, cache, blocklist)
+
+                    print(f"\n[*] {time.strftime('%H:%M:%S')} - {follower.lines_read} lines, {len(log_dict)} IPs")
+                    generate_report(report_data)
+
+            # Nothing new yet - don't spin on the file
+            if not new_lines:
+                time.sleep(poll_seconds)
+
+    except KeyboardInterrupt:
+        print("\n[*] Stopped following.")
+
+    finally:
+        follower.close()
+
+    if args.output and report_data:
+        export_to_csv(report_data, args.output)
+
+
+def serve_logs(args, model=None):
+    """Runs the ingest daemon: log lines arrive over syslog/UDP and HTTP and are re-scored every --interval seconds."""
+    import asyncio
+    from ingest_daemon import HTTP_PORT, SERVE_INTERVAL, SYSLOG_PORT, IngestDaemon
+
+    daemon = IngestDaemon(lambda log_dict: score_ips(log_dict, args, model), detailed=not args.counts_only,
+                          approximate=args.approx, host=args.bind,
+                          syslog_port=SYSLOG_PORT if args.syslog_port is None else args.syslog_port,
+                          http_port=HTTP_PORT if args.http_port is None else args.http_port,
+                          interval=args.interval or SERVE_INTERVAL,
+                          max_queue_bytes=int(args.queue_mb * 2**20), state_ttl=args.state_ttl)
+    try:
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        print("\n[*] Stopped serving.")
+    except OSError as error:
+        print(f"\n[!] ERROR: Could not listen on {args.bind}: {error}")
+
+
 def main():
     """The main log analyser function"""
     parser = argparse.ArgumentParser(description="A script to parse Apache log files for errors.")
-    parser.add_argument("-f", "--file", required=True, help="Path to the Apache access log file.")
-    parser.add_argument("-o", "--output", help="Optional: Path to save the report as a CSV file.")
+    parser.add_argument("-f", "--file", help="Path to the Apache access log file. Also accepts a quoted glob or a directory; .gz/.bz2/.xz files are read directly. Parsed in detail by default (see --counts-only).")
+    parser.add_argument("-o", "--output", help="Optional: Path to save the report as a CSV file: every IP in first-seen order, streamed (with --follow, the last flagged IPs).")
     parser.add_argument("--enrich", action='store_true', help="Enable IP reputation enrichment via AbuseIPDB.")
     parser.add_argument("--apikey", help="Your AbuseIPDB API key. (Can also be set in .env)")
+    parser.add_argument("--blocklist", action='append', help="Optional: CIDR blocklist file checked before the API with --enrich (repeatable). IPs inside a listed prefix score 100.")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL_DAYS, help=f"Optional: Days before a cached reputation is looked up again (default: {CACHE_TTL_DAYS:g}).")
+    parser.add_argument("--enrich-workers", type=int, default=ENRICH_WORKERS, help=f"Optional: Concurrent AbuseIPDB lookups (default: {ENRICH_WORKERS}).")
+    parser.add_argument("--workers", type=int, default=1, help="Optional: Number of worker processes used to parse the log.")
+    parser.add_argument("--engine", choices=["fast", "regex"], default="regex", help="Optional: Parse engine for --counts-only (default: regex; fast reads fields by position, ~12%% faster, see README). The detailed parse always reads by position.")
+    parser.add_argument("--counts-only", action='store_true', help="Only count requests/errors per IP, like the original parser. The default detailed parse (paths, user agents and time windows for the model) is about 4-9x slower per line and much bigger on IP floods; this skips it.")
+    parser.add_argument("--compact-counts", action='store_true', help="With --counts-only, keep the counts as packed-address columns: about half the peak memory on IP floods, but about 1.5x slower to parse (reads by position, like --engine fast).")
+    parser.add_argument("--approx", action='store_true', help="Estimate unique paths/user agents per IP with fixed-size HyperLogLog sketches (~6.5%% error, constant memory).")
+    parser.add_argument("--memory-budget", type=float, metavar="MB", help="Optional: Keep the parse (per-IP state and the path/user-agent tables) within about MB of memory; the coldest IPs' state spills to a temporary SQLite file (serial parse). The feature matrix and scoring come on top (see --score-memory).")
+    parser.add_argument("--checkpoint", action='store_true', help="Save the parsed state so the next run only parses newly appended lines.")
+    parser.add_argument("--train-model", metavar="PATH", help="Fit the Isolation Forest on this (baseline) log, save it to PATH and exit.")
+    parser.add_argument("--model", metavar="PATH", help="Optional: Score with a model saved by --train-model instead of fitting a new one.")
+    parser.add_argument("--rules-only", action='store_true', help="Flag IPs with the Sigma rules only (NumPy, no model - fastest start-up).")
+    parser.add_argument("--score-jobs", type=int, default=1, help="Optional: Cores used to build the model and processes used to score it (for millions of IPs).")
+    parser.add_argument("--score-memory", type=float, metavar="MB", help="Optional: Cap on the memory scoring adds (scores, batches and --score-jobs processes); fewer processes are used if they don't fit.")
+    parser.add_argument("--top", type=int, metavar="N", help="Optional: Only show the N worst IPs in the table (the -o CSV still has every IP).")
+    parser.add_argument("--rank-by", choices=["errors", "score"], default="errors", help="Optional: Rank IPs by error count or by anomaly score (default: errors).")
+    parser.add_argument("--emit-partial", metavar="PATH", help="Parse this host's log into a compact partial aggregate at PATH and exit (no scoring).")
+    parser.add_argument("--merge-partials", metavar="PATH", nargs="+", help="Merge partial aggregates from --emit-partial (instead of -f) and score the combined state.")
+    parser.add_argument("--metrics", metavar="PATH", help="Optional: Write per-stage timings and counters to PATH (JSON, or a Prometheus textfile if PATH ends in .prom).")
+    parser.add_argument("--profile", metavar="PATH", help="Optional: Profile each stage with cProfile and dump the slowest one to PATH.")
+    parser.add_argument("--follow", action='store_true', help="Keep watching the log and re-score as new lines arrive.")
+    parser.add_argument("--serve", action='store_true', help="Run as a daemon taking log lines over syslog/UDP and HTTP POST /ingest (instead of -f), with the top anomalies on GET /anomalies.")
+    parser.add_argument("--bind", default="127.0.0.1", help="Optional: Address the --serve listeners bind to (default: 127.0.0.1).")
+    parser.add_argument("--syslog-port", type=int, help="Optional: UDP syslog port in --serve mode (default: 5140).")
+    parser.add_argument("--http-port", type=int, help="Optional: HTTP port in --serve mode (default: 8080).")
+    parser.add_argument("--queue-mb", type=float, default=64, help="Optional: Log data --serve holds waiting to be parsed before refusing / dropping more (default: 64).")
+    parser.add_argument("--state-ttl", type=float, default=3600, help="Optional: Seconds without a request before --serve forgets an IP (0 keeps them all; default: 3600).")
+    parser.add_argument("--interval", type=float, help="Optional: Seconds between re-scoring in --follow / --serve mode (default: 60 / 10).")
     args = parser.parse_args()
 
+    if args.train_model and (args.follow or args.model):
+        parser.error("--train-model can't be combined with --follow or --model")
+    if args.serve and (args.file or args.merge_partials or args.follow or args.emit_partial or args.train_model):
+        parser.error("--serve takes its logs over the network (drop -f/--merge-partials/--follow/--emit-partial/--train-model)")
+    if args.serve and (args.metrics or args.profile or args.enrich or args.output):
+        parser.error("--metrics, --profile, --enrich and -o aren't available with --serve")
+    if not args.serve and bool(args.file) == bool(args.merge_partials):
+        parser.error("give either -f/--file or --merge-partials")
+    if args.follow and (args.emit_partial or args.merge_partials):
+        parser.error("--emit-partial and --merge-partials can't be combined with --follow")
+    if args.follow and (args.metrics or args.profile):
+        parser.error("--metrics and --profile measure a single run, not --follow")
+    if args.memory_budget and (args.workers > 1 or args.checkpoint or args.follow or args.serve or args.merge_partials):
+        parser.error("--memory-budget parses serially (drop --workers/--checkpoint/--follow/--serve/--merge-partials)")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.score_memory is not None and args.score_memory <= 0:
+        parser.error("--score-memory must be above 0")
+    if args.workers < 1 or args.enrich_workers < 1:
+        parser.error("--workers and --enrich-workers must be at least 1")
+    if args.compact_counts and not args.counts_only:
+        parser.error("--compact-counts needs --counts-only")
+    if args.rules_only and (args.counts_only or args.model or args.train_model):
+        parser.error("--rules-only needs the detailed parse and no model (drop --counts-only/--model/--train-model)")
+
     load_dotenv()
     api_key = os.getenv("API_KEY")
 
@@ -44,56 +253,143 @@ def main():
         api_key = args.apikey
 
     db_connection = setup_database()
+    cache = ReputationCache(db_connection, ttl_days=args.cache_ttl)
 
-    print(f"[*] Processing log file: {args.file}...")
+    blocklist = None
+    if args.blocklist:
+        from cidr_index import load_cidr_files
+        blocklist = load_cidr_files(args.blocklist)
+        print(f"[*] Loaded {len(blocklist)} blocklist ranges from {len(args.blocklist)} file(s)")
 
-    log_dict = parse_apache_file(args.file)
+    # Only read from disk when the first batch is scored
+    model = None
+    if args.model:
+        from anomaly_detector import SavedModel
+        model = SavedModel(args.model)
 
-    if log_dict:
-        # Run anomaly detection first to get the set of weird IPs
-        anomalous_ips, score_dict = detect_anomalies(log_dict, threshold=-0.05)
+    if args.serve:
+        serve_logs(args, model)
+        db_connection.close()
+        return
 
-        # Sort the data after running the model
-        sorted_ips = sorted(log_dict.items(), key=lambda item: item[1]["errors"], reverse=True)
+    if args.follow:
+        args.interval = args.interval or 60
+        follow_log(args, api_key, cache, blocklist, model)
+        db_connection.close()
+        return
 
-        report_data = []
-        print("[*] Processing IP data...")
+    metrics = RunMetrics(profile=bool(args.profile))
+    store = None  # The spilling per-IP state with --memory-budget
 
+    if args.merge_partials:
+        # Each host parsed its own log; only the per-IP aggregates travelled
+        print(f"[*] Merging {len(args.merge_partials)} partial aggregate(s)...")
+        try:
+            with metrics.stage("merge"):
+                log_dict = merge_partials(args.merge_partials)
+        except (OSError, ValueError) as error:
+            print(f"\n[!] ERROR: Could not merge partials: {error}")
+            log_dict = None
+    else:
+        print(f"[*] Processing log file: {args.file}...")
+        if not args.counts_only:
+            log_bytes = sum(os.path.getsize(path) for path in find_log_files(args.file))
+            if log_bytes >= DETAILED_NOTICE_BYTES:
+                print(f"[*] Detailed parse of {log_bytes / 2**30:.1f} GB: about 4-9x slower than --counts-only, "
+                      f"which skips the path, user agent and window features")
+        state_dir = os.path.dirname(os.path.abspath(CACHE_DB)) if args.checkpoint else None
+        if args.memory_budget:
+            from state_store import StateStore
+            try:
+                store = StateStore(args.memory_budget, detailed=not args.counts_only, approximate=args.approx)
+            except ValueError as error:
+                print(f"\n[!] ERROR: {error}")
+                db_connection.close()
+                return
 
-        for ip, data in sorted_ips:
-            score, country = "N/A", "N/A"  # Default values
+        LINE_COUNTS.reset()
+        with metrics.stage("parse"):
+            log_dict = parse_log_files(args.file, workers=args.workers, engine=args.engine, state_dir=state_dir,
+                                       detailed=not args.counts_only, approximate=args.approx, store=store,
+                                       compact=args.compact_counts)
 
-            # Check for enrichment if the flag is set
-            if args.enrich and api_key:
-                cached_result = check_cache(ip, db_connection)
-                if cached_result:
-                    score, country = cached_result
-                else:
-                    score, country = get_ip_reputation(ip, api_key)
-                    update_cache(ip, score, country, db_connection)
-                    time.sleep(1)
+        if store is not None and store.spilled:
+            print(f"[*] Memory budget {args.memory_budget:g} MB: cold IP state was spilled to disk "
+                  f"({store.spilled_ips:,} entries written)")
+            metrics.count("spilled_ips", store.spilled_ips)
 
-            # Check if the IP was flagged by the model
-            is_anomaly = ip in anomalous_ips
-            anomaly_score = score_dict.get(ip, 0.0)
+    if log_dict and args.file:
+        # Counted by the parse engines as they went (with --checkpoint, only the lines new to this run)
+        metrics.count("lines_read", LINE_COUNTS.read)
+        metrics.count("lines_parsed", LINE_COUNTS.read - LINE_COUNTS.unparsed)
+        metrics.count("parse_misses", LINE_COUNTS.unparsed)
+        metrics.count("ips", len(log_dict))
 
-            # Append the final, fully-enriched data point for THIS IP
-            report_data.append((ip, data["total"], data["errors"], score, country, is_anomaly, anomaly_score))
+    if log_dict and args.emit_partial:
+        with metrics.stage("emit"):
+            size = write_partial(args.emit_partial, log_dict)
+        print(f"[+] Partial aggregate of {len(log_dict)} IPs written to {args.emit_partial} ({size / 2**20:.1f} MB)")
+
+    elif log_dict and args.train_model:
+        from anomaly_detector import train_model
+        with metrics.stage("train"):
+            train_model(log_dict, args.train_model, jobs=args.score_jobs)
+
+    elif log_dict:
+        # Run anomaly detection first to get the set of weird IPs
+        try:
+            with metrics.stage("detect"):
+                anomalous_ips, score_dict = score_ips(log_dict, args, model)
+        except (OSError, ValueError) as error:
+            print(f"\n[!] ERROR: {scoring_error(args, error)}")
+            write_run_metrics(metrics, args)
+            if store is not None:
+                store.close()
+            db_connection.close()
+            return
+        metrics.count("anomalous_ips", len(anomalous_ips))
 
-        # --- END OF LOOP ---
+        # Rank the data after running the model (a heap of --top IPs rather than a full sort)
+        with metrics.stage("rank"):
+            ranked_ips = top_ips(log_dict, score_dict, args.top, rank_by=args.rank_by)
+
+        print("[*] Processing IP data...")
+        # Only the rows that get shown or written need a reputation: the table's, or every IP for the CSV
+        with metrics.stage("enrich"):
+            reputation = lookup_reputation(log_dict if args.output else (ip for ip, _ in ranked_ips),
+                                           args, api_key, cache, blocklist, metrics)
+
+        with metrics.stage("report"):
+            report_data = list(iter_report_rows(ranked_ips, anomalous_ips, score_dict, reputation))
+
+            if args.top:
+                print(f"[*] Showing the top {len(report_data)} of {len(log_dict)} IPs by {args.rank_by}")
+            generate_report(report_data)
+        metrics.count("report_rows", len(report_data))
 
-        # Pass the complete report_data to the functions
-        generate_report(report_data)
         if args.output:
-            export_to_csv(report_data, args.output)
+            with metrics.stage("csv"):
+                # Every IP in first-seen order, whatever the table shows - streamed rather than sorted or kept
+                export_to_csv(iter_report_rows(log_dict.items(), anomalous_ips, score_dict, reputation), args.output)
 
         print("\n[*] Analysis complete!")
 
     else:
         print(f"\n[*] Analysis aborted due to error.")
 
+    write_run_metrics(metrics, args)
+    if store is not None:
+        store.close()
     db_connection.close()
 
 
+def write_run_metrics(metrics, args):
+    """Writes the --metrics file and the --profile dump, if they were asked for."""
+    if args.metrics:
+        metrics.write(args.metrics)
+    if args.profile:
+        metrics.write_profile(args.profile)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
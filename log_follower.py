@@ -0,0 +1,102 @@
+import os
+
+from file_parser import BLOCK_SIZE, merge_log_dicts, parse_log_bytes
+
+
+class LogFollower:
+    """
+    Tails an Apache log and keeps per-IP counters up to date as lines are appended.
+
+    Each call to poll() only parses the bytes written since the previous call, so the
+    cost of a refresh scales with the new lines rather than the size of the file.
+    Survives logrotate: when the path is moved aside and recreated (inode change) the
+    rest of the old file is drained before switching, and a truncated file
+    (copytruncate) is read again from the start. Either way, a last line the old file
+    never finished is counted as it stands rather than dropped.
+    """
+
+    def __init__(self, filepath, detailed=False, approximate=False):
+        self.filepath = filepath
+        self.detailed = detailed
+        self.approximate = approximate
+        self.log_dict = {}  # Structure: {ip: {"total": int, "errors": int}} (see file_parser.new_entry)
+        self.lines_read = 0
+
+        self._handle = None
+        self._identity = None
+        self._offset = 0
+        self._pending = b""  # A partial last line, kept until its newline arrives
+
+    def poll(self) -> int:
+        """Parses everything appended since the last poll. Returns the number of new lines."""
+        new_lines = 0
+
+        try:
+            stat = os.stat(self.filepath)
+        except FileNotFoundError:
+            # Between logrotate's rename and Apache reopening the log - try again later
+            return self._read_new_lines() if self._handle else 0
+
+        if self._handle is None:
+            self._open()
+        elif (stat.st_dev, stat.st_ino) != self._identity:
+            # Rotated: finish off the old file, then start on the new one
+            new_lines += self._read_new_lines()
+            new_lines += self._finish_pending()
+            self._handle.close()
+            self._open()
+        elif stat.st_size < self._offset:
+            # Truncated in place: start again from the top
+            new_lines += self._finish_pending()
+            self._handle.seek(0)
+            self._offset = 0
+
+        new_lines += self._read_new_lines()
+        return new_lines
+
+    def close(self):
+        """Closes the underlying file handle."""
+        if self._handle:
+            self._handle.close()
+            self._handle = None
+
+    def _open(self):
+        self._handle = open(self.filepath, "rb")
+        stat = os.fstat(self._handle.fileno())
+        self._identity = (stat.st_dev, stat.st_ino)
+        self._offset = 0
+        self._pending = b""
+
+    def _read_new_lines(self) -> int:
+        """Reads from the current offset to EOF and counts every complete line."""
+        new_lines = 0
+
+        while True:
+            block = self._handle.read(BLOCK_SIZE)
+            if not block:
+                break
+            self._offset += len(block)
+
+            data = self._pending + block
+            last_newline = data.rfind(b"\n")
+            if last_newline == -1:
+                self._pending = data
+                continue
+
+            # Only whole lines are parsed; the tail waits for the rest of its line
+            self._pending = data[last_newline + 1:]
+            merge_log_dicts(self.log_dict, parse_log_bytes(data, 0, last_newline + 1, self.detailed, self.approximate))
+            new_lines += data.count(b"\n", 0, last_newline + 1)
+
+        self.lines_read += new_lines
+        return new_lines
+
+    def _finish_pending(self) -> int:
+        """Counts the partial last line of a file that won't get the rest of it."""
+        if not self._pending:
+            return 0
+
+        merge_log_dicts(self.log_dict, parse_log_bytes(self._pending, 0, len(self._pending), self.detailed, self.approximate))
+        self._pending = b""
+        self.lines_read += 1
+        return 1
@@ -1,9 +1,19 @@
+import argparse
 import csv
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from file_parser import parse_apache_file
-from anomaly_detector import detect_anomalies
+from anomaly_detector import ANOMALY_THRESHOLD, detect_anomalies, fit_forest, score_features
+from metrics import peak_memory_mb
+import numpy as np
 import time
 
 
+# IP counts for the --scale benchmark
+SCALE_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+
 def load_ground_truth(filepath):
     """Load the ground truth csv file."""
     ground_truth = {}
@@ -64,16 +74,75 @@ def calculate_metrics(predictions, ground_truth):
 
 
 
+def synthetic_features(ip_count, seed=42):
+    """A float32 feature matrix shaped like build_features' output: mostly ordinary IPs, 0.1% noisy ones."""
+    rng = np.random.default_rng(seed)
+    features = np.empty((ip_count, 5), dtype=np.float32)
+    features[:, 0] = rng.lognormal(3, 1, ip_count)              # total_requests
+    features[:, 1] = rng.beta(1, 20, ip_count)                   # error_rate
+    features[:, 2] = rng.lognormal(1.5, 0.8, ip_count)           # unique_path_count
+    features[:, 3] = np.minimum(features[:, 0], rng.lognormal(2, 1, ip_count))  # peak_window_requests
+    features[:, 4] = features[:, 3] * features[:, 1]             # peak_window_errors
+
+    noisy = rng.choice(ip_count, max(1, ip_count // 1000), replace=False)
+    features[noisy] *= rng.uniform(5, 50, (len(noisy), 1)).astype(np.float32)
+    return features
+
+
+def run_scale_point(ip_count, jobs, memory_mb):
+    """Fits and scores `ip_count` synthetic IPs; runs in a fresh process so peak RSS is its own."""
+    features = synthetic_features(ip_count)
+
+    start_time = time.perf_counter()
+    forest = fit_forest(features, jobs)
+    fit_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    score_features(forest, features, jobs=jobs, memory_mb=memory_mb)
+    score_time = time.perf_counter() - start_time
+
+    return fit_time, score_time, peak_memory_mb()
+
+
+def benchmark_scaling(sizes, jobs, memory_mb):
+    """Prints how fit/score wall time and peak RSS grow with the number of distinct IPs."""
+    print(f"[*] High-cardinality scoring benchmark ({jobs} scoring process(es), memory cap: {f'{memory_mb:g} MB' if memory_mb else 'none'})")
+    print("=" * 78)
+    print(f"{'IPs':>10} {'Fit (s)':>9} {'Score (s)':>10} {'IPs/second':>12} {'Peak RSS (MB)':>14} {'Worker RSS (MB)':>16}")
+    print("-" * 78)
+
+    for ip_count in sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            fit_time, score_time, peak = pool.submit(run_scale_point, ip_count, jobs, memory_mb).result()
+
+        workers = f"{peak['workers']:.0f}" if peak["workers"] else "-"
+        process = f"{peak['process']:.0f}" if peak["process"] is not None else "n/a"
+        print(f"{ip_count:>10,} {fit_time:>9.2f} {score_time:>10.2f} {ip_count / score_time:>12,.0f} {process:>14} {workers:>16}")
+
+    print("=" * 78)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Measures detection accuracy against the labelled test dataset.")
+    parser.add_argument("--scale", action='store_true', help="Instead, benchmark scoring time and memory from 10k to 5M IPs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SCALE_SIZES, help="Optional: IP counts for --scale.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Optional: Scoring processes for --scale (default: all cores).")
+    parser.add_argument("--score-memory", type=float, help="Optional: Cap (MB) on the memory --scale's scoring adds.")
+    args = parser.parse_args()
+
+    if args.scale:
+        benchmark_scaling(args.sizes, args.jobs, args.score_memory)
+        return
+
     print(f"[*] Loading test dataset...")
-    log_dict = parse_apache_file("test_access.log")
+    log_dict = parse_apache_file("test_access.log", detailed=True)
 
     print(f"[*] Loading ground truth labels...")
     ground_truth = load_ground_truth("ground_truth_labels.csv")
 
     print(f"[*] Running anomaly detection...")
     start_time = time.time()  # Timer for processing
-    anomalous_ips, score_dict = detect_anomalies(log_dict, threshold=-0.05)
+    anomalous_ips, score_dict = detect_anomalies(log_dict, threshold=ANOMALY_THRESHOLD)
     end_time = time.time()  # End of the timer
 
     processing_time = end_time - start_time
@@ -0,0 +1,114 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory isn't reported
+    resource = None
+
+
+# Prefix of every Prometheus metric name
+METRIC_PREFIX = "log_analyser"
+
+
+def peak_memory_mb() -> dict:
+    """Peak resident memory so far, in MB, of this process and of its largest finished worker (None on Windows)."""
+    if resource is None:
+        return {"process": None, "workers": None}
+
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {"process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20,
+            "workers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20}
+
+
+class RunMetrics:
+    """
+    Wall time per pipeline stage and counters (lines, IPs, cache hits, API calls...)
+    for one run of the analyser, written out by --metrics.
+
+    With `profile` set, each stage also runs under its own cProfile profiler and
+    write_profile() keeps the slowest one - the stage worth looking at. Work done in
+    worker processes (--workers, --score-jobs) only shows up as waiting.
+    """
+
+    def __init__(self, profile: bool = False):
+        self.stages = {}    # stage name -> seconds
+        self.counters = {}  # counter name -> value
+        self._profiles = {} if profile else None
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Times the body of a `with` block as stage `name` (repeated stages add up)."""
+        profiler = None
+        if self._profiles is not None:
+            profiler = self._profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start_time
+            if profiler is not None:
+                profiler.disable()
+
+    def count(self, name: str, value=1) -> None:
+        """Adds `value` to counter `name`. None (not measured) leaves it unset."""
+        if value is not None:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self) -> dict:
+        peak = peak_memory_mb()
+        return {
+            "total_seconds": time.perf_counter() - self._started,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "peak_rss_mb": peak["process"],
+            "peak_worker_rss_mb": peak["workers"] or None,
+        }
+
+    def to_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format (for node_exporter's textfile collector)."""
+        data = self.as_dict()
+        lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Wall time of each pipeline stage.",
+                 f"# TYPE {METRIC_PREFIX}_stage_seconds gauge"]
+        lines += [f'{METRIC_PREFIX}_stage_seconds{{stage="{stage}"}} {seconds:.6f}' for stage, seconds in data["stages"].items()]
+
+        lines += [f"# TYPE {METRIC_PREFIX}_run_seconds gauge", f"{METRIC_PREFIX}_run_seconds {data['total_seconds']:.6f}"]
+        for name, value in data["counters"].items():
+            lines += [f"# TYPE {METRIC_PREFIX}_{name} gauge", f"{METRIC_PREFIX}_{name} {value}"]
+
+        for name, megabytes in (("peak_rss_bytes", data["peak_rss_mb"]), ("peak_worker_rss_bytes", data["peak_worker_rss_mb"])):
+            if megabytes is not None:
+                lines += [f"# TYPE {METRIC_PREFIX}_{name} gauge", f"{METRIC_PREFIX}_{name} {int(megabytes * 2**20)}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, filepath) -> None:
+        """Writes JSON, or a Prometheus textfile when the name ends in .prom - atomically, so a scraper never reads half a file."""
+        filepath = str(filepath)
+        if filepath.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.as_dict(), indent=2) + "\n"
+
+        temp_path = f"{filepath}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(content)
+        os.replace(temp_path, filepath)
+        print(f"[+] Metrics written to {filepath}")
+
+    def write_profile(self, filepath) -> str | None:
+        """Dumps the cProfile stats of the slowest profiled stage to `filepath` and returns its name."""
+        if not self._profiles:
+            return None
+
+        hot_stage = max(self._profiles, key=lambda name: self.stages.get(name, 0.0))
+        self._profiles[hot_stage].dump_stats(filepath)
+        print(f"[+] Profile of the slowest stage ({hot_stage}, {self.stages[hot_stage]:.2f}s) written to {filepath}")
+        return hot_stage
@@ -0,0 +1,284 @@
+import math
+import os
+import socket
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from file_parser import merge_log_dicts, new_entry
+from hyperloglog import HyperLogLog
+from intern_table import PATHS, USER_AGENTS, merge_ids
+from time_windows import SlidingWindow
+
+
+# Partial aggregates: one host's per-IP state, written by --emit-partial and combined
+# by --merge-partials. Little-endian struct records, so a partial written on one
+# machine reads the same on any other (and, unlike a pickle, can't run code when loaded).
+PARTIAL_MAGIC = b"SOSPART"
+# Bump when the record layout changes; other versions are refused rather than misread
+PARTIAL_VERSION = 3
+
+FLAG_DETAILED = 1
+FLAG_APPROXIMATE = 2
+
+# magic, version, flags, HyperLogLog precision, created, earliest request, IP count, source length
+_HEADER = struct.Struct("<7sBBBddIH")
+_COUNTS = struct.Struct("<QQ")            # total, errors
+_DETAILS = struct.Struct("<QQQdd")        # total, errors, bytes, first_seen, last_seen
+_WINDOW = struct.Struct("<HIII")          # slots, settled peak requests, settled peak errors, buckets
+_BUCKET = struct.Struct("<qII")           # bucket, requests, errors
+_LENGTH = struct.Struct("<I")            # IP / string lengths and table sizes
+_RULE = struct.Struct("<H")              # rule count of an IP, rule index
+
+_WRITE_CHUNK = 1 << 20
+
+
+def write_partial(filepath, log_dict: dict, source: str | None = None) -> int:
+    """
+    Writes `log_dict` as a compact partial aggregate (written atomically). The mode
+    (counts-only, detailed or --approx) is taken from the entries themselves. Paths and
+    user agents are written as each partial's own string tables plus per-IP ids, so
+    merging re-interns them. Returns the file size in bytes.
+    """
+    sample = next(iter(log_dict.values()), {})
+    detailed = "paths" in sample
+    approximate = isinstance(sample.get("paths"), HyperLogLog)
+    precision = sample["paths"].precision if approximate else 0
+    flags = (FLAG_DETAILED if detailed else 0) | (FLAG_APPROXIMATE if approximate else 0)
+
+    first_seen = [data["first_seen"] for data in log_dict.values() if data.get("first_seen") is not None]
+    source = (source or socket.gethostname()).encode("utf-8")[:65535]
+    header = _HEADER.pack(PARTIAL_MAGIC, PARTIAL_VERSION, flags, precision, time.time(),
+                          min(first_seen) if first_seen else math.nan, len(log_dict), len(source)) + source
+
+    temp_path = f"{filepath}.tmp"
+    compressor = zlib.compressobj(6)
+    with open(temp_path, "wb") as partial_file:
+        partial_file.write(header)
+        chunk = []
+        size = 0
+
+        for record in _encode(log_dict, detailed, approximate):
+            chunk.append(record)
+            size += len(record)
+            if size >= _WRITE_CHUNK:
+                partial_file.write(compressor.compress(b"".join(chunk)))
+                chunk, size = [], 0
+        partial_file.write(compressor.compress(b"".join(chunk)))
+        partial_file.write(compressor.flush())
+
+    # Never leave half a partial behind for the merge to pick up
+    os.replace(temp_path, filepath)
+    return os.path.getsize(filepath)
+
+
+def read_partial_header(filepath) -> dict:
+    """Reads just the uncompressed header of a partial. Raises ValueError if it isn't a partial this version can read."""
+    with open(filepath, "rb") as partial_file:
+        return _read_header(partial_file, filepath)
+
+
+def read_partial(filepath) -> tuple[dict, dict]:
+    """Loads a partial. Returns (header, log_dict), with path / user agent ids re-interned into this process's tables."""
+    with open(filepath, "rb") as partial_file:
+        header = _read_header(partial_file, filepath)
+        try:
+            body = zlib.decompress(partial_file.read())
+        except zlib.error as error:
+            raise ValueError(f"{filepath}: corrupt partial ({error})") from None
+
+    try:
+        return header, _decode(body, header)
+    except (struct.error, IndexError, UnicodeDecodeError) as error:
+        raise ValueError(f"{filepath}: corrupt partial ({error})") from None
+
+
+def merge_partials(filepaths) -> dict:
+    """
+    Merges any number of partials into one log_dict, ready for scoring.
+
+    Request/error/byte totals, first/last seen and the unique path / user agent sets (or
+    sketches) combine exactly, so grouping doesn't matter. Partials are merged in a
+    canonical order (earliest request first, then source), so the result does not
+    depend on the order they are given in either. Peak windows merge exactly when the
+    hosts' logs follow each other in time; when they cover the same hours, a burst split
+    across hosts is only counted against the buckets each IP keeps (see
+    time_windows.SlidingWindow), so the merged peak is a lower bound: never above the
+    true peak, and never below any one host's.
+    Raises ValueError if the partials were written in different modes.
+    """
+    headers = [(read_partial_header(filepath), filepath) for filepath in filepaths]
+    modes = {(header["detailed"], header["approximate"]) for header, _ in headers}
+    if len(modes) > 1:
+        raise ValueError("partials were written in different modes (--counts-only / --approx); re-emit them alike")
+
+    headers.sort(key=lambda item: (math.inf if math.isnan(item[0]["earliest"]) else item[0]["earliest"],
+                                   item[0]["source"], item[0]["created"], item[0]["ips"]))
+
+    # One partial in memory at a time on top of the merged state
+    log_dict = {}
+    for _, filepath in headers:
+        _, partial = read_partial(filepath)
+        merge_log_dicts(log_dict, partial)
+    return log_dict
+
+
+def _read_header(partial_file, filepath):
+    fixed = partial_file.read(_HEADER.size)
+    if len(fixed) < _HEADER.size or not fixed.startswith(PARTIAL_MAGIC):
+        raise ValueError(f"{filepath} is not a partial aggregate")
+
+    magic, version, flags, precision, created, earliest, ips, source_length = _HEADER.unpack(fixed)
+    if version != PARTIAL_VERSION:
+        raise ValueError(f"{filepath} is a version {version} partial; this analyser reads version {PARTIAL_VERSION}")
+
+    return {"version": version, "detailed": bool(flags & FLAG_DETAILED), "approximate": bool(flags & FLAG_APPROXIMATE),
+            "precision": precision, "created": created, "earliest": earliest, "ips": ips,
+            "source": partial_file.read(source_length).decode("utf-8", "replace")}
+
+
+def _encode(log_dict, detailed, approximate):
+    """Yields the body's byte strings: string tables first, then one record per IP."""
+    rule_names = sorted({name for data in log_dict.values() for name in data.get("rules", ())}) if detailed else []
+    if len(rule_names) > 0xFFFF:
+        raise ValueError(f"{len(rule_names)} Sigma rules fired; a partial holds at most {0xFFFF}")
+    rule_index = {name: index for index, name in enumerate(rule_names)}
+    yield _pack_strings([name.encode("utf-8") for name in rule_names])
+
+    if detailed and not approximate:
+        # The ids only mean something alongside the tables they came from
+        yield _pack_strings(PATHS.values)
+        yield _pack_strings(USER_AGENTS.values)
+
+    for ip, data in log_dict.items():
+        encoded_ip = ip.encode("ascii")
+        parts = [_LENGTH.pack(len(encoded_ip)), encoded_ip]
+
+        if not detailed:
+            parts.append(_COUNTS.pack(data["total"], data["errors"]))
+            yield b"".join(parts)
+            continue
+
+        parts.append(_DETAILS.pack(data["total"], data["errors"], data["bytes"],
+                                   math.nan if data["first_seen"] is None else data["first_seen"],
+                                   math.nan if data["last_seen"] is None else data["last_seen"]))
+        if approximate:
+            parts += [data["paths"].registers, data["agents"].registers]
+        else:
+            parts += [_pack_ids(data["paths"]), _pack_ids(data["agents"])]
+
+        parts.append(_pack_window(data["window"]))
+        parts.append(_RULE.pack(len(data["rules"])))
+        for name, rule_window in data["rules"].items():
+            parts.append(_RULE.pack(rule_index[name]))
+            parts.append(_pack_window(rule_window))
+        yield b"".join(parts)
+
+
+def _decode(body, header):
+    detailed, approximate, precision = header["detailed"], header["approximate"], header["precision"]
+    position = 0
+
+    rule_names, position = _unpack_strings(body, position)
+    rule_names = [name.decode("utf-8") for name in rule_names]
+    path_ids = agent_ids = None
+    if detailed and not approximate:
+        paths, position = _unpack_strings(body, position)
+        agents, position = _unpack_strings(body, position)
+        path_ids, agent_ids = PATHS.remap(paths), USER_AGENTS.remap(agents)
+
+    registers = 1 << precision
+    log_dict = {}
+    for _ in range(header["ips"]):
+        (length,) = _LENGTH.unpack_from(body, position)
+        position += _LENGTH.size
+        ip = body[position:position + length].decode("ascii")
+        position += length
+
+        if not detailed:
+            total, errors = _COUNTS.unpack_from(body, position)
+            position += _COUNTS.size
+            log_dict[ip] = {"total": total, "errors": errors}
+            continue
+
+        entry = new_entry(True, approximate)
+        total, errors, sent, first_seen, last_seen = _DETAILS.unpack_from(body, position)
+        position += _DETAILS.size
+        entry.update(total=total, errors=errors, bytes=sent,
+                     first_seen=None if math.isnan(first_seen) else first_seen,
+                     last_seen=None if math.isnan(last_seen) else last_seen)
+
+        if approximate:
+            for field in ("paths", "agents"):
+                sketch = HyperLogLog(precision)
+                sketch.registers = bytearray(body[position:position + registers])
+                entry[field] = sketch
+                position += registers
+        else:
+            ids, position = _unpack_ids(body, position)
+            entry["paths"] = merge_ids([], ids, path_ids)
+            ids, position = _unpack_ids(body, position)
+            entry["agents"] = merge_ids([], ids, agent_ids)
+
+        entry["window"], position = _unpack_window(body, position)
+        (rule_count,) = _RULE.unpack_from(body, position)
+        position += _RULE.size
+        for _ in range(rule_count):
+            (index,) = _RULE.unpack_from(body, position)
+            entry["rules"][rule_names[index]], position = _unpack_window(body, position + _RULE.size)
+
+        log_dict[ip] = entry
+
+    return log_dict
+
+
+def _pack_strings(values):
+    return b"".join([_LENGTH.pack(len(values))] + [_LENGTH.pack(len(value)) + value for value in values])
+
+
+def _unpack_strings(body, position):
+    (count,) = _LENGTH.unpack_from(body, position)
+    position += _LENGTH.size
+    values = []
+    for _ in range(count):
+        (length,) = _LENGTH.unpack_from(body, position)
+        position += _LENGTH.size
+        values.append(bytes(body[position:position + length]))
+        position += length
+    return values, position
+
+
+def _pack_ids(ids):
+    ids = array("I", ids)
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return _LENGTH.pack(len(ids)) + ids.tobytes()
+
+
+def _unpack_ids(body, position):
+    (count,) = _LENGTH.unpack_from(body, position)
+    position += _LENGTH.size
+    ids = array("I", body[position:position + count * 4])
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids, position + count * 4
+
+
+def _pack_window(window):
+    header = _WINDOW.pack(window.slots, window.settled_requests, window.settled_errors, len(window.buckets))
+    return b"".join([header] + [_BUCKET.pack(*bucket)
+                                for bucket in zip(window.buckets, window.requests, window.errors)])
+
+
+def _unpack_window(body, position):
+    slots, settled_requests, settled_errors, count = _WINDOW.unpack_from(body, position)
+    position += _WINDOW.size
+
+    window = SlidingWindow(slots)
+    window.settled_requests, window.settled_errors = settled_requests, settled_errors
+    for _ in range(count):
+        window.add_counts(*_BUCKET.unpack_from(body, position))
+        position += _BUCKET.size
+    return window, position
@@ -1,18 +1,48 @@
 import csv
+import heapq
 from beautifultable import BeautifulTable
 
+from ip_counters import IpCounters
+from state_store import StateStore
+
+
+def top_ips(log_dict, score_dict, count=None, rank_by="errors") -> list:
+    """
+    Returns the `count` worst (ip, data) pairs, worst first: most errors, or lowest
+    anomaly score with rank_by="score". Picked with a heap in O(n log k) rather than
+    sorting every IP; with no `count` every IP is sorted.
+    """
+    if rank_by == "errors" and isinstance(log_dict, IpCounters):
+        return log_dict.top_by_errors(count)
+    if isinstance(log_dict, StateStore) and log_dict.spilled:
+        if rank_by == "errors":
+            return log_dict.top_by_errors(count)
+        # Rank the IPs by score alone, then read just the picked entries back from disk
+        key = lambda ip: score_dict.get(ip, 0.0)
+        ranked = sorted(log_dict, key=key) if count is None else heapq.nsmallest(count, log_dict, key=key)
+        return [(ip, log_dict[ip]) for ip in ranked]
+
+    if rank_by == "score":
+        key, pick, reverse = (lambda item: score_dict.get(item[0], 0.0)), heapq.nsmallest, False
+    else:
+        key, pick, reverse = (lambda item: item[1]["errors"]), heapq.nlargest, True
+
+    if count is None:
+        return sorted(log_dict.items(), key=key, reverse=reverse)
+    return pick(count, log_dict.items(), key=key)
+
 
 def export_to_csv(report_data, filepath):
-    """Takes the enriched report data and writes it to a CSV file."""
-    fields = ["IP Address", "Total Requests", "Errors", "Abuse Score", "Country", "Is Anomaly", "Confidence Score"]
+    """Takes the enriched report data (a list or any iterable of rows) and writes it to a CSV file."""
+    fields = ["IP Address", "Total Requests", "Errors", "Abuse Score", "Country", "Is Anomaly", "Confidence Score", "Sigma Matches"]
 
     try:
         with open(filepath, "w", newline="", encoding="utf-8") as csv_file:
             writer = csv.writer(csv_file)
             writer.writerow(fields)  # Header row
 
-            for row in report_data:
-                writer.writerow(row)
+            # report_data may be a generator, so rows are written as they are made
+            writer.writerows(report_data)
 
         print(f"\n[+] Report successfully exported to {filepath}")
 
@@ -25,17 +55,17 @@ def generate_report(report_data):
     """Takes enriched report data and prints a formatted report."""
 
     # Create the table and set the headers
-    table = BeautifulTable()
-    table.columns.header = ["IP Address", "Total Requests", "Errors", "Abuse Score", "Country", "Is Anomaly", "Confidence Score"]
+    table = BeautifulTable(maxwidth=160)  # Wide enough that IPs and rule names aren't wrapped
+    table.columns.header = ["IP Address", "Total Requests", "Errors", "Abuse Score", "Country", "Is Anomaly", "Confidence Score", "Sigma Matches"]
     table.columns.alignment["IP Address"] = BeautifulTable.ALIGN_LEFT
 
     # Loop through the sorted data and add rows to the table
     for row in report_data:
         # Convert the boolean to a more readable string format
-        ip, total, errors, score, country, is_anomaly, confidence = row
+        ip, total, errors, score, country, is_anomaly, confidence, sigma_matches = row
         anomaly_str = "Yes" if is_anomaly else "No"
         confidence_str = f"{confidence:.3f}"
-        table.rows.append([ip, total, errors, score, country, anomaly_str, confidence_str])
+        table.rows.append([ip, total, errors, score, country, anomaly_str, confidence_str, sigma_matches])
 
 
     # Print the final table
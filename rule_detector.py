@@ -0,0 +1,63 @@
+from itertools import chain
+
+import numpy as np
+
+from sigma_rules import get_rule_set
+
+
+def detect_rule_anomalies(log_dict: dict, rule_set=None) -> tuple[set, dict]:
+    """
+    Rule-only detection: flags the IPs that fire any Sigma rule, using NumPy only - no
+    model is fitted and scikit-learn is never imported.
+
+    Each IP's score is its closest margin to a rule's count threshold, scaled into the
+    Isolation Forest's range: negative for IPs that fire a rule (the further past the
+    threshold, the lower), zero or positive for the rest. Needs a detailed parse, which
+    is where the per-rule counts come from.
+
+    Returns:
+        (anomalous_ips, score_dict), like detect_anomalies.
+    """
+    if not log_dict:
+        return (set(), {})
+
+    rule_set = rule_set or get_rule_set()
+    rule_names = [rule.name for rule in rule_set.rules]
+    count = len(log_dict)
+
+    # One pass over the entries (a spilled StateStore is read from disk once): each row
+    # holds the IP's total, its errors and its peak count for every rule
+    ips = []
+    columns = np.fromiter(chain.from_iterable(_count_rows(log_dict.items(), ips, rule_names)), dtype=np.float32,
+                          count=count * (2 + len(rule_names))).reshape(count, 2 + len(rule_names))
+    totals, errors = columns[:, 0], columns[:, 1]
+    error_rate = np.divide(errors, totals, out=np.zeros_like(totals), where=totals > 0)
+
+    fired = np.zeros(count, dtype=bool)
+    margins = np.full(count, np.inf, dtype=np.float32)
+
+    for column, rule in enumerate(rule_set.rules, 2):
+        peaks = columns[:, column]
+        rule_fired = peaks > rule.threshold
+        if rule.min_error_rate is not None:
+            rule_fired &= error_rate > rule.min_error_rate
+
+        # Only IPs that actually fire the rule may go below zero
+        margin = (rule.threshold - peaks) / max(rule.threshold, 1)
+        margins = np.minimum(margins, np.where(rule_fired, margin, np.maximum(margin, 0)))
+        fired |= rule_fired
+
+    scores = np.clip(margins / 2, -0.5, 0.5)
+    anomalous_ips = {ips[index] for index in np.flatnonzero(fired)}
+    score_dict = dict(zip(ips, scores.tolist()))
+
+    print(f"[*] Rule-based detection complete.\nFound {len(anomalous_ips)} IP addresses matching Sigma rules")
+    return (anomalous_ips, score_dict)
+
+
+def _count_rows(items, ips, rule_names):
+    for ip, data in items:
+        ips.append(ip)
+        rules = data.get("rules", {})
+        yield (data["total"], data["errors"],
+               *(window.peak_requests if (window := rules.get(name)) is not None else 0 for name in rule_names))
@@ -0,0 +1,185 @@
+import glob
+import os
+import re
+from functools import lru_cache
+
+from time_windows import BUCKET_SECONDS
+
+
+# Rules shipped with the analyser
+SIGMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sigma")
+
+# The Apache fields the rules refer to, in Sigma's W3C naming
+PATH_FIELD = "cs-uri-stem"
+STATUS_FIELD = "sc-status"
+
+_AGGREGATION = re.compile(r"count\([\w-]*\)\s+by\s+c-ip\s*>\s*(\d+)(?:\s+and\s+error_rate\(c-ip\)\s*>\s*([\d.]+))?$")
+_CONDITION_TOKEN = re.compile(r"\(|\)|\w+")
+_TIMEFRAME_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+# Distinct paths whose bits are cached; a scan of endless unique paths (or a long-running
+# --serve) evicts the least recently seen instead of growing the cache
+PATH_CACHE_SIZE = 65536
+
+_RULE_SET = None
+
+
+class SigmaRule:
+    """One compiled rule: which selections make a line match, and how many matches per IP fire it."""
+
+    def __init__(self, name, title, level, condition, selections, timeframe, threshold, min_error_rate):
+        self.name = name
+        self.title = title
+        self.level = level
+        self.condition = condition  # Code object over the selection names
+        self.selections = selections  # {selection name: required field bits}
+        self.slots = max(1, timeframe // BUCKET_SECONDS)
+        self.threshold = threshold
+        self.min_error_rate = min_error_rate
+
+    def matches(self, field_bits: int) -> bool:
+        """Evaluates the condition for a line whose matching fields are `field_bits`."""
+        truths = {name: field_bits & required == required for name, required in self.selections.items()}
+        return eval(self.condition, {"__builtins__": {}}, truths)
+
+    def fires(self, data: dict) -> bool:
+        """Checks an IP's entry against the count (and error rate) in the rule's condition."""
+        window = data.get("rules", {}).get(self.name)
+        if window is None or window.peak_requests <= self.threshold:
+            return False
+        if self.min_error_rate is None:
+            return True
+        return data["total"] > 0 and data["errors"] / data["total"] > self.min_error_rate
+
+
+class RuleSet:
+    """
+    Every loaded rule compiled into one matcher, so all rules are evaluated in a single
+    pass over the log.
+
+    Each (selection, field) pair gets one bit. A line's path and status are turned into
+    a bit mask - the path behind a single combined regex, cached for the PATH_CACHE_SIZE
+    most recent distinct paths, and the status by a dict lookup - and the tuple of rules
+    that mask fires is cached, so the per-line cost does not grow with the number of rules.
+    """
+
+    def __init__(self, rules, path_patterns, status_bits):
+        self.rules = rules
+        self.status_bits = status_bits  # {b"404": bits}
+        self._path_patterns = path_patterns  # [(lower-case substring, bits)]
+        self._any_path = re.compile(b"|".join(re.escape(pattern) for pattern, _ in path_patterns)) if path_patterns else None
+        self._path_bits = lru_cache(maxsize=PATH_CACHE_SIZE)(self._bits_for_path)
+        self._hits = {}
+
+    def match(self, path: bytes, status: bytes) -> tuple:
+        """Returns the rules (possibly none) that a request for `path` answered with `status` matches."""
+        bits = self.status_bits.get(status, 0)
+        if self._any_path is not None:
+            bits |= self._path_bits(path)
+
+        hits = self._hits.get(bits)
+        if hits is None:
+            hits = self._hits[bits] = tuple(rule for rule in self.rules if rule.matches(bits))
+        return hits
+
+    def evaluate(self, data: dict) -> list[str]:
+        """Returns the names of the rules an IP's entry fires."""
+        return [rule.name for rule in self.rules if rule.fires(data)]
+
+    def _bits_for_path(self, path):
+        lowered = path.lower()  # Sigma's `contains` is case-insensitive
+        if not self._any_path.search(lowered):
+            return 0
+
+        bits = 0
+        for pattern, pattern_bits in self._path_patterns:
+            if pattern in lowered:
+                bits |= pattern_bits
+        return bits
+
+
+def load_rules(rules_dir=SIGMA_DIR) -> RuleSet:
+    """
+    Loads and compiles every *.yml rule in `rules_dir`.
+
+    Supports the subset of Sigma the bundled rules use: `cs-uri-stem|contains` and
+    `sc-status` selections, a boolean condition over them, and a
+    `count(c-ip) by c-ip > N [and error_rate(c-ip) > X]` aggregation over `timeframe`.
+    error_rate is taken over the IP's whole traffic. Raises ValueError for anything else.
+    """
+    import yaml
+
+    rules, path_patterns, status_bits = [], {}, {}
+    next_bit = 1
+
+    for rule_path in sorted(glob.glob(os.path.join(rules_dir, "*.yml"))):
+        with open(rule_path, "r", encoding="utf-8") as rule_file:
+            document = yaml.safe_load(rule_file)
+
+        name = os.path.splitext(os.path.basename(rule_path))[0]
+        detection = document.get("detection")
+        if not detection:
+            raise ValueError(f"{rule_path}: no detection section")
+
+        selections = {}
+        for selection_name, fields in detection.items():
+            if selection_name in ("condition", "timeframe"):
+                continue
+
+            required = 0
+            for field, values in fields.items():
+                values = values if isinstance(values, list) else [values]
+                if field == f"{PATH_FIELD}|contains":
+                    for value in values:
+                        key = str(value).lower().encode("utf-8")
+                        path_patterns[key] = path_patterns.get(key, 0) | next_bit
+                elif field == STATUS_FIELD:
+                    for value in values:
+                        key = str(value).encode("ascii")
+                        status_bits[key] = status_bits.get(key, 0) | next_bit
+                else:
+                    raise ValueError(f"{rule_path}: unsupported field '{field}'")
+                required |= next_bit
+                next_bit <<= 1
+            selections[selection_name] = required
+
+        expression, _, aggregation = str(detection["condition"]).partition("|")
+        condition = _compile_condition(expression, selections, rule_path)
+
+        threshold, min_error_rate = 0, None
+        if aggregation.strip():
+            match = _AGGREGATION.match(aggregation.strip())
+            if not match:
+                raise ValueError(f"{rule_path}: unsupported aggregation '{aggregation.strip()}'")
+            threshold = int(match.group(1))
+            min_error_rate = float(match.group(2)) if match.group(2) else None
+
+        rules.append(SigmaRule(name, document.get("title", name), document.get("level", ""), condition,
+                               selections, _parse_timeframe(detection.get("timeframe", "5m")),
+                               threshold, min_error_rate))
+
+    return RuleSet(rules, list(path_patterns.items()), status_bits)
+
+
+def get_rule_set() -> RuleSet:
+    """Returns the bundled rules, compiled on first use (once per process)."""
+    global _RULE_SET
+    if _RULE_SET is None:
+        _RULE_SET = load_rules()
+    return _RULE_SET
+
+
+def _compile_condition(expression, selections, rule_path):
+    """Turns `a and (b or not c)` into a code object, allowing only selection names and boolean operators"""
+    tokens = _CONDITION_TOKEN.findall(expression)
+    for token in tokens:
+        if token not in selections and token not in ("and", "or", "not", "(", ")"):
+            raise ValueError(f"{rule_path}: unsupported condition token '{token}'")
+    return compile(" ".join(tokens), rule_path, "eval")
+
+
+def _parse_timeframe(timeframe):
+    """'5m' -> 300"""
+    match = re.fullmatch(r"(\d+)([smhd])", str(timeframe).strip())
+    if not match:
+        raise ValueError(f"Unsupported timeframe '{timeframe}'")
+    return int(match.group(1)) * _TIMEFRAME_UNITS[match.group(2)]
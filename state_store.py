@@ -0,0 +1,303 @@
+import gc
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+from itertools import islice
+
+from file_parser import merge_log_dicts, new_entry
+from intern_table import PATHS, USER_AGENTS
+from metrics import peak_memory_mb
+
+
+# Kept free below the budget for the parser's block and what the hot IPs can grow by between two checks
+HEADROOM_MB = 16
+# New hot IPs between memory checks (the parser also checks after every block)
+CHECK_EVERY = 4096
+# A spill leaves this share of the hot IP capacity in RAM, so the next one isn't due straight away
+LOW_WATER = 0.75
+# Hot entries measured per check to estimate the size of the hot state
+SIZE_SAMPLE = 64
+# Bytes each hot IP costs beyond its entry: the raw IP key and its slots in the store's dicts
+IP_OVERHEAD = 600
+# Bytes of each interned value's id (an int object) on top of the value and the tables' own arrays
+ID_BYTES = 32
+# Never fewer hot IPs than this, however large the entries get
+MIN_CAPACITY = 64
+_FETCH_ROWS = 10_000
+
+
+class StateStore:
+    """
+    Per-IP state with a memory budget, for logs with more distinct IPs than fit in RAM.
+
+    Entries are filled in place by parse_log_bytes(store=...) and kept in `hot`, keyed
+    by the raw IP bytes like the parser's own dict. The parser calls trim() after every
+    block and whenever `hot` reaches `check_at` IPs. The state may use what the
+    process's resident memory at construction leaves of `budget_mb` (less HEADROOM_MB),
+    and the detailed parse's intern tables (PATHS, USER_AGENTS) come out of that share.
+    Each check measures the values added to the tables and a sample of the hot entries,
+    and once the hot IPs at that average size would outgrow what the tables leave, the
+    number that fits becomes the hot capacity (re-estimated at every later check as
+    entries and tables grow). The entries are measured rather than the process because
+    resident memory doesn't drop after a spill: freed entries stay with the allocator
+    for the next ones. The tables can't be spilled (spilled entries hold their ids), so
+    a log whose distinct paths alone outgrow the share still goes over, with only
+    MIN_CAPACITY hot IPs (and as the tables near it, what the allocator keeps of the
+    shrinking hot state can take the process over too). The budget covers the parse: the feature matrix and scoring
+    built from the store afterwards come on top. Past the capacity
+    the coldest IPs (no lines since the previous spill first, then the longest-held)
+    are spilled to a temporary SQLite file. An IP that shows up again is loaded back
+    before its line is counted, so every entry is built exactly as in memory and the
+    result is identical to an in-memory parse of the same log.
+
+    After finish() the store reads like the log_dict it replaces (len, iteration,
+    items(), values(), [ip]) in first-seen order, streaming spilled entries from disk.
+    Each items() / values() pass unpickles every spilled entry, so the later stages
+    make as few as they can: one for the features, one for the report.
+    """
+
+    def __init__(self, budget_mb: float, detailed: bool = False, approximate: bool = False, spill_dir=None):
+        self.budget_mb = budget_mb
+        self.detailed = detailed
+        self.approximate = approximate
+        self.hot = {}          # raw IP bytes -> entry
+        self.spilled_ips = 0   # Spill writes, counting IPs spilled more than once
+        self.capacity = None   # Hot IPs that fit in the budget, once it has been reached
+        self.check_at = CHECK_EVERY
+        self._order = {}       # raw IP bytes -> first-seen sequence number
+        self._marks = {}       # raw IP bytes -> total after the previous spill (unchanged = cold)
+        self._next_order = 0
+        self._length = None
+        self._db = None
+        # The detailed parse interns paths and user agents into tables that only grow
+        self._tables = (PATHS, USER_AGENTS) if detailed and not approximate else ()
+        self._measured = [0] * len(self._tables)  # Values already counted in _value_bytes
+        self._value_bytes = 0
+
+        resident = resident_memory_mb()
+        self._state_bytes = (budget_mb - HEADROOM_MB - (resident or 0.0)) * 2**20
+        if self._state_bytes <= 0:
+            raise ValueError(f"a memory budget of {budget_mb:g} MB leaves no room for per-IP state "
+                             f"(this process already uses {resident or 0:.0f} MB)")
+
+        self._spill_dir = tempfile.TemporaryDirectory(prefix="log_analyser_spill_", dir=spill_dir)
+
+    def load(self, ip: bytes) -> dict:
+        """Returns the spilled entry of an IP that isn't hot, or a new one. The caller puts it in `hot`."""
+        if len(self.hot) >= self.check_at:
+            self.trim()
+
+        if self._db is not None:
+            row = self._db.execute("SELECT seq, entry FROM state WHERE ip = ?", (ip,)).fetchone()
+            if row is not None:
+                self._order[ip] = row[0]
+                return pickle.loads(row[1])
+
+        self._order[ip] = self._next_order
+        self._next_order += 1
+        return new_entry(self.detailed, self.approximate)
+
+    def add_counts(self, counts: dict) -> None:
+        """Adds the parser's {raw IP: [total, errors]} counts (counts-only mode)."""
+        hot = self.hot
+        for ip, (total, errors) in counts.items():
+            entry = hot.get(ip)
+            if entry is None:
+                entry = hot[ip] = self.load(ip)
+            entry["total"] += total
+            entry["errors"] += errors
+
+    def merge(self, partial: dict) -> None:
+        """merge_log_dicts() into the store: adds a {ip: entry} map from another parse."""
+        hot = self.hot
+        for ip, data in partial.items():
+            key = ip.encode("utf-8")
+            entry = hot.get(key)
+            if entry is None:
+                entry = hot[key] = self.load(key)
+            merge_log_dicts({key: entry}, {key: data})
+
+    def trim(self) -> None:
+        """Estimates the hot state's size and spills cold entries past the hot capacity. Only called between lines."""
+        # The intern tables come out of the same share, and the hot IPs get what they leave
+        state_bytes = self._state_bytes - self._table_bytes()
+        if self.hot:
+            ip_bytes = self._average_ip_bytes()
+            if self.capacity is not None or len(self.hot) * ip_bytes > state_bytes:
+                self.capacity = max(MIN_CAPACITY, int(state_bytes / ip_bytes))
+
+        if self.capacity is not None and len(self.hot) > self.capacity:
+            keep = int(self.capacity * LOW_WATER)
+            marks = self._marks
+            # Cold first (no lines since the previous spill), oldest first within each group
+            cold = [ip for ip, entry in self.hot.items() if marks.get(ip) == entry["total"]]
+            if len(self.hot) - len(cold) > keep:
+                cold_set = set(cold)
+                cold += [ip for ip in self.hot if ip not in cold_set]
+            self._spill(cold[:len(self.hot) - keep])
+            self._marks = {ip: entry["total"] for ip, entry in self.hot.items()}
+
+        self.check_at = len(self.hot) + CHECK_EVERY
+        if self.capacity is not None:
+            self.check_at = min(self.check_at, self.capacity + 1)
+
+    def finish(self) -> "StateStore":
+        """Ends the parse. If anything was spilled, the hot entries join it on disk so reads see one ordered set."""
+        if self._db is not None:
+            self._spill(list(self.hot))
+            self._length = self._db.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+        else:
+            self._length = len(self.hot)
+        self._marks = {}
+        return self
+
+    def close(self) -> None:
+        """Deletes the spill file."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        self.hot = {}
+        self._spill_dir.cleanup()
+
+    @property
+    def spilled(self) -> bool:
+        return self._db is not None
+
+    # --- Read access, like a log_dict (after finish) ---
+
+    def __len__(self):
+        return len(self.hot) if self._length is None else self._length
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        return self._iter_keys()
+
+    def keys(self):
+        return _View(self, self._iter_keys)
+
+    def values(self):
+        return _View(self, lambda: (entry for _, entry in self._iter_items()))
+
+    def items(self):
+        return _View(self, self._iter_items)
+
+    def top_by_errors(self, count: int | None = None) -> list:
+        """top_ips(rank_by="errors") of a spilled store: most errors first, ties in first-seen order. Only the picked entries are loaded."""
+        rows = self._rows(f"SELECT ip, entry FROM state ORDER BY errors DESC, seq LIMIT {-1 if count is None else int(count)}")
+        return [(ip.decode("utf-8"), pickle.loads(entry)) for ip, entry in rows]
+
+    def get(self, ip: str, default=None):
+        key = ip.encode("utf-8")
+        if self._db is None:
+            return self.hot.get(key, default)
+        row = self._db.execute("SELECT entry FROM state WHERE ip = ?", (key,)).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def __getitem__(self, ip: str):
+        entry = self.get(ip)
+        if entry is None:
+            raise KeyError(ip)
+        return entry
+
+    def __contains__(self, ip):
+        return self.get(ip) is not None
+
+    def _iter_keys(self):
+        if self._db is None:
+            return (ip.decode("utf-8") for ip in self.hot)
+        return (ip.decode("utf-8") for (ip,) in self._rows("SELECT ip FROM state ORDER BY seq"))
+
+    def _iter_items(self):
+        if self._db is None:
+            return ((ip.decode("utf-8"), entry) for ip, entry in self.hot.items())
+        return ((ip.decode("utf-8"), pickle.loads(entry)) for ip, entry in self._rows("SELECT ip, entry FROM state ORDER BY seq"))
+
+    def _rows(self, query):
+        # A cursor of its own, so several passes can be in flight at once
+        cursor = self._db.execute(query)
+        while rows := cursor.fetchmany(_FETCH_ROWS):
+            yield from rows
+
+    def _average_ip_bytes(self):
+        # Every n-th hot entry, so old (grown) and new (small) IPs are both represented
+        step = max(1, len(self.hot) // SIZE_SAMPLE)
+        sample = list(islice(self.hot.values(), 0, None, step))
+        return sum(map(entry_size, sample)) / len(sample) + IP_OVERHEAD
+
+    def _table_bytes(self):
+        # Only values added since the previous check are measured (all of them again after a compact()).
+        # The dict and list count twice: growing one briefly holds its old and new arrays
+        size = 0
+        for index, table in enumerate(self._tables):
+            values = table.values
+            if len(values) < self._measured[index]:
+                self._measured, self._value_bytes = [0] * len(self._tables), 0
+                return self._table_bytes()
+            new = values[self._measured[index]:]
+            self._value_bytes += sum(map(sys.getsizeof, new)) + len(new) * ID_BYTES
+            self._measured[index] = len(values)
+            size += 2 * (sys.getsizeof(table.ids) + sys.getsizeof(values))
+        return size + self._value_bytes
+
+    def _spill(self, ips):
+        if not ips:
+            return
+        if self._db is None:
+            self._db = sqlite3.connect(os.path.join(self._spill_dir.name, "state.db"))
+            # Scratch data: nothing to recover after a crash, so skip the journal and fsyncs
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("PRAGMA synchronous = OFF")
+            # Errors sit beside the pickled entry so ranking doesn't unpickle every IP
+            self._db.execute("CREATE TABLE state (ip BLOB PRIMARY KEY, seq INTEGER, errors INTEGER, entry BLOB)")
+            self._db.execute("CREATE INDEX state_seq ON state (seq)")
+
+        hot, order, marks = self.hot, self._order, self._marks
+        self._db.executemany("INSERT OR REPLACE INTO state (ip, seq, errors, entry) VALUES (?, ?, ?, ?)",
+                             ((ip, order[ip], hot[ip]["errors"], pickle.dumps(hot[ip], pickle.HIGHEST_PROTOCOL))
+                              for ip in ips))
+        self._db.commit()
+        for ip in ips:
+            del hot[ip], order[ip]
+            marks.pop(ip, None)
+        self.spilled_ips += len(ips)
+
+
+class _View:
+    """keys() / values() / items() of a StateStore: sized, and iterable any number of times like a dict view."""
+
+    def __init__(self, store, iterate):
+        self._store = store
+        self._iterate = iterate
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self):
+        return self._iterate()
+
+
+def entry_size(entry) -> int:
+    """Bytes held by one per-IP entry. Strings (field and rule names), small ints and classes are shared, so not counted."""
+    size, seen, pending = 0, set(), [entry]
+    while pending:
+        value = pending.pop()
+        if (value is None or isinstance(value, (str, bool, type)) or id(value) in seen
+                or (type(value) is int and -5 <= value <= 256)):
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        pending.extend(gc.get_referents(value))
+    return size
+
+
+def resident_memory_mb() -> float | None:
+    """Current resident memory of this process in MB (Linux; elsewhere the peak so far, or None)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return peak_memory_mb()["process"]
@@ -0,0 +1,119 @@
+import argparse
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from anomaly_detector import SavedModel, build_features, detect_anomalies, fit_forest, score_features, train_model
+from log_analyser import scoring_error
+
+
+ANALYSER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log_analyser.py")
+
+
+def make_log_dict(count):
+    log_dict = {f"10.0.{index // 256}.{index % 256}": {"total": 20 + index % 7, "errors": index % 3}
+                for index in range(count)}
+    log_dict["203.0.113.9"] = {"total": 5000, "errors": 4900}
+    return log_dict
+
+
+def test_saved_model_scores_in_batches(tmp_path):
+
+    model_path = tmp_path / "model.pkl"
+    baseline = make_log_dict(300)
+    assert train_model(baseline, model_path) == ["total_requests", "error_rate", "unique_path_count"]
+
+    # Nothing is read until the first score
+    model = SavedModel(model_path)
+    assert model._saved is None
+
+    anomalous_ips, score_dict = detect_anomalies(baseline, threshold=-0.05, model=model, batch_size=64)
+    assert "203.0.113.9" in anomalous_ips
+
+    # Same scores as fitting on the same data, however it is batched
+    _, fitted_scores = detect_anomalies(baseline, threshold=-0.05)
+    assert score_dict == pytest.approx(fitted_scores)
+
+
+def test_saved_model_refuses_missing_features(tmp_path):
+
+    model_path = tmp_path / "model.pkl"
+    train_model(make_log_dict(50), model_path)
+
+    model = SavedModel(model_path)
+    model._load()["feature_names"].append("peak_window_requests")
+    with pytest.raises(ValueError):
+        detect_anomalies(make_log_dict(50), model=model)
+
+
+def test_array_results_match_the_dict_contract():
+
+    log_dict = make_log_dict(200)
+    anomalous_ips, score_dict = detect_anomalies(log_dict, threshold=-0.05)
+    ips, scores, is_anomaly = detect_anomalies(log_dict, threshold=-0.05, return_arrays=True)
+
+    assert scores.dtype.kind == "f" and len(scores) == len(ips) == len(log_dict)
+    assert dict(zip(ips, scores.tolist())) == score_dict
+    assert {ip for ip, flagged in zip(ips, is_anomaly) if flagged} == anomalous_ips
+
+
+def test_process_pool_scoring_matches_serial():
+
+    _, features, _ = build_features(make_log_dict(500))
+    forest = fit_forest(features)
+
+    serial = score_features(forest, features)
+    pooled, jobs = score_features(forest, features, batch_size=100, jobs=2, return_jobs=True)
+    assert jobs == 2 and np.allclose(serial, pooled)
+
+
+def test_memory_cap_bounds_scoring():
+
+    features = np.random.default_rng(0).random((100_000, 3), dtype=np.float32)
+    forest = fit_forest(features)
+    serial = score_features(forest, features)
+
+    for memory_mb in (2, 4):
+        tracemalloc.start()
+        scores, jobs = score_features(forest, features, jobs=4, memory_mb=memory_mb, return_jobs=True)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # No room for a scoring process, so everything (the scores included) fits in the cap in this one
+        assert jobs == 1
+        assert peak <= memory_mb * 2**20
+        assert np.allclose(scores, serial)
+
+    # Room for two processes but not four
+    _, jobs = score_features(forest, features, batch_size=10_000, jobs=4, memory_mb=450, return_jobs=True)
+    assert jobs == 2
+
+    # The scores alone (0.8 MB) leave too little
+    with pytest.raises(ValueError, match="too small"):
+        score_features(forest, features, memory_mb=1)
+
+
+def test_cli_trains_on_the_detailed_features_by_default(tmp_path):
+    # ANOMALY_THRESHOLD is calibrated for these features - re-tune it if this list changes
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(f'10.0.0.{index % 50} - - [10/Oct/2025:13:{index // 60 % 60:02d}:{index % 60:02d} +0000] '
+                                f'"GET /{index % 7} HTTP/1.1" {404 if index % 9 == 0 else 200} 512\n' for index in range(500)))
+
+    for name, extra in (("default", []), ("counts", ["--counts-only"])):
+        subprocess.run([sys.executable, ANALYSER, "-f", str(log_file), "--train-model", str(tmp_path / f"{name}.pkl")] + extra,
+                       cwd=tmp_path, capture_output=True, check=True)
+
+    assert SavedModel(tmp_path / "default.pkl").feature_names == [
+        "total_requests", "error_rate", "unique_path_count", "peak_window_requests", "peak_window_errors"]
+    assert SavedModel(tmp_path / "counts.pkl").feature_names == ["total_requests", "error_rate", "unique_path_count"]
+
+
+def test_scoring_errors_only_name_a_model_that_was_given():
+    error = ValueError("empty feature matrix")
+
+    assert scoring_error(argparse.Namespace(model=None), error) == "Could not score the IPs: empty feature matrix"
+    assert "'baseline.pkl'" in scoring_error(argparse.Namespace(model="baseline.pkl"), error)
@@ -0,0 +1,71 @@
+import ipaddress
+import random
+
+from cidr_index import CidrIndex, load_cidr_files
+from enrichment import BLOCKLIST_SCORE, check_blocklist
+
+
+def test_longest_prefix_match_for_ipv4_and_ipv6(tmp_path):
+
+    feed = tmp_path / "drop.txt"
+    feed.write_text("; Spamhaus DROP style feed\n"
+                    "10.0.0.0/8 ; SBL1\n"
+                    "10.1.0.0/16 ; SBL2\n"
+                    "10.1.2.3/32 ; SBL3\n"
+                    "2001:db8::/32 ; SBL6\n"
+                    "not-a-prefix\n")
+    asn = tmp_path / "asn.txt"
+    asn.write_text("192.0.2.0/24 64500\n2001:db8:1::/48\n")
+
+    index = load_cidr_files([feed, asn])
+    ips = ["10.9.9.9", "10.1.9.9", "10.1.2.3", "10.1.2.4", "11.0.0.1", "192.0.2.200",
+           "2001:db8::1", "2001:db8:1::5", "2001:db9::1"]
+
+    assert index.lookup_many(ips) == ["SBL1", "SBL2", "SBL3", "SBL2", None, "64500", "SBL6", "asn", None]
+    assert index.lookup("10.255.255.255") == "SBL1"
+
+    # The first enrichment tier only returns the listed IPs
+    assert check_blocklist(ips, index) == {ip: (BLOCKLIST_SCORE, "N/A") for ip in ips
+                                           if ip not in ("11.0.0.1", "2001:db9::1")}
+
+
+def test_ipv6_batch_lookup_matches_a_plain_search():
+    rng = random.Random(7)
+    prefixes, seen = [], set()
+    for index in range(300):
+        # Shared upper halves, so many intervals differ only in their low 64 bits
+        address = (0x20010db8 << 96) | (rng.getrandbits(8) << 64) | rng.getrandbits(64)
+        network = ipaddress.IPv6Network((address, rng.choice([56, 64, 72, 96, 120, 128])), strict=False)
+        if network not in seen:
+            seen.add(network)
+            prefixes.append((network, f"list-{index}"))
+    index = CidrIndex(prefixes)
+
+    def expected(ip):
+        address = ipaddress.IPv6Address(ip.split("%")[0])
+        matches = [(network.prefixlen, label) for network, label in prefixes if address in network]
+        return max(matches)[1] if matches else None
+
+    edges = [str(network.network_address) for network, _ in prefixes[:50]]
+    edges += [str(network.broadcast_address) for network, _ in prefixes[:50]]
+    edges += [str(network.broadcast_address + 1) for network, _ in prefixes[:50] if int(network.broadcast_address) < 2**128 - 1]
+    ips = edges + [str(ipaddress.IPv6Address((0x20010db8 << 96) | rng.getrandbits(72))) for _ in range(500)]
+    ips += ["fe80::1%eth0", str(prefixes[0][0].network_address) + "%eth0", "::1", "ffff::"]
+
+    assert index.lookup_many(ips) == [expected(ip) for ip in ips]
+    # Unparseable IPv6 never matches, and doesn't disturb the rest of the batch
+    assert index.lookup_many(["2001:db8::zz", ips[0], "1::2::3"]) == [None, expected(ips[0]), None]
+
+
+def test_tokens_that_are_not_canonical_addresses_never_match(tmp_path):
+
+    bogons = tmp_path / "bogons.txt"
+    bogons.write_text("0.0.0.0/8\n10.0.0.0/8\n::/8\n")
+    index = load_cidr_files([bogons])
+
+    # inet_aton would read these as 0.0.0.10, 0.0.4.210, 1.0.0.2 ... inside 0.0.0.0/8
+    tokens = ["10", "abc", "1234", "1.2", "deadbeef", "010.0.0.1", "0.0.0.256", ""]
+    assert index.lookup_many(tokens) == [None] * len(tokens)
+    assert index.lookup_many(tokens + ["0.0.0.1", "10.1.2.3"]) == [None] * len(tokens) + ["bogons", "bogons"]
+    assert index.lookup_many(["0.0.0.1", "10.1.2.3"]) == ["bogons", "bogons"]
+    assert check_blocklist(tokens + ["10.1.2.3"], index) == {"10.1.2.3": (BLOCKLIST_SCORE, "N/A")}
@@ -0,0 +1,169 @@
+import datetime
+import json
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from enrichment import ReputationCache, TokenBucket, enrich_ips
+
+
+class StubAbuseIPDB(BaseHTTPRequestHandler):
+    """Answers like /api/v2/check, rate limiting the first request for each IP once."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive, so pooled connections are reused
+    limited = set()
+    client_ports = set()
+    lock = threading.Lock()
+
+    def do_GET(self):
+        ip = parse_qs(urlparse(self.path).query)["ipAddress"][0]
+        with self.lock:
+            self.client_ports.add(self.client_address[1])
+            first_time = ip not in self.limited
+            self.limited.add(ip)
+
+        if first_time:
+            self._reply(429, {"errors": []}, {"Retry-After": "0"})
+        else:
+            self._reply(200, {"data": {"abuseConfidenceScore": int(ip.split(".")[-1]), "countryCode": "NL"}},
+                        {"X-RateLimit-Remaining": "1000", "X-RateLimit-Reset": "0"})
+
+    def _reply(self, status, body, headers):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_enrich_ips_retries_429s_over_pooled_connections():
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAbuseIPDB)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v2/check"
+
+    try:
+        ips = [f"10.0.0.{index}" for index in range(40)]
+        results = enrich_ips(ips, "test-key", workers=4, rate=1000, url=url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results == {ip: (int(ip.split(".")[-1]), "NL") for ip in ips}
+
+    # 80 requests (each IP is rate limited once), but only one connection per worker
+    assert len(StubAbuseIPDB.client_ports) <= 4
+
+
+class RefusingAbuseIPDB(StubAbuseIPDB):
+    """Refuses the key for one IP and answers the rest with bodies that aren't the documented JSON."""
+
+    requests = 0
+
+    def do_GET(self):
+        ip = parse_qs(urlparse(self.path).query)["ipAddress"][0]
+        with self.lock:
+            RefusingAbuseIPDB.requests += 1
+
+        if ip == "10.0.0.0":
+            self._reply(401, {"errors": [{"detail": "Authentication failed"}]}, {})
+        elif ip == "10.0.0.1":
+            payload = b"<html>Bad gateway</html>"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self._reply(200, {"errors": []}, {})
+
+
+def test_enrich_ips_stops_on_a_refused_key_and_skips_odd_bodies():
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RefusingAbuseIPDB)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v2/check"
+
+    try:
+        # The odd bodies come back as misses rather than raising
+        assert enrich_ips(["10.0.0.1", "10.0.0.2"], "test-key", workers=1, rate=1000, url=url) == {}
+
+        RefusingAbuseIPDB.requests = 0
+        ips = [f"10.0.0.{index}" for index in range(40)]
+        results = enrich_ips(ips, "test-key", workers=1, rate=1000, url=url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results == {}
+    assert RefusingAbuseIPDB.requests == 1
+
+
+class OddHeadersAbuseIPDB(StubAbuseIPDB):
+    """Answers with a Retry-After in HTTP-date form, or with quota headers that aren't numbers."""
+
+    def do_GET(self):
+        ip = parse_qs(urlparse(self.path).query)["ipAddress"][0]
+        last_octet = int(ip.split(".")[-1])
+        if last_octet % 2:
+            headers = {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}
+        else:
+            headers = {"Retry-After": "soon", "X-RateLimit-Remaining": "lots", "X-RateLimit-Reset": "never"}
+        self._reply(200, {"data": {"abuseConfidenceScore": last_octet, "countryCode": "NL"}}, headers)
+
+
+def test_enrich_ips_tolerates_date_and_garbage_rate_limit_headers():
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OddHeadersAbuseIPDB)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/api/v2/check"
+
+    try:
+        ips = [f"10.0.0.{index}" for index in range(10)]
+        results = enrich_ips(ips, "test-key", workers=2, rate=1000, url=url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert results == {ip: (int(ip.split(".")[-1]), "NL") for ip in ips}
+
+
+def test_token_bucket_follows_quota_headers():
+
+    bucket = TokenBucket(rate=1000)
+    bucket.update_from_headers({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "9999999999"})
+
+    # Out of quota until the reset: don't hang, give up
+    assert bucket.acquire(max_wait=0.1) is False
+
+    # A Retry-After date in the past doesn't pause; one that can't be read is ignored
+    bucket = TokenBucket(rate=1000)
+    assert bucket.update_from_headers({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}) is True
+    assert bucket.update_from_headers({"Retry-After": "later", "X-RateLimit-Remaining": "n/a"}) is False
+    assert bucket.acquire(max_wait=0.1) is True
+
+
+def test_reputation_cache_bulk_lookup_honours_ttl():
+
+    db_connection = sqlite3.connect(":memory:")
+    db_connection.execute("CREATE TABLE reputation (ip_address TEXT PRIMARY KEY, abuse_score INTEGER, country TEXT, last_checked TEXT)")
+    stale = (datetime.datetime.now() - datetime.timedelta(days=30)).isoformat()
+    db_connection.execute("INSERT INTO reputation VALUES ('10.9.9.9', 90, 'RU', ?)", (stale,))
+
+    cache = ReputationCache(db_connection, ttl_days=7, lru_size=1000)
+    ips = [f"10.0.{index // 256}.{index % 256}" for index in range(2000)]
+    cache.put_many({ip: (1, "NL") for ip in ips})
+
+    # Spans several IN (...) chunks; a fresh cache starts with an empty LRU
+    assert ReputationCache(db_connection).get_many(ips + ["10.9.9.9"]) == {ip: (1, "NL") for ip in ips}
+
+    # The LRU stays bounded and answers without the database
+    assert len(cache._lru) == 1000
+    db_connection.close()
+    assert cache.get_many(ips[-10:]) == {ip: (1, "NL") for ip in ips[-10:]}
@@ -0,0 +1,34 @@
+import csv
+
+from file_parser import parse_apache_file
+from generate_test_dataset import generate_large_dataset, session_mix
+
+
+def test_large_dataset_is_reproducible_and_labelled(tmp_path):
+
+    outputs = []
+    for workers in (1, 2):
+        log_file, labels_file = tmp_path / f"{workers}.log", tmp_path / f"{workers}.csv"
+        lines = generate_large_dataset(30_000, 1_500, seed=7, workers=workers, attack_share=0.01,
+                                       output_file=log_file, ground_truth_file=labels_file)
+        outputs.append((log_file.read_bytes(), labels_file.read_bytes()))
+
+    # The same seed gives the same files however many workers generate them
+    assert outputs[0] == outputs[1]
+
+    with open(labels_file, newline="") as csv_file:
+        labels = {row["IP Address"]: row["Label"] for row in csv.DictReader(csv_file)}
+    log_dict = parse_apache_file(log_file)
+
+    assert len(labels) == 1_500 and set(log_dict) <= set(labels)
+    assert "ATTACK" in labels.values()
+    assert sum(data["total"] for data in log_dict.values()) == lines
+    assert 20_000 < lines < 40_000
+
+
+def test_session_mix_scales_benign_traffic():
+
+    # Few lines per IP: mostly short visits; many: repeat sessions
+    assert session_mix(5)[0] < 0.2 and session_mix(5)[1] == 1.0
+    normal_share, sessions_per_ip = session_mix(200)
+    assert normal_share == 1.0 and sessions_per_ip > 4
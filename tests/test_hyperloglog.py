@@ -0,0 +1,28 @@
+import pickle
+
+from hyperloglog import DEFAULT_PRECISION, HyperLogLog
+
+
+def test_estimate_is_within_error_bound():
+
+    for true_count in (10, 1000, 50000):
+        sketch = HyperLogLog()
+        for index in range(true_count):
+            sketch.add(f"/path/{index}".encode())
+
+        # Well inside 4 standard errors (1.04 / sqrt(256) ~ 6.5%)
+        assert abs(len(sketch) - true_count) <= max(2, 0.26 * true_count)
+
+
+def test_merge_equals_union_and_size_is_fixed():
+
+    left, right, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for index in range(5000):
+        value = f"agent-{index}".encode()
+        (left if index % 2 else right).add(value)
+        both.add(value)
+
+    left.merge(right)
+    assert left == both
+    assert len(left.registers) == 1 << DEFAULT_PRECISION
+    assert pickle.loads(pickle.dumps(left)) == left
@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import json
+import socket
+import threading
+
+from ingest_daemon import IngestDaemon, apache_line
+from intern_table import PATHS
+from rule_detector import detect_rule_anomalies
+
+
+LINE = '{ip} - - [10/Oct/2025:13:55:{second:02d} +0000] "POST /login HTTP/1.1" {status} 512 "-" "curl/8.0"\n'
+
+
+def lines(ip, count, status=401):
+    return "".join(LINE.format(ip=ip, second=second % 60, status=status) for second in range(count)).encode()
+
+
+async def request(port, method, target, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def test_apache_line_strips_syslog_headers():
+    line = b'10.0.0.1 - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 200 512 "-" "curl/8.0"'
+
+    assert apache_line(b"<134>Oct 10 13:55:36 web01 apache: " + line) == line
+    assert apache_line(b"<134>1 2025-10-10T13:55:36Z web01 apache - - - " + line) == line
+    assert apache_line(line) == line
+    assert apache_line(b"<134>Oct 10 13:55:36 web01 kernel: eth0 link up") is None
+
+
+def test_lines_over_udp_and_http_are_scored_and_served():
+
+    async def scenario():
+        daemon = IngestDaemon(detect_rule_anomalies, syslog_port=0, http_port=0)
+        await daemon.start()
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+                for line in lines("10.0.0.66", 120).splitlines():
+                    udp.sendto(b"<134>Oct 10 13:55:36 web01 apache: " + line, ("127.0.0.1", daemon.syslog_port))
+                udp.sendto(b"<134>Oct 10 13:55:36 web01 kernel: not a log line", ("127.0.0.1", daemon.syslog_port))
+
+            status, body = await request(daemon.http_port, "POST", "/ingest", lines("10.0.0.7", 5, status=200))
+            assert (status, body) == (202, {"accepted": 5})
+
+            for _ in range(100):  # Let the datagrams arrive
+                if daemon.counters["udp_datagrams"] == 121:
+                    break
+                await asyncio.sleep(0.01)
+
+            assert daemon.drain() == 125
+            await daemon.score()
+
+            status, body = await request(daemon.http_port, "GET", "/anomalies?limit=5")
+            assert status == 200 and body["ips"] == 2
+            assert [entry["ip"] for entry in body["anomalies"]] == ["10.0.0.66"]
+            assert body["anomalies"][0]["errors"] == 120
+            assert (await request(daemon.http_port, "GET", "/anomalies?limit=-3"))[0] == 400
+
+            status, stats = await request(daemon.http_port, "GET", "/stats")
+            assert stats["udp_lines"] == 120 and stats["udp_ignored"] == 1 and stats["http_lines"] == 5
+            assert stats["lines_parsed"] == 125 and stats["scoring_runs"] == 1
+
+            assert (await request(daemon.http_port, "GET", "/ingest"))[0] == 405
+            assert (await request(daemon.http_port, "GET", "/missing"))[0] == 404
+        finally:
+            daemon.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_refuses_posts_and_counts_dropped_datagrams():
+
+    async def scenario():
+        daemon = IngestDaemon(detect_rule_anomalies, syslog_port=0, http_port=0, max_queue_bytes=600)
+        await daemon.start()
+        try:
+            status, _ = await request(daemon.http_port, "POST", "/ingest", lines("10.0.0.1", 5))
+            assert status == 202
+
+            # Nothing is draining the queue, so the next batch doesn't fit
+            status, body = await request(daemon.http_port, "POST", "/ingest", lines("10.0.0.2", 5))
+            assert status == 503 and body == {"error": "ingest queue full"}
+            assert not daemon.offer(lines("10.0.0.3", 5), "udp")
+
+            assert daemon.counters["http_rejected_posts"] == 1 and daemon.counters["http_rejected_lines"] == 5
+            assert daemon.counters["udp_dropped_lines"] == 5
+
+            daemon.drain()
+            assert daemon.offer(lines("10.0.0.3", 5), "udp")
+        finally:
+            daemon.close()
+
+    asyncio.run(scenario())
+
+
+def test_idle_ips_expire_from_the_rolling_state():
+    daemon = IngestDaemon(detect_rule_anomalies, state_ttl=60)
+    daemon.offer(lines("10.0.0.1", 1).replace(b"/login", b"/old"), "http")
+    daemon.offer(lines("10.0.0.2", 1), "http")
+    daemon.offer(b'10.0.0.2 - - [10/Oct/2025:14:30:00 +0000] "GET /new HTTP/1.1" 200 512 "-" "curl/8.0"\n', "http")
+    daemon.drain()
+    daemon._compact_at = 0  # Rebuild the intern tables on this run
+
+    asyncio.run(daemon.score())
+    assert list(daemon.log_dict) == ["10.0.0.2"]
+    assert daemon.counters["expired_ips"] == 1
+
+    # Only the buckets a window from the cutoff on can reach are kept, with the peaks
+    entry = daemon.log_dict["10.0.0.2"]
+    assert len(entry["window"].buckets) == 1 and entry["window"].peak_requests == 1
+    # The path only the expired IP used is dropped from the intern table
+    assert sorted(PATHS[value_id] for value_id in entry["paths"]) == [b"/login", b"/new"] and b"/old" not in PATHS.ids
+
+
+def test_counts_only_ips_expire_by_arrival():
+    daemon = IngestDaemon(detect_rule_anomalies, detailed=False, state_ttl=60)
+    daemon.offer(lines("10.0.0.1", 3) + lines("10.0.0.2", 3), "http")
+    daemon.drain()
+    daemon._arrivals["10.0.0.1"] -= 120
+
+    asyncio.run(daemon.score())
+    assert list(daemon.log_dict) == ["10.0.0.2"] and list(daemon._arrivals) == ["10.0.0.2"]
+    assert daemon.counters["expired_ips"] == 1
+
+
+def test_lines_keep_being_parsed_while_the_state_is_scored():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_score(log_dict):
+        started.set()
+        release.wait(5)
+        return detect_rule_anomalies(log_dict)
+
+    async def scenario():
+        daemon = IngestDaemon(slow_score)
+        daemon.offer(lines("10.0.0.66", 120), "http")
+        daemon.drain()
+        consumer = asyncio.create_task(daemon._consume())
+        scoring = asyncio.create_task(daemon.score())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+
+        daemon.offer(lines("10.0.0.66", 1) + lines("10.0.0.7", 5, status=200), "http")
+        for _ in range(100):
+            if not daemon._queue:
+                break
+            await asyncio.sleep(0.01)
+        assert not daemon._queue and daemon.stats()["ips"] == 2
+
+        release.set()
+        await scoring
+        consumer.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await consumer
+
+        assert list(daemon.log_dict) == ["10.0.0.66", "10.0.0.7"]
+        assert daemon.log_dict["10.0.0.66"]["total"] == 121 and daemon.counters["lines_parsed"] == 126
+        assert [entry["ip"] for entry in daemon.top] == ["10.0.0.66"]
+
+    asyncio.run(scenario())
+
+
+def test_a_failing_scoring_run_is_counted_and_the_daemon_keeps_going(capsys):
+    calls = []
+
+    def flaky_score(log_dict):
+        calls.append(len(log_dict))
+        if len(calls) == 1:
+            raise MemoryError("out of memory")
+        return detect_rule_anomalies(log_dict)
+
+    daemon = IngestDaemon(flaky_score)
+    daemon.offer(lines("10.0.0.66", 120), "http")
+    daemon.drain()
+
+    asyncio.run(daemon.score())
+    assert daemon.counters["scoring_errors"] == 1 and daemon.counters["scoring_runs"] == 0
+    assert daemon.top == [] and daemon.log_dict["10.0.0.66"]["total"] == 120
+    assert "Scoring failed" in capsys.readouterr().out
+
+    asyncio.run(daemon.score())
+    assert daemon.counters["scoring_runs"] == 1 and [entry["ip"] for entry in daemon.top] == ["10.0.0.66"]
@@ -0,0 +1,125 @@
+import gzip
+import pickle
+import tracemalloc
+
+import numpy as np
+
+from anomaly_detector import build_features
+from file_parser import merge_log_dicts, parse_apache_file, parse_log_files
+from ip_counters import IpCounters
+from reporting import top_ips
+
+
+# IPv4, IPv6, and tokens with no canonical form, which must come back exactly as logged
+ODD_IPS = ["2001:db8::1", "2001:DB8::1", "fe80::1", "0.0.0.0", "255.255.255.255", "deadbeef", "010.0.0.1"]
+
+
+def mixed_lines(count):
+    lines = []
+    for index in range(count):
+        ip = ODD_IPS[index % len(ODD_IPS)] if index % 3 == 0 else f"10.{index % 5}.{index % 7}.{index % 11}"
+        status = 404 if index % 4 == 0 else 200
+        lines.append(f'{ip} - - [10/Oct/2025:13:55:36 +0000] "GET /page/{index} HTTP/1.1" {status} 512 "-" "curl/8.0"')
+    # One line for the regex fallback, and a last line without a newline
+    lines.append('10.9.9.9 - - "GET / HTTP/1.1" 200 - 512')
+    return "\n".join(lines) + "\n" + '10.0.0.2 - - [10/Oct/2025:13:55:37 +0000] "GET / HTTP/1.1" 500 1'
+
+
+def test_compact_parse_reads_like_the_dictionary(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text(mixed_lines(600))
+    expected = parse_apache_file(log_file, engine="fast")
+
+    counters = parse_apache_file(log_file, engine="fast", compact=True)
+    assert isinstance(counters, IpCounters)
+    assert len(counters) == len(expected) and list(counters) == list(expected)
+    assert list(counters.items()) == list(expected.items())
+    assert set(ODD_IPS) <= set(counters)
+
+    assert counters["2001:DB8::1"] == expected["2001:DB8::1"] and "2001:db8::2" not in counters
+    assert counters.get("deadbeef") == expected["deadbeef"]
+
+    # Packing needs the fields by position, so compact counting always uses the fast engine
+    counters = parse_apache_file(log_file, engine="regex", compact=True)
+    assert isinstance(counters, IpCounters) and list(counters.items()) == list(expected.items())
+
+    # An IPv4-mapped address isn't folded into the plain IPv4 one
+    direct = IpCounters()
+    for ip in ("::ffff:1.2.3.4", "1.2.3.4", "::1", "1.2.3.4"):
+        direct.add(ip.encode(), 1, 0)
+    assert dict(direct.items()) == {"::ffff:1.2.3.4": {"total": 1, "errors": 0}, "1.2.3.4": {"total": 2, "errors": 0},
+                                    "::1": {"total": 1, "errors": 0}}
+
+    # Workers send their counters back pickled, and merge them in chunk order
+    assert list(parse_apache_file(log_file, workers=3, engine="fast", compact=True).items()) == list(expected.items())
+    assert list(pickle.loads(pickle.dumps(counters)).items()) == list(expected.items())
+
+
+def test_compact_files_merge_in_order(tmp_path):
+    text = mixed_lines(300)
+    (tmp_path / "access.log").write_text(text)
+    with gzip.open(tmp_path / "access.log.1.gz", "wt") as compressed:
+        compressed.write(mixed_lines(200).replace("10.", "172.16."))
+    expected = parse_log_files(str(tmp_path), engine="fast")
+
+    counters = parse_log_files(str(tmp_path), engine="fast", compact=True)
+    assert isinstance(counters, IpCounters)
+    assert list(counters.items()) == list(expected.items())
+
+    # A dictionary partial merges in too, and the counters stay the target
+    assert merge_log_dicts(counters, {"10.0.0.2": {"total": 2, "errors": 1}, "192.0.2.7": {"total": 1, "errors": 0}}) is counters
+    assert counters["10.0.0.2"]["total"] == expected["10.0.0.2"]["total"] + 2
+    assert list(counters)[-1] == "192.0.2.7"
+
+
+def test_counters_take_a_fraction_of_the_memory(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(f'10.{index // 65536}.{index // 256 % 256}.{index % 256} - - '
+                                f'[10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 200 512\n' for index in range(20_000)))
+
+    retained = {}
+    for compact in (False, True):
+        tracemalloc.start()
+        result = parse_apache_file(log_file, engine="fast", compact=compact)
+        retained[compact] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(result) == 20_000
+        del result
+
+    assert retained[False] > 5 * retained[True]
+
+
+def test_compact_parse_peak_stays_near_the_columns(tmp_path, monkeypatch):
+    # Small blocks, so the per-IP state rather than the block of lines sets the peak
+    monkeypatch.setattr("file_parser.BLOCK_SIZE", 64 * 1024)
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(f'10.{index // 65536}.{index // 256 % 256}.{index % 256} - - '
+                                f'[10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 200 512\n' for index in range(50_000)))
+
+    tracemalloc.start()
+    counters = parse_apache_file(log_file, engine="fast", compact=True)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(counters) == 50_000
+    assert peak < 3 * retained
+
+
+def test_features_and_ranking_match_the_dictionary(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text(mixed_lines(500))
+    log_dict = parse_apache_file(log_file, engine="fast")
+    counters = parse_apache_file(log_file, engine="fast", compact=True)
+
+    ips, features, names = build_features(counters)
+    expected_ips, expected_features, expected_names = build_features(log_dict)
+    assert ips == expected_ips and names == expected_names
+    assert features.dtype == np.float32 and np.array_equal(features, expected_features)
+
+    # The columns go to numpy as views, not copies
+    totals, _ = counters.arrays()
+    assert np.shares_memory(totals, np.frombuffer(counters.totals, dtype=np.uint64))
+
+    # Many IPs tie on errors - both keep first-seen order
+    assert top_ips(counters, {}, 5) == top_ips(log_dict, {}, 5)
+    assert top_ips(counters, {}) == top_ips(log_dict, {})
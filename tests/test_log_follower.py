@@ -0,0 +1,87 @@
+from log_follower import LogFollower
+
+
+LINE = '{ip} - - [10/Oct/2025:13:55:36 +0000] "GET /index.html HTTP/1.1" {status} 2326\n'
+
+
+def test_follower_counts_only_new_lines(tmp_path):
+
+    log_file = tmp_path / "access.log"
+    log_file.write_text(LINE.format(ip="127.0.0.1", status=200))
+
+    follower = LogFollower(log_file)
+    assert follower.poll() == 1
+
+    # A half-written line is held back until its newline arrives
+    with open(log_file, "a") as log:
+        log.write(LINE.format(ip="192.168.1.1", status=404)[:20])
+    assert follower.poll() == 0
+    with open(log_file, "a") as log:
+        log.write(LINE.format(ip="192.168.1.1", status=404)[20:])
+    assert follower.poll() == 1
+
+    assert follower.log_dict == {
+        "127.0.0.1": {"total": 1, "errors": 0},
+        "192.168.1.1": {"total": 1, "errors": 1}
+    }
+    follower.close()
+
+
+def test_follower_survives_rotation_and_truncation(tmp_path):
+
+    log_file = tmp_path / "access.log"
+    log_file.write_text(LINE.format(ip="127.0.0.1", status=200))
+
+    follower = LogFollower(log_file)
+    follower.poll()
+
+    # logrotate: the old file gets one last line, is moved aside and a new one is created
+    with open(log_file, "a") as log:
+        log.write(LINE.format(ip="127.0.0.1", status=500))
+    log_file.rename(tmp_path / "access.log.1")
+    log_file.write_text(LINE.format(ip="10.0.0.1", status=200))
+    assert follower.poll() == 2
+
+    # copytruncate: same inode, smaller file
+    log_file.write_text(LINE.format(ip="1.2.3.4", status=403))
+    assert follower.poll() == 1
+
+    assert follower.log_dict == {
+        "127.0.0.1": {"total": 2, "errors": 1},
+        "10.0.0.1": {"total": 1, "errors": 0},
+        "1.2.3.4": {"total": 1, "errors": 1}
+    }
+    follower.close()
+
+
+def test_follower_keeps_a_partial_last_line_across_rotation(tmp_path):
+
+    log_file = tmp_path / "access.log"
+    log_file.write_text(LINE.format(ip="127.0.0.1", status=200))
+
+    follower = LogFollower(log_file, detailed=True)
+    follower.poll()
+
+    # Half of the last line is read, the rest lands in the old file, which is then
+    # rotated without ever getting its newline
+    last_line = LINE.format(ip="10.0.0.5", status=404)
+    with open(log_file, "a") as log:
+        log.write(last_line[:30])
+    assert follower.poll() == 0
+    with open(log_file, "a") as log:
+        log.write(last_line[30:-1])
+    log_file.rename(tmp_path / "access.log.1")
+    log_file.write_text(LINE.format(ip="10.0.0.1", status=200))
+    assert follower.poll() == 2
+
+    # copytruncate while a line is still unterminated
+    with open(log_file, "a") as log:
+        log.write(LINE.format(ip="1.2.3.4", status=403)[:-1])
+    assert follower.poll() == 0
+    log_file.write_text(LINE.format(ip="10.0.0.1", status=200))
+    assert follower.poll() == 2
+
+    assert follower.lines_read == 5
+    assert {ip: (entry["total"], entry["errors"]) for ip, entry in follower.log_dict.items()} == {
+        "127.0.0.1": (1, 0), "10.0.0.5": (1, 1), "10.0.0.1": (2, 0), "1.2.3.4": (1, 1)}
+    follower.close()
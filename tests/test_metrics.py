@@ -0,0 +1,53 @@
+import gzip
+import json
+import pstats
+import time
+
+import pytest
+
+from file_parser import LINE_COUNTS, parse_log_files
+from metrics import RunMetrics
+
+
+def test_stages_and_counters_are_written(tmp_path):
+
+    metrics = RunMetrics(profile=True)
+    with metrics.stage("parse"):
+        time.sleep(0.02)
+    with metrics.stage("report"):
+        pass
+    metrics.count("cache_hits", 3)
+    metrics.count("cache_hits", 2)
+    metrics.count("parse_misses", None)  # Not measured
+
+    metrics.write(tmp_path / "metrics.json")
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["stages"]["parse"] >= 0.02 > data["stages"]["report"]
+    assert data["counters"] == {"cache_hits": 5}
+
+    metrics.write(tmp_path / "metrics.prom")
+    prometheus = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert "log_analyser_cache_hits 5" in prometheus
+    assert any(line.startswith('log_analyser_stage_seconds{stage="parse"} ') for line in prometheus)
+
+    # The slowest stage's profile is the one kept
+    assert metrics.write_profile(tmp_path / "run.prof") == "parse"
+    assert pstats.Stats(str(tmp_path / "run.prof")).total_calls > 0
+
+
+@pytest.mark.parametrize("options", [{"engine": "regex"}, {"engine": "fast"}, {"engine": "fast", "compact": True},
+                                     {"detailed": True}, {"engine": "fast", "workers": 3}, {"engine": "regex", "workers": 3}])
+def test_parse_engines_count_the_lines_they_read(tmp_path, options):
+
+    lines = [f'10.0.0.{index % 7} - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" {200 + index % 300} 5' for index in range(300)]
+    lines[50:50] = ["not a log line", "", "- - - [bad] GET"]
+    text = "\n".join(lines)  # The last line has no newline
+    (tmp_path / "access.log").write_text(text)
+    with gzip.open(tmp_path / "access.log.1.gz", "wt") as rotated:
+        rotated.write(text + "\n")
+
+    for path, files in ((tmp_path / "access.log", 1), (tmp_path, 2)):
+        LINE_COUNTS.reset()
+        log_dict = parse_log_files(str(path), **options)
+        assert (LINE_COUNTS.read, LINE_COUNTS.unparsed) == (303 * files, 3 * files)
+        assert sum(data["total"] for data in log_dict.values()) == LINE_COUNTS.read - LINE_COUNTS.unparsed
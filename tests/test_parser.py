@@ -1,18 +1,32 @@
-from file_parser import parse_apache_file
+import bz2
+import gzip
+import lzma
+import os
+import subprocess
+import sys
 
+import pytest
 
-def test_parse_apache_file(tmp_path):
+from file_parser import find_chunk_ranges, parse_apache_file, parse_log_files
+from intern_table import PATHS, USER_AGENTS
+
+
+ANALYSER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log_analyser.py")
 
-    # Fake log data for testing
-    fake_log_content = """127.0.0.1 - - [10/Oct/2025:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 2326
+
+# Fake log data for testing
+FAKE_LOG_CONTENT = """127.0.0.1 - - [10/Oct/2025:13:55:36 +0000] "GET /index.html HTTP/1.1" 200 2326
 192.168.1.1 - - [10/Oct/2025:13:56:12 +0000] "GET /login.php HTTP/1.1" 404 123
 127.0.0.1 - - [10/Oct/2025:13:57:01 +0000] "GET /style.css HTTP/1.1" 200 584
 192.168.1.1 - - [10/Oct/2025:13:58:22 +0000] "POST /submit HTTP/1.1" 500 0
 """
+
+
+def test_parse_apache_file(tmp_path):
     # Create a temporary file to write the content to
     # "tmp_path" is a special built-in pytest feature - creates a temp dir to use for testing
     log_file = tmp_path / "test_access.log"
-    log_file.write_text(fake_log_content)
+    log_file.write_text(FAKE_LOG_CONTENT)
 
     # Define the dictionary output expected for the function to return
     expected_output = {
@@ -25,3 +39,205 @@ def test_parse_apache_file(tmp_path):
 
     # Check if the actual output is exactly as expected
     assert actual_output == expected_output
+
+
+def test_parse_apache_file_parallel_matches_serial(tmp_path):
+
+    # Enough lines that every worker gets its own chunk
+    lines = []
+    for index in range(500):
+        ip = f"10.0.{index % 7}.{index % 13}"
+        status = "404" if index % 5 == 0 else "200"
+        lines.append(f'{ip} - - [10/Oct/2025:13:55:36 +0000] "GET /page/{index} HTTP/1.1" {status} 512')
+
+    log_file = tmp_path / "parallel_access.log"
+    log_file.write_text("\n".join(lines) + "\n")
+
+    serial_output = parse_apache_file(log_file)
+    parallel_output = parse_apache_file(log_file, workers=4)
+
+    # Same counts and the same first-seen IP order
+    assert parallel_output == serial_output
+    assert list(parallel_output) == list(serial_output)
+
+    with pytest.raises(ValueError):
+        find_chunk_ranges(log_file, 0)
+
+
+def test_parallel_regex_parse_matches_serial_on_odd_bytes(tmp_path):
+
+    # A lone "\r" inside a line and bytes that aren't UTF-8, spread over every worker's chunk
+    lines = []
+    for index in range(300):
+        lines.append(f'10.0.0.{index % 11} - - [10/Oct/2025:13:55:36 +0000] "GET /{index} HTTP/1.1" 200 512'.encode())
+        if index % 50 == 0:
+            lines.append(b'1.2.3.5 - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 200 5\r'
+                         b'5.6.7.8 - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 404 5')
+            lines.append(b'10.9.9.9 - - [10/Oct/2025:13:55:36 +0000] "GET /\xff\xfe HTTP/1.1" 500 5\r')
+
+    log_file = tmp_path / "odd_access.log"
+    log_file.write_bytes(b"\n".join(lines) + b"\n")
+
+    serial_output = parse_apache_file(log_file, engine="regex")
+    assert serial_output["10.9.9.9"] == {"total": 6, "errors": 6}
+    for workers in (2, 3):
+        parallel_output = parse_apache_file(log_file, workers=workers, engine="regex")
+        assert parallel_output == serial_output and list(parallel_output) == list(serial_output)
+
+
+def test_worker_counts_below_one_are_refused(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text('10.0.0.1 - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 200 512\n')
+
+    for flag in ("--workers", "--enrich-workers"):
+        result = subprocess.run([sys.executable, ANALYSER, "-f", str(log_file), flag, "0"],
+                                cwd=tmp_path, capture_output=True, text=True)
+        assert result.returncode == 2
+        assert "must be at least 1" in result.stderr
+
+
+def test_fast_engine_matches_regex_engine(tmp_path):
+
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text(FAKE_LOG_CONTENT)
+
+    assert parse_apache_file(log_file, engine="fast") == parse_apache_file(log_file)
+
+
+def test_fast_engine_falls_back_to_regex_for_odd_lines(tmp_path):
+
+    # Combined format, IPv6 and lines the fast path can't read by field position
+    odd_log_content = (
+        '2001:db8::1 - - [10/Oct/2025:13:55:36 +0000] "GET / HTTP/1.1" 403 10 "-" "curl/8.0"\n'
+        '[proxy] 10.0.0.2 - - [10/Oct/2025:13:55:38 +0000] "GET /b HTTP/1.1" 502 0\n'
+        'garbage line with no status\n'
+        '10.0.0.3 - - [10/Oct/2025:13:55:39 +0000] "GET /c HTTP/1.1" 404 0'
+    )
+    log_file = tmp_path / "odd_access.log"
+    log_file.write_text(odd_log_content)
+
+    assert parse_apache_file(log_file, engine="fast") == parse_apache_file(log_file)
+
+
+def test_fast_engine_reads_status_by_position(tmp_path):
+
+    # A user agent that smuggles in something that looks like a status code
+    log_file = tmp_path / "ua_access.log"
+    log_file.write_text('10.0.0.1 - - [10/Oct/2025:13:55:37 +0000] "GET /a HTTP/1.1" 404 10 "-" "x \\" 200 y"\n')
+
+    assert parse_apache_file(log_file, engine="fast") == {"10.0.0.1": {"total": 1, "errors": 1}}
+    # The regex engine's greedy match takes the smuggled status instead
+    assert parse_apache_file(log_file, engine="regex") == {"10.0.0.1": {"total": 1, "errors": 0}}
+
+
+def test_parse_log_files_reads_rotated_and_compressed_logs(tmp_path):
+
+    # Spread the fixture over a plain log and its compressed rotations
+    lines = FAKE_LOG_CONTENT.splitlines(keepends=True)
+    (tmp_path / "access.log").write_text(lines[0])
+    (tmp_path / "access.log.1.gz").write_bytes(gzip.compress(lines[1].encode()))
+    (tmp_path / "access.log.2.bz2").write_bytes(bz2.compress(lines[2].encode()))
+    (tmp_path / "access.log.3.xz").write_bytes(lzma.compress(lines[3].encode()))
+
+    expected_output = {
+        "127.0.0.1": {"total": 2, "errors": 0},
+        "192.168.1.1": {"total": 2, "errors": 2}
+    }
+
+    for engine in ("regex", "fast"):
+        assert parse_log_files(tmp_path, engine=engine) == expected_output
+        assert parse_log_files(tmp_path / "access.log*", workers=2, engine=engine) == expected_output
+
+
+def test_checkpoint_resumes_and_detects_rewrites(tmp_path):
+
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text(FAKE_LOG_CONTENT)
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+
+    first_run = parse_log_files(log_file, state_dir=state_dir)
+    assert first_run == parse_apache_file(log_file)
+
+    # Appended lines (including a half-written one) are merged into the saved state
+    with open(log_file, "a") as log:
+        log.write('10.0.0.9 - - [10/Oct/2025:14:00:00 +0000] "GET / HTTP/1.1" 403 0\n')
+        log.write('10.0.0.9 - - [10/Oct/2025:14:00:01 +0000] "GET / HTTP/1.1" 200 ')
+    assert parse_log_files(log_file, state_dir=state_dir) == parse_apache_file(log_file)
+
+    # Once the last line is finished it is counted exactly once
+    with open(log_file, "a") as log:
+        log.write('0\n')
+    assert parse_log_files(log_file, state_dir=state_dir) == parse_apache_file(log_file)
+
+    # Rewritten in place with different content: fall back to a full parse
+    log_file.write_text(FAKE_LOG_CONTENT.replace("127.0.0.1", "127.0.0.2") * 2)
+    assert parse_log_files(log_file, state_dir=state_dir) == parse_apache_file(log_file)
+
+
+def test_detailed_parse_interns_paths_and_user_agents(tmp_path):
+
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text(FAKE_LOG_CONTENT + '127.0.0.1 - - [10/Oct/2025:14:55:36 +0100] "GET /index.html?x=1 HTTP/1.1" 304 0 "-" "curl/8.0"\n')
+
+    log_dict = parse_apache_file(log_file, detailed=True)
+    entry = log_dict["127.0.0.1"]
+
+    # Same counts as the basic parse, plus the extra fields
+    assert {ip: (data["total"], data["errors"]) for ip, data in log_dict.items()} == \
+        {"127.0.0.1": (3, 0), "192.168.1.1": (2, 2)}
+    assert entry["bytes"] == 2326 + 584
+    assert entry["first_seen"] == entry["last_seen"] - 85
+    assert [PATHS[path_id] for path_id in entry["paths"]] == [b"/index.html", b"/style.css"]
+    assert [USER_AGENTS[agent_id] for agent_id in entry["agents"]] == [b"curl/8.0"]
+
+    # Worker processes intern into their own tables; the merged result must not care
+    parallel_dict = parse_apache_file(log_file, workers=3, detailed=True)
+    assert parallel_dict == log_dict
+
+
+def test_detailed_windows_do_not_depend_on_how_the_log_is_split(tmp_path):
+
+    def client(index):
+        # Bursts straddling the middle worker split and the checkpoint, with traffic going on long after
+        if 2800 <= index < 3200:
+            return "10.8.8.8"
+        if 3300 <= index < 3700:
+            return "10.9.9.9"
+        return ("10.8.8.8", "10.9.9.9")[index % 2] if index % 50 == 0 else f"10.0.0.{index % 40}"
+
+    lines = [f'{client(index)} - - [10/Oct/2025:{13 + index // 3600}:{index // 60 % 60:02d}:{index % 60:02d} +0000] '
+             f'"GET /admin/{index % 9} HTTP/1.1" {404 if index % 4 else 200} 10 "-" "curl/8.0"\n' for index in range(6000)]
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text("".join(lines[:3500]))
+    state_dir = tmp_path / "state"
+    state_dir.mkdir()
+    parse_log_files(log_file, state_dir=state_dir, detailed=True)
+    with open(log_file, "a") as log:
+        log.write("".join(lines[3500:]))
+
+    serial = parse_apache_file(log_file, detailed=True)
+    assert serial["10.9.9.9"]["window"].peak_requests == 300
+    assert serial["10.9.9.9"]["rules"]
+    for split in (parse_apache_file(log_file, workers=2, detailed=True),
+                  parse_log_files(log_file, state_dir=state_dir, detailed=True)):
+        assert {ip: (data["window"], data["rules"]) for ip, data in split.items()} == \
+               {ip: (data["window"], data["rules"]) for ip, data in serial.items()}
+
+
+def test_approximate_parse_counts_distinct_paths_with_sketches(tmp_path):
+
+    lines = [f'10.0.0.1 - - [10/Oct/2025:13:55:36 +0000] "GET /probe/{index} HTTP/1.1" 404 0 "-" "scanner"\n'
+             for index in range(2000)]
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text("".join(lines))
+
+    exact = parse_apache_file(log_file, detailed=True)["10.0.0.1"]
+    approximate = parse_apache_file(log_file, detailed=True, approximate=True)["10.0.0.1"]
+
+    assert (approximate["total"], approximate["errors"]) == (exact["total"], exact["errors"])
+    assert abs(len(approximate["paths"]) - len(exact["paths"])) < 0.2 * len(exact["paths"])
+    assert len(approximate["agents"]) == 1
+
+    # Sketches merge to the same registers whichever process filled them
+    assert parse_apache_file(log_file, workers=3, detailed=True, approximate=True)["10.0.0.1"] == approximate
@@ -0,0 +1,89 @@
+import pytest
+
+from file_parser import parse_apache_file
+from intern_table import PATHS
+from partials import merge_partials, read_partial, write_partial
+
+
+def write_log(path, lines):
+    path.write_text("".join(lines))
+    return path
+
+
+def host_lines(host, count):
+    lines = []
+    for index in range(count):
+        # 203.0.113.9 hits each host in a burst of its own, so its peak window spans the hosts
+        burst = {"a": 100, "b": 160, "c": 220}.get(host, 0) <= index < {"a": 100, "b": 160, "c": 220}.get(host, 0) + 120
+        ip = "203.0.113.9" if burst or not index % 3 else f"10.0.0.{index % 7}"
+        status = 401 if ip == "203.0.113.9" else 200
+        lines.append(f'{ip} - - [10/Oct/2025:13:{index * 3 // 60:02d}:{index * 3 % 60:02d} +0000] '
+                     f'"POST /{host}/login{index % 5} HTTP/1.1" {status} {index} "-" "agent-{index % 4}"\n')
+    return lines
+
+
+def summary(log_dict):
+    """Every field, with path ids turned back into paths"""
+    return {ip: (data["total"], data["errors"], data.get("bytes"), data.get("first_seen"), data.get("last_seen"),
+                 sorted(PATHS[path_id] for path_id in data["paths"]) if "paths" in data else None,
+                 data.get("window"), data.get("rules"))
+            for ip, data in log_dict.items()}
+
+
+@pytest.mark.parametrize("detailed, approximate", [(False, False), (True, False), (True, True)])
+def test_partial_round_trip(tmp_path, detailed, approximate):
+
+    # A client token can be any run of hex digits - longer than a one-byte length can hold
+    long_token = "ab" * 200
+    log_file = write_log(tmp_path / "access.log", host_lines("a", 400) + [
+        f'{long_token} - - [10/Oct/2025:13:20:00 +0000] "GET /a HTTP/1.1" 404 1 "-" "agent-0"\n'])
+    log_dict = parse_apache_file(log_file, detailed=detailed, approximate=approximate)
+    assert long_token in log_dict
+
+    write_partial(tmp_path / "a.part", log_dict, source="web-01")
+    header, loaded = read_partial(tmp_path / "a.part")
+
+    assert (header["source"], header["detailed"], header["approximate"]) == ("web-01", detailed, approximate)
+    assert list(loaded) == list(log_dict)
+    for ip, data in log_dict.items():
+        assert (loaded[ip]["total"], loaded[ip]["errors"]) == (data["total"], data["errors"])
+        if detailed:
+            assert loaded[ip]["window"] == data["window"]
+            assert loaded[ip]["rules"] == data["rules"]
+            assert len(loaded[ip]["paths"]) == len(data["paths"])
+    if detailed and not approximate:
+        assert summary(loaded) == summary(log_dict)
+
+
+def test_merge_is_order_independent_and_exact(tmp_path):
+
+    hosts = {host: write_log(tmp_path / f"{host}.log", host_lines(host, 300)) for host in ("a", "b", "c")}
+    partials = []
+    for host, log_file in hosts.items():
+        partials.append(tmp_path / f"{host}.part")
+        write_partial(partials[-1], parse_apache_file(log_file, detailed=True), source=host)
+
+    merged = merge_partials(partials)
+    assert list(merged) == list(merge_partials(partials[::-1]))
+    assert summary(merged) == summary(merge_partials(reversed(partials)))
+
+    # Same totals and unique paths as parsing every host's lines in one place
+    everything = write_log(tmp_path / "all.log", sorted((line for log_file in hosts.values() for line in open(log_file)),
+                                                        key=lambda line: line.split("[")[1][:20]))
+    assert summary(merged) == summary(parse_apache_file(everything, detailed=True))
+
+    # Merging a merge (a two-level reduce) gives the same result
+    write_partial(tmp_path / "ab.part", merge_partials(partials[:2]), source="ab")
+    assert summary(merge_partials([tmp_path / "ab.part", partials[2]])) == summary(merged)
+
+
+def test_merge_refuses_mixed_or_foreign_files(tmp_path):
+
+    log_file = write_log(tmp_path / "access.log", host_lines("a", 50))
+    write_partial(tmp_path / "counts.part", parse_apache_file(log_file), source="a")
+    write_partial(tmp_path / "detailed.part", parse_apache_file(log_file, detailed=True), source="b")
+    with pytest.raises(ValueError):
+        merge_partials([tmp_path / "counts.part", tmp_path / "detailed.part"])
+
+    with pytest.raises(ValueError):
+        merge_partials([log_file])
@@ -0,0 +1,55 @@
+import csv
+import os
+import subprocess
+import sys
+
+from reporting import export_to_csv, top_ips
+
+
+ANALYSER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "log_analyser.py")
+
+
+def test_top_ips_matches_a_full_sort():
+
+    log_dict = {f"10.0.0.{index}": {"total": 100, "errors": (index * 37) % 11} for index in range(200)}
+    score_dict = {ip: ((index * 13) % 17) / 100 - 0.1 for index, ip in enumerate(log_dict)}
+
+    by_errors = sorted(log_dict.items(), key=lambda item: item[1]["errors"], reverse=True)
+    assert top_ips(log_dict, score_dict, 10) == by_errors[:10]
+    assert top_ips(log_dict, score_dict) == by_errors
+
+    by_score = sorted(log_dict.items(), key=lambda item: score_dict[item[0]])
+    assert top_ips(log_dict, score_dict, 10, rank_by="score") == by_score[:10]
+
+
+def test_csv_export_streams_from_a_generator(tmp_path):
+
+    rows = ((f"10.0.0.{index}", 10, index, "N/A", "N/A", False, 0.0, "-") for index in range(50))
+    output = tmp_path / "report.csv"
+    export_to_csv(rows, output)
+
+    with open(output, newline="") as csv_file:
+        written = list(csv.reader(csv_file))
+    assert written[0][0] == "IP Address"
+    assert len(written) == 51 and written[-1][0] == "10.0.0.49"
+
+
+def test_csv_has_every_ip_in_log_order_with_or_without_top(tmp_path):
+
+    lines = []
+    for index in range(30):
+        # Later IPs have more errors, so rank order is the reverse of log order
+        lines += [f'10.0.0.{index} - - [10/Oct/2025:13:55:{second:02d} +0000] "GET /{second} HTTP/1.1" '
+                  f'{404 if second < index else 200} 512 "-" "curl/8.0"\n' for second in range(40)]
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(lines))
+
+    written = {}
+    for name, extra in (("all", []), ("top", ["--top", "5"])):
+        output = tmp_path / f"{name}.csv"
+        subprocess.run([sys.executable, ANALYSER, "-f", str(log_file), "--rules-only", "-o", str(output)] + extra,
+                       cwd=tmp_path, capture_output=True, check=True)
+        with open(output, newline="") as csv_file:
+            written[name] = [row[0] for row in list(csv.reader(csv_file))[1:]]
+
+    assert written["all"] == written["top"] == [f"10.0.0.{index}" for index in range(30)]
@@ -0,0 +1,44 @@
+from file_parser import parse_apache_file
+from sigma_rules import get_rule_set, load_rules
+
+
+def test_bundled_rules_compile():
+
+    rule_set = load_rules()
+    assert [rule.name for rule in rule_set.rules] == ["credential_stuffing", "excessive_http_errors", "web_vulnerability_scan"]
+
+    # One lookup returns every rule a line matches
+    names = [rule.name for rule in rule_set.match(b"/WP-Admin/setup.php", b"404")]
+    assert names == ["excessive_http_errors", "web_vulnerability_scan"]
+    assert rule_set.match(b"/index.html", b"200") == ()
+
+
+def test_rules_fire_from_the_parse_pass(tmp_path):
+
+    lines = []
+    for index in range(120):
+        # A scanner: 120 admin probes in two minutes
+        lines.append(f'10.0.0.9 - - [10/Oct/2025:13:{55 + index // 60}:{index % 60:02d} +0000] "GET /.env.{index} HTTP/1.1" 404 0 "-" "zgrab"\n')
+        # The same number of errors spread over two hours never fills a 10m window
+        lines.append(f'10.0.0.5 - - [10/Oct/2025:{12 + index // 60}:{index % 60:02d}:00 +0000] "GET /admin HTTP/1.1" 404 0 "-" "Mozilla"\n')
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text("".join(lines))
+
+    log_dict = parse_apache_file(log_file, detailed=True)
+    rule_set = get_rule_set()
+
+    assert rule_set.evaluate(log_dict["10.0.0.9"]) == ["excessive_http_errors", "web_vulnerability_scan"]
+    assert log_dict["10.0.0.9"]["rules"]["web_vulnerability_scan"].peak_requests == 120
+    assert rule_set.evaluate(log_dict["10.0.0.5"]) == []
+
+
+def test_path_cache_is_bounded(monkeypatch):
+
+    monkeypatch.setattr("sigma_rules.PATH_CACHE_SIZE", 100)
+    rule_set = load_rules()
+    for index in range(1000):
+        rule_set.match(f"/probe/{index}/wp-admin".encode(), b"404")
+
+    assert rule_set._path_bits.cache_info().currsize == 100
+    # Evicted paths are worked out again, with the same result
+    assert [rule.name for rule in rule_set.match(b"/probe/0/wp-admin", b"404")] == ["excessive_http_errors", "web_vulnerability_scan"]
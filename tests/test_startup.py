@@ -0,0 +1,36 @@
+import subprocess
+import sys
+
+from file_parser import parse_apache_file
+from rule_detector import detect_rule_anomalies
+from sigma_rules import get_rule_set
+
+
+HEAVY_MODULES = ("sklearn", "numpy", "pandas", "requests")
+
+
+def test_import_leaves_heavy_modules_unloaded():
+
+    # A fresh interpreter, so modules other tests imported don't count
+    code = f"import sys, log_analyser; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
+
+
+def test_rules_only_flags_rule_hits(tmp_path):
+
+    lines = []
+    for index in range(120):
+        # 120 failed logins in two minutes fires credential_stuffing
+        lines.append(f'10.0.0.9 - - [10/Oct/2025:13:{55 + index // 60}:{index % 60:02d} +0000] "POST /login HTTP/1.1" 401 0 "-" "python-requests"\n')
+        lines.append(f'10.0.0.5 - - [10/Oct/2025:13:{55 + index // 60}:{index % 60:02d} +0000] "GET /index.html HTTP/1.1" 200 512 "-" "Mozilla"\n')
+    log_file = tmp_path / "test_access.log"
+    log_file.write_text("".join(lines))
+
+    log_dict = parse_apache_file(log_file, detailed=True)
+    anomalous_ips, score_dict = detect_rule_anomalies(log_dict)
+
+    assert anomalous_ips == {"10.0.0.9"}
+    assert "credential_stuffing" in get_rule_set().evaluate(log_dict["10.0.0.9"])
+    assert score_dict["10.0.0.9"] < 0 <= score_dict["10.0.0.5"]
+    assert detect_rule_anomalies({}) == (set(), {})
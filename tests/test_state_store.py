@@ -0,0 +1,174 @@
+import gzip
+import os
+import pickle
+import random
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import state_store
+from anomaly_detector import build_features
+from file_parser import parse_apache_file, parse_log_files
+from hyperloglog import HyperLogLog
+from reporting import top_ips
+from rule_detector import detect_rule_anomalies
+from state_store import StateStore
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def flood_lines(count, ips=300, seed=7):
+    """Many IPs in random order, so cold IPs are spilled and come back later"""
+    rng = random.Random(seed)
+    lines = []
+    for index in range(count):
+        ip = f"10.0.{(address := rng.randrange(ips)) // 256}.{address % 256}"
+        status = 401 if address < 5 else rng.choice([200, 200, 404])
+        lines.append(f'{ip} - - [10/Oct/2025:13:{index // 120 % 60:02d}:{index // 2 % 60:02d} +0000] '
+                     f'"POST /login{rng.randrange(20)} HTTP/1.1" {status} {index} "-" "agent-{rng.randrange(4)}"\n')
+    return lines
+
+
+def comparable(entry):
+    return {field: (value.registers if isinstance(value, HyperLogLog) else list(value) if field in ("paths", "agents")
+                    else value) for field, value in entry.items()}
+
+
+def spilling_store(monkeypatch, detailed, approximate=False):
+    """A store that finds itself over budget at every check, with a check every few new IPs."""
+    store = StateStore(20_000, detailed=detailed, approximate=approximate)
+    monkeypatch.setattr(state_store, "CHECK_EVERY", 8)
+    monkeypatch.setattr(state_store, "MIN_CAPACITY", 16)
+    store._state_bytes = 1
+    store.check_at = 8
+    return store
+
+
+@pytest.mark.parametrize("detailed, approximate", [(False, False), (True, False), (True, True)])
+def test_spilled_parse_matches_in_memory_parse(tmp_path, monkeypatch, detailed, approximate):
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(flood_lines(6000)))
+    expected = parse_apache_file(log_file, engine="fast", detailed=detailed, approximate=approximate)
+
+    # Small blocks, so entries are checked and spilled between blocks as well as mid-block
+    monkeypatch.setattr("file_parser.STORE_BLOCK_SIZE", 4096)
+    store = spilling_store(monkeypatch, detailed, approximate)
+
+    result = parse_log_files(str(log_file), detailed=detailed, approximate=approximate, store=store)
+    assert result is store and store.spilled and store.capacity < 300
+
+    assert len(store) == len(expected) and list(store) == list(expected)
+    assert [(ip, comparable(entry)) for ip, entry in store.items()] == \
+           [(ip, comparable(entry)) for ip, entry in expected.items()]
+    ip = next(iter(expected))
+    assert comparable(store[ip]) == comparable(expected[ip]) and "192.0.2.1" not in store
+
+    spill_dir = store._spill_dir.name
+    store.close()
+    assert not os.path.exists(spill_dir)
+
+
+def test_compressed_logs_merge_like_an_in_memory_parse(tmp_path, monkeypatch):
+    log_file = tmp_path / "access.log.gz"
+    with gzip.open(log_file, "wt") as compressed:
+        compressed.write("".join(flood_lines(3000)))
+    expected = parse_apache_file(log_file, detailed=True)
+
+    store = spilling_store(monkeypatch, detailed=True)
+    parse_log_files(str(log_file), detailed=True, store=store)
+
+    assert store.spilled
+    assert {ip: comparable(entry) for ip, entry in store.items()} == {ip: comparable(entry) for ip, entry in expected.items()}
+    store.close()
+
+
+def test_scoring_and_ranking_read_each_spilled_entry_once(tmp_path, monkeypatch):
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(flood_lines(4000)))
+    expected = parse_apache_file(log_file, detailed=True)
+
+    store = parse_log_files(str(log_file), detailed=True, store=spilling_store(monkeypatch, detailed=True))
+    assert store.spilled
+    loads = []
+    monkeypatch.setattr(state_store, "pickle", SimpleNamespace(
+        loads=lambda data: loads.append(data) or pickle.loads(data), dumps=pickle.dumps, HIGHEST_PROTOCOL=pickle.HIGHEST_PROTOCOL))
+
+    ips, features, names = build_features(store)
+    expected_ips, expected_features, expected_names = build_features(expected)
+    assert (ips, names) == (expected_ips, expected_names) and np.array_equal(features, expected_features)
+    assert len(loads) == len(store)
+
+    loads.clear()
+    assert detect_rule_anomalies(store) == detect_rule_anomalies(expected)
+    assert len(loads) == len(store)
+
+    # Ranking reads only the entries it returns
+    _, score_dict = detect_rule_anomalies(expected)
+    for rank_by in ("errors", "score"):
+        loads.clear()
+        top = top_ips(store, score_dict, 10, rank_by=rank_by)
+        assert [(ip, comparable(entry)) for ip, entry in top] == \
+               [(ip, comparable(entry)) for ip, entry in top_ips(expected, score_dict, 10, rank_by=rank_by)]
+        assert len(loads) == 10
+    store.close()
+
+
+def test_within_budget_nothing_is_spilled(tmp_path):
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(flood_lines(500)))
+
+    store = parse_log_files(str(log_file), detailed=True, store=StateStore(10_000, detailed=True))
+    assert not store.spilled and store.capacity is None
+    assert dict(store.items()).keys() == parse_apache_file(log_file, detailed=True).keys()
+    store.close()
+
+
+def test_tight_budget_spills_each_ip_a_few_times(tmp_path):
+    # Each IP is busy for a short stretch of the log, as in real traffic
+    rng = random.Random(3)
+    lines = [f'10.0.{(address := min(2999, index // 10 + rng.randrange(20))) // 256}.{address % 256} - - '
+             f'[10/Oct/2025:13:{index // 600 % 60:02d}:{index // 10 % 60:02d} +0000] '
+             f'"GET /page{rng.randrange(50)} HTTP/1.1" 200 {index} "-" "agent"\n' for index in range(30_000)]
+    log_file = tmp_path / "access.log"
+    log_file.write_text("".join(lines))
+
+    # About 1 MB for per-IP state, measured from the entries rather than the process
+    budget = state_store.resident_memory_mb() + state_store.HEADROOM_MB + 1
+    store = parse_log_files(str(log_file), detailed=True, store=StateStore(budget, detailed=True))
+
+    assert store.spilled and store.capacity >= state_store.MIN_CAPACITY
+    assert store.spilled_ips <= 3 * len(store)
+    assert list(store) == list(parse_apache_file(log_file, detailed=True))
+    store.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads the peak from /proc")
+def test_peak_memory_stays_within_budget(tmp_path):
+    # A flood of 60k IPs over 20k distinct paths: about 100 MB when parsed in memory
+    rng = random.Random(5)
+    log_file = tmp_path / "flood.log"
+    log_file.write_text("".join(
+        f'10.0.{(address := rng.randrange(60_000)) >> 8}.{address & 255} - - '
+        f'[10/Oct/2025:13:{index // 2000 % 60:02d}:{index // 40 % 60:02d} +0000] '
+        f'"GET /item/{rng.randrange(20_000)} HTTP/1.1" 404 {index} "-" "agent-{rng.randrange(50)}"\n'
+        for index in range(80_000)))
+
+    # A fresh process, so the peak is this parse's own (VmHWM, as ru_maxrss carries over from the parent
+    # through fork and exec); 8 MB for the per-IP state and intern tables
+    code = ("import re, sys, state_store\n"
+            "from file_parser import parse_log_files\n"
+            "budget = state_store.resident_memory_mb() + state_store.HEADROOM_MB + 8\n"
+            "store = parse_log_files(sys.argv[1], detailed=True, store=state_store.StateStore(budget, detailed=True))\n"
+            "peak = int(re.search(r'VmHWM:\\s+(\\d+)', open('/proc/self/status').read()).group(1)) / 1024\n"
+            "print(store.spilled, budget, peak)\n")
+    result = subprocess.run([sys.executable, "-c", code, str(log_file)], cwd=REPO, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    spilled, budget, peak = result.stdout.split()
+    assert spilled == "True" and float(peak) <= float(budget)
+
+
+def test_budget_below_current_memory_is_refused():
+    with pytest.raises(ValueError, match="no room"):
+        StateStore(1)
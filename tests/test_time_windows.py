@@ -0,0 +1,72 @@
+import pickle
+import random
+
+from time_windows import BUCKET_SECONDS, LATE_BUCKETS, WINDOW_SECONDS, SlidingWindow
+
+
+def test_burst_peaks_higher_than_the_same_requests_spread_out():
+
+    burst, slow = SlidingWindow(), SlidingWindow()
+    for index in range(100):
+        burst.add(1_000_000 + index, is_error=True)
+        slow.add(1_000_000 + index * 3600, is_error=True)
+
+    assert (burst.peak_requests, burst.peak_errors) == (100, 100)
+    assert (slow.peak_requests, slow.peak_errors) == (1, 1)
+
+    # Memory is the minutes an IP was active in, but only at the two edges of its traffic
+    steady = SlidingWindow()
+    for index in range(100):
+        steady.add(1_000_000 + index * BUCKET_SECONDS, is_error=False)
+    assert steady.peak_requests == steady.slots
+    bound = 3 * (steady.slots + LATE_BUCKETS)
+    assert len(burst.buckets) == 3 and len(slow.buckets) <= bound and len(steady.buckets) <= bound
+
+
+def fill(timestamps):
+    window = SlidingWindow()
+    for timestamp in timestamps:
+        window.add(timestamp, is_error=timestamp % 3 == 0)
+    return window
+
+
+def test_merging_consecutive_stretches_matches_one_pass():
+
+    rng = random.Random(3)
+    timestamps = sorted(1_000_000 + rng.randrange(4 * 3600) for _ in range(3000))
+    whole = fill(timestamps)
+    assert whole.peak_requests > whole.peak_errors > 0
+    assert len(whole.buckets) <= 3 * (whole.slots + LATE_BUCKETS)
+
+    # Consecutive stretches longer than the window, each merged next to one already in
+    cuts = [0, 700, 2200, 3000]
+    stretches = [fill(timestamps[start:end]) for start, end in zip(cuts, cuts[1:])]
+    for order in ([0, 1, 2], [2, 1, 0], [1, 0, 2]):
+        merged = SlidingWindow()
+        for index in order:
+            merged.merge(stretches[index])
+        assert merged == whole
+    assert pickle.loads(pickle.dumps(whole)) == whole
+
+    # Lines a little out of order, or in reverse, are still exact
+    late = sorted(timestamps, key=lambda timestamp: timestamp + rng.randrange(LATE_BUCKETS * BUCKET_SECONDS))
+    assert late != timestamps
+    assert fill(late) == whole == fill(reversed(timestamps))
+
+    # Interleaved, as with hosts covering the same hours: the peaks are a lower bound
+    merged = fill(timestamps[::2])
+    merged.merge(fill(timestamps[1::2]))
+    assert fill(timestamps[::2]).peak_requests <= merged.peak_requests <= whole.peak_requests
+
+
+def test_forgetting_old_buckets_keeps_the_peaks():
+
+    timestamps = [1_000_000 + index * 5 for index in range(2000)] + [1_000_000 + 30_000] * 3
+    whole = fill(timestamps)
+
+    window = fill(timestamps[:1000])
+    window.forget_before((1_000_000 + 1000 * 5) // BUCKET_SECONDS)
+    assert len(window.buckets) < WINDOW_SECONDS // BUCKET_SECONDS
+    for timestamp in timestamps[1000:]:
+        window.add(timestamp, is_error=timestamp % 3 == 0)
+    assert (window.peak_requests, window.peak_errors) == (whole.peak_requests, whole.peak_errors)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from measure_performance import calculate_metrics
+from tune_threshold import labelled_scores, roc_sweep
+
+
+def test_sweep_matches_per_threshold_metrics():
+
+    rng = np.random.default_rng(3)
+    ips = [f"10.0.0.{index}" for index in range(200)]
+    scores = np.round(rng.normal(0, 0.1, len(ips)), 2)  # Rounded, so there are ties
+    ground_truth = {ip: "ATTACK" if rng.random() < 0.1 else "BENIGN" for ip in ips}
+    ground_truth["192.0.2.1"] = "ATTACK"  # Labelled but never seen in the log
+
+    _, matched, is_attack = labelled_scores(ips, scores, ground_truth)
+    curve = roc_sweep(matched, is_attack)
+    score_dict = dict(zip(ips, scores))
+
+    # Every row agrees with flagging `score < threshold` the slow way
+    for threshold, tp, fp, tpr, fpr in zip(curve["thresholds"], curve["tp"], curve["fp"], curve["tpr"], curve["fpr"]):
+        predictions = {ip: score_dict.get(ip, np.inf) < threshold for ip in ground_truth}
+        metrics = calculate_metrics(predictions, ground_truth)
+        assert (tp, fp) == (metrics["true_positives"], metrics["false_positives"])
+        assert tpr * 100 == pytest.approx(metrics["true_positive_rate"])
+        assert fpr * 100 == pytest.approx(metrics["false_positive_rate"])
+
+    assert len(curve["thresholds"]) == len(np.unique(scores)) + 1
+    assert curve["tp"][-1] == curve["total_attacks"] - 1
+
+
+def test_sweep_of_a_perfect_ranking():
+
+    curve = roc_sweep([-0.3, -0.2, 0.1, 0.2], [True, True, False, False])
+    assert curve["roc_auc"] == pytest.approx(1.0)
+    assert curve["average_precision"] == pytest.approx(1.0)
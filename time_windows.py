@@ -0,0 +1,162 @@
+from array import array
+from bisect import bisect_left
+
+
+# The Sigma rules count over 5-10 minutes; a 5 minute window in 1 minute buckets
+BUCKET_SECONDS = 60
+WINDOW_SECONDS = 300
+# Apache logs a request when it completes, so an IP's lines can arrive slightly out of
+# order; lines up to this many buckets behind its newest one are still counted exactly
+LATE_BUCKETS = 2
+
+
+class SlidingWindow:
+    """
+    Per-bucket request/error counts for one IP, giving the busiest `slots` consecutive
+    buckets (WINDOW_SECONDS by default) seen so far: peak_requests / peak_errors.
+
+    Only buckets with requests are kept, and only at the two edges of the IP's traffic:
+    the first and the last `slots + LATE_BUCKETS` buckets' worth of time. As lines move
+    past the buckets in the middle, the windows they were part of are settled into
+    settled_requests / settled_errors and the buckets are dropped (in batches, once the
+    IP holds 3 * (slots + LATE_BUCKETS) of them), so memory per IP is bounded however
+    long the IP stays active.
+
+    The edges let merge() join two stretches of the same IP's traffic that follow each
+    other in time (worker chunks, checkpoint resumes, follow polls) exactly, in either
+    order. Lines more than LATE_BUCKETS behind the newest, and stretches that overlap in
+    time (e.g. partials from hosts covering the same hours), are still counted, but only
+    against the buckets that are kept, so the peaks are then a lower bound.
+
+    Long-running state can also drop old buckets outright with forget_before().
+    """
+
+    __slots__ = ("slots", "buckets", "requests", "errors", "settled_requests", "settled_errors", "_peaks")
+
+    def __init__(self, slots: int = WINDOW_SECONDS // BUCKET_SECONDS):
+        self.slots = slots
+        self.buckets = array("q")  # Sorted bucket numbers (epoch seconds // BUCKET_SECONDS)
+        self.requests = array("I")
+        self.errors = array("I")
+        self.settled_requests = 0  # Peaks among buckets that have been dropped
+        self.settled_errors = 0
+        self._peaks = None
+
+    def add(self, timestamp: float, is_error: bool) -> None:
+        """Counts one request made at `timestamp` (epoch seconds)."""
+        self.add_counts(int(timestamp) // BUCKET_SECONDS, 1, 1 if is_error else 0)
+
+    def add_counts(self, bucket: int, requests: int, errors: int) -> None:
+        """Counts `requests` / `errors` in a bucket."""
+        buckets = self.buckets
+        self._peaks = None
+
+        # Almost always the newest bucket
+        if buckets and buckets[-1] == bucket:
+            self.requests[-1] += requests
+            self.errors[-1] += errors
+            return
+        # Trimmed in batches, so a steadily active IP isn't re-settled every minute
+        if self._add_bucket(bucket, requests, errors) and len(buckets) > 3 * (self.slots + LATE_BUCKETS):
+            self._settle_middle()
+
+    @property
+    def peak_requests(self) -> int:
+        return self._get_peaks()[0]
+
+    @property
+    def peak_errors(self) -> int:
+        return self._get_peaks()[1]
+
+    def merge(self, other: "SlidingWindow") -> None:
+        """Folds in the counts of another stretch of the same IP's traffic (exact if the two follow each other in time)."""
+        for bucket, requests, errors in zip(other.buckets, other.requests, other.errors):
+            self._add_bucket(bucket, requests, errors)
+        self.settled_requests = max(self.settled_requests, other.settled_requests)
+        self.settled_errors = max(self.settled_errors, other.settled_errors)
+        self._peaks = None
+        self._settle_middle()
+
+    def forget_before(self, bucket: int) -> None:
+        """
+        Drops the buckets that no window ending at `bucket` or later can include, keeping
+        their peaks. Exact as long as no more lines arrive for before `bucket`.
+        """
+        cut = bisect_left(self.buckets, bucket - self.slots + 1)
+        if cut:
+            self.settled_requests, self.settled_errors = self._get_peaks()
+            del self.buckets[:cut], self.requests[:cut], self.errors[:cut]
+
+    def _add_bucket(self, bucket, requests, errors):
+        """Adds counts to a bucket, inserting it if needed. Returns True if the bucket is new."""
+        buckets = self.buckets
+        if not buckets or bucket > buckets[-1]:
+            buckets.append(bucket)
+            self.requests.append(requests)
+            self.errors.append(errors)
+            return True
+
+        index = bisect_left(buckets, bucket)
+        if buckets[index] == bucket:
+            self.requests[index] += requests
+            self.errors[index] += errors
+            return False
+        buckets.insert(index, bucket)
+        self.requests.insert(index, requests)
+        self.errors.insert(index, errors)
+        return True
+
+    def _edges(self):
+        """(head_end, tail_start): the buckets before head_end and from tail_start on are the two edges."""
+        buckets = self.buckets
+        if not buckets:
+            return 0, 0
+        edge = self.slots + LATE_BUCKETS
+        head_end = bisect_left(buckets, buckets[0] + edge)
+        return head_end, max(head_end, bisect_left(buckets, buckets[-1] - edge + 1, head_end))
+
+    def _settle_middle(self):
+        """Settles the peaks, then drops the buckets between the two edges."""
+        head_end, tail_start = self._edges()
+        if tail_start > head_end:
+            # Every window that includes a middle bucket is complete: its buckets are older than any line still exact
+            self.settled_requests, self.settled_errors = self._get_peaks()
+            del self.buckets[head_end:tail_start], self.requests[head_end:tail_start], self.errors[head_end:tail_start]
+
+    def _get_peaks(self):
+        if self._peaks is None:
+            buckets, requests, errors = self.buckets, self.requests, self.errors
+            peak_requests, peak_errors = self.settled_requests, self.settled_errors
+            request_sum = error_sum = start = 0
+            for index, bucket in enumerate(buckets):
+                request_sum += requests[index]
+                error_sum += errors[index]
+                # Buckets that have slid out of the window ending here
+                while buckets[start] <= bucket - self.slots:
+                    request_sum -= requests[start]
+                    error_sum -= errors[start]
+                    start += 1
+                if request_sum > peak_requests:
+                    peak_requests = request_sum
+                if error_sum > peak_errors:
+                    peak_errors = error_sum
+            self._peaks = (peak_requests, peak_errors)
+        return self._peaks
+
+    def __getstate__(self):
+        return (self.slots, self.buckets, self.requests, self.errors, self.settled_requests, self.settled_errors)
+
+    def __setstate__(self, state):
+        self.slots, self.buckets, self.requests, self.errors, self.settled_requests, self.settled_errors = state
+        self._peaks = None
+
+    def __eq__(self, other):
+        # Middle buckets may or may not have been dropped yet; only the edges carry state that matters
+        return (isinstance(other, SlidingWindow) and self.slots == other.slots
+                and (self.peak_requests, self.peak_errors) == (other.peak_requests, other.peak_errors)
+                and self._edge_counts() == other._edge_counts())
+
+    def _edge_counts(self):
+        head_end, tail_start = self._edges()
+        return [(self.buckets[index], self.requests[index], self.errors[index])
+                for index in (*range(head_end), *range(tail_start, len(self.buckets)))]
@@ -1,18 +1,167 @@
+import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 from file_parser import parse_apache_file
-from anomaly_detector import detect_anomalies
+from anomaly_detector import build_features, detect_anomalies, fit_forest, score_features
 from measure_performance import load_ground_truth, calculate_metrics
 
 
+CURVE_FILE = "threshold_curve.csv"
+
+
+def roc_sweep(scores: np.ndarray, is_attack: np.ndarray) -> dict:
+    """
+    TPR, FPR and precision at every distinct threshold in one vectorised pass.
+
+    The scores are sorted once and the attack / benign labels cumulatively summed, so
+    row k counts the IPs flagged by `score < thresholds[k]`. Each threshold sits halfway
+    between two neighbouring distinct scores, which makes it usable as-is with
+    detect_anomalies. Row 0 flags nothing and the last row every scored IP.
+
+    Returns:
+        dict of equal-length NumPy arrays (thresholds, tp, fp, tpr, fpr, precision),
+        plus the ROC AUC and average precision as floats.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    is_attack = np.asarray(is_attack, dtype=bool)
+    total_attacks = int(is_attack.sum())
+    total_benign = len(is_attack) - total_attacks
+
+    # IPs without a score (+inf) count towards the totals but are never flagged
+    scored = np.isfinite(scores)
+    order = np.argsort(scores[scored], kind="stable")
+    sorted_scores = scores[scored][order]
+    sorted_attacks = is_attack[scored][order]
+
+    # Last position of each run of equal scores: the threshold just above it flags everything up to there
+    ends = np.flatnonzero(np.append(sorted_scores[1:] != sorted_scores[:-1], True)) if len(sorted_scores) else np.array([], int)
+    tp = np.concatenate(([0], np.cumsum(sorted_attacks)[ends]))
+    fp = np.concatenate(([0], np.cumsum(~sorted_attacks)[ends]))
+
+    if len(ends):
+        midpoints = (sorted_scores[ends[:-1]] + sorted_scores[ends[:-1] + 1]) / 2
+        thresholds = np.concatenate(([sorted_scores[0]], midpoints, [np.nextafter(sorted_scores[-1], np.inf)]))
+    else:
+        thresholds = np.array([0.0])
+
+    tpr = tp / total_attacks if total_attacks else np.zeros(len(tp))
+    fpr = fp / total_benign if total_benign else np.zeros(len(fp))
+    flagged = tp + fp
+    precision = np.divide(tp, flagged, out=np.ones(len(tp)), where=flagged > 0)
+
+    return {
+        "thresholds": thresholds, "tp": tp, "fp": fp, "tpr": tpr, "fpr": fpr, "precision": precision,
+        "roc_auc": float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)),
+        "average_precision": float(np.sum(np.diff(tpr) * precision[1:])),
+        "total_attacks": total_attacks, "total_benign": total_benign,
+    }
+
+
+def labelled_scores(ips, scores, ground_truth):
+    """
+    Lines the scores up with the ground truth. Labelled IPs that never appear in the log
+    are never flagged, so they are kept as +inf (counted, but never below a threshold).
+    """
+    position = {ip: index for index, ip in enumerate(ips)}
+    labelled = list(ground_truth)
+    is_attack = np.fromiter((ground_truth[ip] == "ATTACK" for ip in labelled), dtype=bool, count=len(labelled))
+    matched = np.fromiter((scores[position[ip]] if ip in position else np.inf for ip in labelled),
+                          dtype=np.float64, count=len(labelled))
+    return labelled, matched, is_attack
+
+
+def score_with_seed(features, seed, jobs=1):
+    """Fits and scores the forest with one random seed (a worker of the --seeds sweep)."""
+    forest = fit_forest(features, jobs, seed)
+    return seed, score_features(forest, features, jobs=jobs)
+
+
+def write_curve(curves, filepath):
+    """Writes one row per (seed, threshold) of every sweep."""
+    with open(filepath, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Seed", "Threshold", "True Positives", "False Positives", "TPR", "FPR", "Precision"])
+        for seed, curve in curves.items():
+            for row in zip(curve["thresholds"], curve["tp"], curve["fp"], curve["tpr"], curve["fpr"], curve["precision"]):
+                threshold, tp, fp, tpr, fpr, precision = row
+                writer.writerow([seed, f"{threshold:.6f}", int(tp), int(fp), f"{tpr:.4f}", f"{fpr:.4f}", f"{precision:.4f}"])
+
+
+def sweep(args):
+    """--sweep: the full ROC / PR curve for each model seed, plus how stable the scores are between seeds."""
+    print("[*] Loading test dataset...")
+    log_dict = parse_apache_file(args.log, detailed=True)
+    ground_truth = load_ground_truth(args.labels)
+    ips, features, _ = build_features(log_dict)
+
+    # Each seed is fitted and scored in its own process; the features are sent once per seed
+    print(f"[*] Scoring with {len(args.seeds)} seed(s) on {args.jobs} process(es)...")
+    if args.jobs > 1 and len(args.seeds) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            scored = dict(pool.map(score_with_seed, [features] * len(args.seeds), args.seeds))
+    else:
+        scored = dict(score_with_seed(features, seed) for seed in args.seeds)
+
+    curves = {}
+    matched_scores = []
+    for seed in args.seeds:
+        _, matched, is_attack = labelled_scores(ips, scored[seed], ground_truth)
+        curves[seed] = roc_sweep(matched, is_attack)
+        matched_scores.append(matched)
+
+    write_curve(curves, args.curve)
+
+    print("\n" + "=" * 70)
+    print("THRESHOLD SWEEP RESULTS")
+    print("=" * 70)
+    print(f"{'Seed':<8} {'ROC AUC':<9} {'Avg Prec':<10} {'Best Threshold':<16} {'TPR':<8} {'FPR'}")
+    print("-" * 70)
+    for seed, curve in curves.items():
+        # Youden's J: the threshold furthest above the diagonal
+        best = int(np.argmax(curve["tpr"] - curve["fpr"]))
+        print(f"{seed:<8} {curve['roc_auc']:<9.3f} {curve['average_precision']:<10.3f} {curve['thresholds'][best]:<16.4f} "
+              f"{curve['tpr'][best] * 100:<8.1f} {curve['fpr'][best] * 100:.1f}")
+    print("=" * 70)
+
+    if len(args.seeds) > 1:
+        stacked = np.vstack(matched_scores)
+        finite = np.isfinite(stacked).all(axis=0)
+        spread = stacked[:, finite].std(axis=0)
+        aucs = np.array([curve["roc_auc"] for curve in curves.values()])
+        print(f"\nScore stability across seeds: per-IP std mean {spread.mean():.4f}, max {spread.max():.4f}; "
+              f"ROC AUC {aucs.mean():.3f} ± {aucs.std():.3f}")
+
+    print(f"\n[+] Curve for {len(curves)} seed(s) written to {args.curve}")
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Threshold tuning against the labelled test dataset.")
+    parser.add_argument("--sweep", action='store_true', help="Compute TPR/FPR/precision at every distinct threshold and write the ROC/PR curve.")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[42], help="Optional: Model seeds for --sweep (default: 42).")
+    parser.add_argument("--jobs", type=int, default=1, help="Optional: Processes fitting the --seeds in parallel.")
+    parser.add_argument("--curve", default=CURVE_FILE, help=f"Optional: Where --sweep writes the curve (default: {CURVE_FILE}).")
+    parser.add_argument("--log", default="test_access.log", help="Optional: Labelled log file (default: test_access.log).")
+    parser.add_argument("--labels", default="ground_truth_labels.csv", help="Optional: Ground truth CSV (default: ground_truth_labels.csv).")
+    args = parser.parse_args()
+
+    if args.sweep:
+        args.jobs = min(args.jobs, os.cpu_count() or 1, len(args.seeds))
+        sweep(args)
+        return
+
     print("[*] Loading test dataset...")
-    log_dict = parse_apache_file("test_access.log")
-    ground_truth = load_ground_truth("ground_truth_labels.csv")
+    log_dict = parse_apache_file(args.log, detailed=True)
+    ground_truth = load_ground_truth(args.labels)
 
     # Get scores once
     _, score_dict = detect_anomalies(log_dict, threshold=-999)  # Get all scores
 
     # Test different thresholds
-    thresholds = [0.0, -0.01, -0.02, -0.03, -0.04, -0.05, -0.06, -0.07, -0.08]
+    thresholds = [0.0, -0.02, -0.04, -0.05, -0.06, -0.08, -0.10, -0.12, -0.14]
 
     print("\n" + "=" * 70)
     print("THRESHOLD TUNING RESULTS")
@@ -37,4 +186,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()